@@ -42,6 +42,7 @@ class Command(BaseCommand):
             ('statistics:view', '查看统计', 'statistics'),
             # 月底结存
             ('monthly_report:view', '查看月报', 'monthly_report'),
+            ('monthly_report:close', '结账/反结账', 'monthly_report'),
             # 用户管理
             ('user_manage:view', '查看用户', 'user_manage'),
             ('user_manage:create', '创建用户', 'user_manage'),
@@ -97,7 +98,7 @@ class Command(BaseCommand):
         finance_perms = [
             'stock_query:view', 'stock_warning:view',
             'stock_count:view',
-            'statistics:view', 'monthly_report:view',
+            'statistics:view', 'monthly_report:view', 'monthly_report:close',
         ]
         # 老板权限（全部）
         boss_perms = [
@@ -107,7 +108,7 @@ class Command(BaseCommand):
             'stock_warning:view', 'stock_warning:check',
             'stock_count:view', 'stock_count:create',
             'stock_count:submit', 'stock_count:complete',
-            'statistics:view', 'monthly_report:view',
+            'statistics:view', 'monthly_report:view', 'monthly_report:close',
             'user_manage:view', 'user_manage:create',
             'user_manage:update', 'user_manage:delete',
             'material:view', 'material:create', 'material:update',
@@ -4,9 +4,10 @@ from .models import Stock, StockIn
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
-    list_display = ['material_code', 'material_name', 'current_stock', 'max_stock', 'min_stock', 'stock_value', 'updated_at']
+    list_display = ['material_code', 'material_name', 'current_stock', 'max_stock', 'min_stock', 'stock_status', 'stock_value', 'updated_at']
     search_fields = ['material_code', 'material_name']
-    list_filter = ['created_at']
+    list_filter = ['stock_status', 'created_at']
+    readonly_fields = ['stock_status']
 
 
 @admin.register(StockIn)
@@ -5,3 +5,17 @@ class StockConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.stock'
     verbose_name = '库存管理'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save, pre_delete
+
+        from .autocomplete import material_deleted, material_saved
+        from .models import Stock
+        from .triggers import configure_connection, resume_after_stock_delete, suspend_for_stock_delete
+
+        connection_created.connect(configure_connection, dispatch_uid='stock_balance_triggers')
+        pre_delete.connect(suspend_for_stock_delete, sender=Stock, dispatch_uid='stock_balance_triggers')
+        post_delete.connect(resume_after_stock_delete, sender=Stock, dispatch_uid='stock_balance_triggers')
+        post_save.connect(material_saved, sender=Stock, dispatch_uid='material_autocomplete')
+        post_delete.connect(material_deleted, sender=Stock, dispatch_uid='material_autocomplete')
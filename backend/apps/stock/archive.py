@@ -0,0 +1,286 @@
+"""
+出入库记录冷归档
+
+多年前的出入库记录按月、按方向流式写入 gzip 压缩的 JSON Lines 文件（settings.STOCK_ARCHIVE_DIR，
+如 stock_in/202301.jsonl.gz），每批写入后在同一事务中从出入库表删除，文件校验后登记在 MovementArchive，
+同时写入按日、按物料的汇总行（ArchivedMovementSummary），趋势、排行等按出入库记录统计的报表
+合并汇总行后结果不变；余额、时点余额与月报基于流水账和月结快照，不受归档影响。
+
+只能归档已结账的月份：期间锁保证归档后该期间不再有新增、修改或撤销，已归档的月份也不能反结账。
+因此归档记录的业务时间都早于库中记录，列表接口的 include_archived 模式按时间倒序
+先列出库中记录，再依次扫描归档文件；本页取满后总数取自汇总行，筛选条件无法用汇总行表达时按抽样估算。
+"""
+import gzip
+import hashlib
+import json
+from collections import defaultdict
+from datetime import time
+from decimal import Decimal
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .closing import month_of, month_range
+from .models import ArchivedMovementSummary, ClosedPeriod, MovementArchive, StockIn, StockOut
+from .pagination import keyset_filter
+from .triggers import balance_triggers_suspended
+
+# 方向 -> (模型, 业务时间字段, 数量字段, 价值字段)
+ARCHIVED_MOVEMENTS = {
+    'in': (StockIn, 'in_time', 'in_quantity', 'in_value'),
+    'out': (StockOut, 'out_time', 'out_quantity', 'out_value'),
+}
+
+# 从数据库流式读取、删除记录时每批的行数
+ARCHIVE_CHUNK_SIZE = 2000
+
+# include_archived 列表本页取满后，为估算总数继续扫描的归档记录数上限
+ARCHIVE_COUNT_SAMPLE_ROWS = 1000
+
+
+def archive_root():
+    return Path(getattr(settings, "STOCK_ARCHIVE_DIR", Path(settings.BASE_DIR) / "archive"))
+
+
+def archive_month(direction, month):
+    """
+    归档 month 月 direction 方向的出入库记录，返回 MovementArchive；已归档时返回 None
+
+    在一个事务中锁定期间后，按业务时间倒序以键集分批读取记录写入临时文件，每批写入后按该批的键集范围删除；
+    写完回读校验文件行数与累计删除行数一致，再登记文件、写入汇总行。任一批删除行数不符（期间被反结账后
+    又有改动）或校验失败时事务回滚、记录保留，并删除文件。月份须已结账，否则抛出 ValueError。
+    """
+    if MovementArchive.objects.filter(direction=direction, month=month).exists():
+        return None
+    if not ClosedPeriod.objects.filter(month=month, status='closed').exists():
+        raise ValueError(f"{month:%Y-%m} 尚未结账，不能归档")
+
+    model, time_field, quantity_field, value_field = ARCHIVED_MOVEMENTS[direction]
+    start, end = month_range(month)
+    records = model.objects.filter(**{f'{time_field}__gte': start, f'{time_field}__lt': end})
+    ordering = (f'-{time_field}', '-pk')
+    fields = [field.attname for field in model._meta.concrete_fields]
+    relative = f"{model._meta.db_table}/{month:%Y%m}.jsonl.gz"
+    path = archive_root() / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + '.tmp')
+
+    summaries = defaultdict(lambda: {'count': 0, 'quantity': 0, 'value': Decimal('0')})
+    try:
+        # 归档的记录由按日汇总继续计入余额，删除时不冲销余额
+        with balance_triggers_suspended():
+            # 与反结账互斥：反结账锁定期间行后才删除期间
+            locked = ClosedPeriod.objects.select_for_update(
+                no_key=connection.features.has_select_for_no_key_update,
+            ).filter(month=month, status='closed')
+            if not locked.exists():
+                raise ValueError(f"{month:%Y-%m} 已反结账，取消归档")
+
+            archived, boundary = 0, None
+            with gzip.open(temporary, 'wt', encoding='utf-8') as fh:
+                while True:
+                    batch = records if boundary is None else records.filter(keyset_filter(ordering, boundary))
+                    rows = list(batch.order_by(*ordering).values(*fields)[:ARCHIVE_CHUNK_SIZE])
+                    if not rows:
+                        break
+                    for row in rows:
+                        fh.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                        summary = summaries[(timezone.localtime(row[time_field]).date(), row['stock_id'])]
+                        summary['count'] += 1
+                        summary['quantity'] += row[quantity_field]
+                        summary['value'] += row[value_field]
+                        summary['material_code'], summary['material_name'] = row['material_code'], row['material_name']
+                    # 本批的键集范围：上一批末行之后、本批末行（含）之前
+                    last = (rows[-1][time_field], rows[-1]['id'])
+                    written = batch.filter(**{f'{time_field}__gte': last[0]}).exclude(keyset_filter(ordering, last))
+                    if written.delete()[0] != len(rows):
+                        raise RuntimeError(f"{month:%Y-%m} 的记录在归档期间发生变化")
+                    archived += len(rows)
+                    boundary = last
+            checksum, row_count = _verify(temporary)
+            if row_count != archived:
+                raise RuntimeError(f"归档文件 {relative} 校验失败")
+            if records.exists():
+                raise RuntimeError(f"{month:%Y-%m} 的记录在归档期间发生变化")
+            temporary.replace(path)
+
+            archive = MovementArchive.objects.create(
+                direction=direction, month=month, path=relative, row_count=row_count, checksum=checksum,
+            )
+            ArchivedMovementSummary.objects.bulk_create([
+                ArchivedMovementSummary(direction=direction, day=day, stock_id=stock_id, **summary)
+                for (day, stock_id), summary in summaries.items()
+            ], batch_size=1000)
+    except BaseException:
+        temporary.unlink(missing_ok=True)
+        if not MovementArchive.objects.filter(direction=direction, month=month).exists():
+            path.unlink(missing_ok=True)
+        raise
+    return archive
+
+
+def _verify(path):
+    """归档文件的 SHA-256 与行数（逐块读取，不整体载入内存）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        row_count = sum(1 for _ in fh)
+    return digest.hexdigest(), row_count
+
+
+def archive_movements(until):
+    """归档 until 月（含）及之前全部已结账月份的出入库记录，返回新建的 MovementArchive 列表"""
+    archives = []
+    for month in ClosedPeriod.objects.filter(month__lte=until, status='closed').order_by('month').values_list('month', flat=True):
+        for direction in ARCHIVED_MOVEMENTS:
+            archive = archive_month(direction, month)
+            if archive is not None:
+                archives.append(archive)
+    return archives
+
+
+def iter_archived(direction, start=None, end=None):
+    """
+    按业务时间倒序逐条读出已归档的记录（未保存的模型实例，archived 属性为 True）
+
+    start / end 为带时区的时间，只扫描与 [start, end] 相交月份的归档文件，月内记录由调用方过滤。
+    """
+    model = ARCHIVED_MOVEMENTS[direction][0]
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    for relative in _archives_between(direction, start, end).order_by('-month').values_list('path', flat=True):
+        with gzip.open(archive_root() / relative, 'rt', encoding='utf-8') as fh:
+            for line in fh:
+                row = json.loads(line)
+                record = model(**{name: fields[name].to_python(value) for name, value in row.items()})
+                record.archived = True
+                yield record
+
+
+def _archives_between(direction, start, end):
+    """与 [start, end] 相交月份的归档文件"""
+    archives = MovementArchive.objects.filter(direction=direction)
+    if start is not None:
+        archives = archives.filter(month__gte=month_of(start))
+    if end is not None:
+        archives = archives.filter(month__lte=month_of(end))
+    return archives
+
+
+def archived_filter(time_field, search='', exact=None, contains=None, start=None, end=None):
+    """
+    与列表接口筛选条件一致的归档记录判断函数
+
+    search 匹配物料编号或名称，exact / contains 为 {字段: 值}（精确匹配 / 不区分大小写包含），
+    start / end 为业务时间上下限（含）。
+    """
+    search = search.lower()
+    exact = {name: value for name, value in (exact or {}).items() if value}
+    contains = {name: value.lower() for name, value in (contains or {}).items() if value}
+
+    def matches(record):
+        if search and search not in record.material_code.lower() and search not in record.material_name.lower():
+            return False
+        if any(getattr(record, name) != value for name, value in exact.items()):
+            return False
+        if any(value not in getattr(record, name).lower() for name, value in contains.items()):
+            return False
+        moment = getattr(record, time_field)
+        return (start is None or moment >= start) and (end is None or moment <= end)
+    return matches
+
+
+def archived_summaries(direction, search='', start=None, end=None):
+    """
+    与列表筛选条件等价的归档汇总行，筛选条件无法用按日、按物料的汇总表达时返回 None
+
+    search 与 archived_filter 相同，匹配物料编号或名称；时间范围须为整日：
+    start 为当地零点，end 为当地某日最后一刻（23:59:59.999999）。其他筛选条件由调用方判断。
+    """
+    summaries = ArchivedMovementSummary.objects.filter(direction=direction)
+    if search:
+        summaries = summaries.filter(Q(material_code__icontains=search) | Q(material_name__icontains=search))
+    if start is not None:
+        start = timezone.localtime(start)
+        if start.time() != time.min:
+            return None
+        summaries = summaries.filter(day__gte=start.date())
+    if end is not None:
+        end = timezone.localtime(end)
+        if end.time() != time.max:
+            return None
+        summaries = summaries.filter(day__lte=end.date())
+    return summaries
+
+
+def _summary_count(summaries):
+    return summaries.aggregate(total=Sum('count'))['total'] or 0
+
+
+def paginate_with_archive(queryset, direction, matches, start, end, page, page_size, summaries=None):
+    """
+    include_archived 模式的分页，返回 (总数, 总数是否精确, 本页记录)
+
+    库中记录在前、归档记录在后，整体按业务时间倒序。本页取满后不再扫描全部归档文件：
+    summaries 为与筛选条件等价的归档汇总行（见 archived_summaries）时，归档部分的总数取自汇总行；
+    否则最多再扫描 ARCHIVE_COUNT_SAMPLE_ROWS 条，按已扫描记录的匹配比例估算其余归档记录。
+    """
+    page = max(page, 1)
+    offset = (page - 1) * page_size
+    live_total = queryset.count()
+    items = list(queryset[offset:offset + page_size]) if offset < live_total else []
+    skip = max(offset - live_total, 0)
+    if len(items) == page_size and summaries is not None:
+        return live_total + _summary_count(summaries), True, items
+    archived_total = scanned = 0
+    records = iter_archived(direction, start, end)
+    try:
+        for record in records:
+            scanned += 1
+            if matches(record):
+                if archived_total >= skip and len(items) < page_size:
+                    items.append(record)
+                archived_total += 1
+            if len(items) == page_size:
+                break
+        else:
+            return live_total + archived_total, True, items
+
+        if summaries is not None:
+            return live_total + _summary_count(summaries), True, items
+        sampled = 0
+        for record in islice(records, ARCHIVE_COUNT_SAMPLE_ROWS):
+            sampled += 1
+            archived_total += matches(record)
+        scanned += sampled
+        if sampled < ARCHIVE_COUNT_SAMPLE_ROWS:
+            return live_total + archived_total, True, items
+    finally:
+        records.close()
+    archived_rows = _archives_between(direction, start, end).aggregate(total=Sum('row_count'))['total']
+    return live_total + round(archived_total * archived_rows / scanned), False, items
+
+
+def archived_daily_totals(direction, start, end=None):
+    """[start, end) 内已归档记录的每日汇总 {日期: (数量, 价值)}"""
+    summaries = ArchivedMovementSummary.objects.filter(direction=direction, day__gte=timezone.localtime(start).date())
+    if end is not None:
+        summaries = summaries.filter(day__lt=timezone.localtime(end).date())
+    return {
+        row['day']: (row['qty'], row['value'])
+        for row in summaries.values('day').annotate(qty=Sum('quantity'), value=Sum('value'))
+    }
+
+
+def archived_material_totals(direction):
+    """已归档记录按物料的数量合计 {(物料编号, 物料名称): 数量}"""
+    totals = ArchivedMovementSummary.objects.filter(direction=direction).values(
+        'material_code', 'material_name',
+    ).annotate(total_qty=Sum('quantity'))
+    return {(row['material_code'], row['material_name']): row['total_qty'] for row in totals}
@@ -0,0 +1,308 @@
+"""
+物料输入联想（typeahead）
+
+每个进程在首次请求时从数据库加载启用物料，建立内存索引（MaterialIndex）：
+- 前缀：物料编号、名称、名称拼音首字母（小写）各一个有序列表，二分查找定位前缀起点
+- 子串：编号、名称的二元组（bigram）倒排表，取最短的倒排表逐个校验
+
+结果按 编号前缀、名称前缀、拼音首字母前缀、编号/名称包含 的顺序排列，取前 limit 个。
+物料初始化、后台修改或删除提交后由 Stock 的 post_save / post_delete 信号增量更新本进程的索引；
+其他进程的修改按 MATERIAL_AUTOCOMPLETE_REFRESH_SECONDS 定期按 updated_at 增量同步。
+索引至多收录 MATERIAL_AUTOCOMPLETE_MAX_ENTRIES 个物料，超出时未收录的物料在结果不足时回退到数据库查询。
+"""
+import bisect
+import threading
+import time
+from array import array
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Stock
+from .search import contains_any
+
+# 单次联想的最大条数
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_REFRESH_SECONDS = 60
+
+# 影响联想结果的字段，只修改其他字段（余额、库存状态等）时不更新索引
+INDEXED_FIELDS = ('material_code', 'material_name', 'spec', 'unit', 'status')
+
+# 前缀匹配的键，按结果排序的优先级
+KEY_KINDS = ('code', 'name', 'initials')
+
+# GB2312 一级汉字按拼音排序，各声母第一个字的编码（i / u / v 无汉字）
+_GB2312_INITIALS = [
+    (0xB0A1, 'a'), (0xB0C5, 'b'), (0xB2C1, 'c'), (0xB4EE, 'd'), (0xB6EA, 'e'), (0xB7A2, 'f'), (0xB8C1, 'g'),
+    (0xB9FE, 'h'), (0xBBF7, 'j'), (0xBFA6, 'k'), (0xC0AC, 'l'), (0xC2E8, 'm'), (0xC4C3, 'n'), (0xC5B6, 'o'),
+    (0xC5BE, 'p'), (0xC6DA, 'q'), (0xC8BB, 'r'), (0xC8F6, 's'), (0xCBFA, 't'), (0xCDDA, 'w'), (0xCEF4, 'x'),
+    (0xD1B9, 'y'), (0xD4D1, 'z'),
+]
+_GB2312_CODES = [code for code, _ in _GB2312_INITIALS]
+_GB2312_LEVEL1_END = 0xD7F9
+
+
+@lru_cache(maxsize=8192)
+def _char_initial(char):
+    if char.isascii():
+        return char.lower() if char.isalnum() else ''
+    try:
+        encoded = char.encode('gb2312')
+    except UnicodeEncodeError:
+        return ''
+    code = encoded[0] << 8 | encoded[1] if len(encoded) == 2 else 0
+    if not _GB2312_CODES[0] <= code <= _GB2312_LEVEL1_END:
+        return ''
+    return _GB2312_INITIALS[bisect.bisect_right(_GB2312_CODES, code) - 1][1]
+
+
+def pinyin_initials(text):
+    """
+    名称的拼音首字母（小写）
+
+    汉字按 GB2312 一级汉字（常用字）取声母，字母、数字保留并转小写，其余字符（含二级汉字）忽略。
+    """
+    return ''.join(map(_char_initial, text))
+
+
+def _bigrams(text):
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class MaterialIndex:
+    """
+    一个进程内的物料联想索引
+
+    物料占用一个槽位（slot），修改时删除旧槽位、追加新槽位；倒排表中失效的槽位在校验时跳过，
+    失效槽位超过四分之一时在内存中重建（compact）。所有读写在同一把锁内进行。
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self.max_entries = max_entries
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self.loaded = False
+        self._reset()
+
+    def _reset(self):
+        # 槽位 -> (id, 编号, 名称, 规格, 单位, 编号键, 名称键)，失效为 None
+        self._slots = []
+        self._slot_of = {}
+        # 前缀键 -> (有序的键列表, 对应槽位)
+        self._keys = {kind: ([], array('i')) for kind in KEY_KINDS}
+        self._postings = {}
+        self._dead = 0
+        # 是否收录了全部启用物料
+        self.complete = True
+        self._watermark = None
+        self._synced_at = 0.0
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    # 写入（调用方持有锁）
+
+    def _add(self, row, bulk=False):
+        """收录一个启用物料；bulk 时前缀列表只追加，由调用方最后统一排序"""
+        if row['status'] != 'active':
+            return
+        if len(self._slot_of) >= self.max_entries:
+            self.complete = False
+            return
+        # 与原值相同时复用原字符串，不额外占用内存
+        code, name = row['material_code'], row['material_name']
+        code_key = code if code.casefold() == code else code.casefold()
+        name_key = name if name.casefold() == name else name.casefold()
+        slot = len(self._slots)
+        self._slots.append((row['id'], row['material_code'], row['material_name'], row['spec'], row['unit'],
+                            code_key, name_key))
+        self._slot_of[row['id']] = slot
+        for kind, key in zip(KEY_KINDS, (code_key, name_key, pinyin_initials(name))):
+            if key:
+                keys, slots = self._keys[kind]
+                position = len(keys) if bulk else bisect.bisect_right(keys, key)
+                keys.insert(position, key)
+                slots.insert(position, slot)
+        for gram in _bigrams(code_key) | _bigrams(name_key):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('i')
+            postings.append(slot)
+
+    def _remove(self, material_id):
+        slot = self._slot_of.pop(material_id, None)
+        if slot is None:
+            return
+        entry = self._slots[slot]
+        for kind, key in zip(KEY_KINDS, (entry[5], entry[6], pinyin_initials(entry[2]))):
+            keys, slots = self._keys[kind]
+            position = bisect.bisect_left(keys, key)
+            while position < len(keys) and keys[position] == key:
+                if slots[position] == slot:
+                    del keys[position], slots[position]
+                    break
+                position += 1
+        self._slots[slot] = None
+        self._dead += 1
+        if self._dead > 1000 and self._dead * 4 > len(self._slots):
+            self._compact()
+
+    def _compact(self):
+        """丢弃失效槽位，按现有条目重建各结构（不访问数据库）"""
+        live = [entry for entry in self._slots if entry is not None]
+        complete, watermark, synced_at = self.complete, self._watermark, self._synced_at
+        self._reset()
+        for material_id, code, name, spec, unit, _, _ in live:
+            self._add({'id': material_id, 'material_code': code, 'material_name': name, 'spec': spec, 'unit': unit,
+                       'status': 'active'}, bulk=True)
+        self._sort_keys()
+        self.complete, self._watermark, self._synced_at = complete, watermark, synced_at
+
+    def _sort_keys(self):
+        for kind, (keys, slots) in self._keys.items():
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            self._keys[kind] = ([keys[i] for i in order], array('i', (slots[i] for i in order)))
+
+    def _upsert(self, row):
+        slot = self._slot_of.get(row['id'])
+        if slot is not None and row['status'] == 'active' and self._slots[slot][1:5] == (
+                row['material_code'], row['material_name'], row['spec'], row['unit']):
+            return
+        self._remove(row['id'])
+        self._add(row)
+
+    def _load(self, rows=None):
+        self._reset()
+        if rows is None:
+            queryset = Stock.objects.filter(status='active').order_by('-updated_at').values('id', 'updated_at',
+                                                                                             *INDEXED_FIELDS)
+            rows = list(queryset[:self.max_entries + 1])
+        for row in rows:
+            self._add(row, bulk=True)
+        self._sort_keys()
+        self._watermark = max((row['updated_at'] for row in rows), default=None)
+        self._synced_at = time.monotonic()
+        self.loaded = True
+
+    def _sync(self):
+        """增量同步其他进程的修改：重读 updated_at 不早于上次同步水位（减去一个同步周期）的物料"""
+        queryset = Stock.objects.values('id', 'updated_at', *INDEXED_FIELDS)
+        if self._watermark is not None:
+            queryset = queryset.filter(updated_at__gte=self._watermark - timedelta(seconds=self.refresh_seconds))
+        for row in queryset.iterator():
+            self._upsert(row)
+            self._watermark = max(self._watermark, row['updated_at']) if self._watermark else row['updated_at']
+        self._synced_at = time.monotonic()
+        # 其他进程删除的物料无法增量发现，数量不一致时全量重建
+        if self.complete and Stock.objects.filter(status='active').count() != len(self):
+            self._load()
+
+    # 对外接口
+
+    def ensure_fresh(self):
+        """首次使用时加载，之后每 refresh_seconds 秒增量同步一次"""
+        with self._lock:
+            if not self.loaded:
+                self._load()
+            elif time.monotonic() - self._synced_at >= self.refresh_seconds:
+                self._sync()
+
+    def load(self, rows=None):
+        """全量加载；rows 为 None 时从数据库读取最近更新的启用物料，否则加载给定的行（含 updated_at）"""
+        with self._lock:
+            self._load(rows)
+
+    def upsert(self, row):
+        with self._lock:
+            if self.loaded:
+                self._upsert(row)
+
+    def remove(self, material_id):
+        with self._lock:
+            if self.loaded:
+                self._remove(material_id)
+
+    def search(self, term, limit):
+        """联想结果：[(id, 编号, 名称, 规格, 单位)]，空关键字按编号顺序返回前 limit 个"""
+        term = term.strip().casefold()
+        found, seen = [], set()
+        with self._lock:
+            for kind in KEY_KINDS:
+                keys, slots = self._keys[kind]
+                position = bisect.bisect_left(keys, term)
+                while len(found) < limit and position < len(keys) and keys[position].startswith(term):
+                    slot = slots[position]
+                    if slot not in seen:
+                        seen.add(slot)
+                        found.append(self._slots[slot][:5])
+                    position += 1
+            if len(found) < limit and len(term) >= 2:
+                postings = [self._postings.get(gram) for gram in _bigrams(term)]
+                if all(postings):
+                    for slot in min(postings, key=len):
+                        entry = self._slots[slot]
+                        if entry is None or slot in seen or (term not in entry[5] and term not in entry[6]):
+                            continue
+                        seen.add(slot)
+                        found.append(entry[:5])
+                        if len(found) >= limit:
+                            break
+        return found
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_material_index():
+    """获取本进程的物料联想索引（首次使用时按 settings 创建，数据在首次查询时加载）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = MaterialIndex(
+                    max_entries=getattr(settings, "MATERIAL_AUTOCOMPLETE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES),
+                    refresh_seconds=getattr(settings, "MATERIAL_AUTOCOMPLETE_REFRESH_SECONDS",
+                                            DEFAULT_REFRESH_SECONDS),
+                )
+    return _index
+
+
+def autocomplete_materials(term, limit):
+    """
+    物料联想，返回 [{id, material_code, material_name, spec, unit}]
+
+    索引未收录全部物料且结果不足 limit 个时，以编号/名称包含关键字从数据库补足。
+    """
+    index = get_material_index()
+    index.ensure_fresh()
+    items = [
+        {"id": material_id, "material_code": code, "material_name": name, "spec": spec, "unit": unit}
+        for material_id, code, name, spec, unit in index.search(term, limit)
+    ]
+    if len(items) < limit and not index.complete:
+        queryset = Stock.objects.filter(status='active').exclude(pk__in=[item["id"] for item in items])
+        if term.strip():
+            queryset = queryset.filter(contains_any(('material_code', 'material_name'), term.strip()))
+        items += queryset.order_by('material_code').values(
+            'id', 'material_code', 'material_name', 'spec', 'unit')[:limit - len(items)]
+    return items
+
+
+def material_saved(sender, instance, update_fields=None, **kwargs):
+    """物料保存后（事务提交时）更新本进程已加载的索引；只改了余额等字段时跳过"""
+    if _index is None or (update_fields is not None and not set(update_fields) & set(INDEXED_FIELDS)):
+        return
+    row = {'id': instance.pk, **{field: getattr(instance, field) for field in INDEXED_FIELDS}}
+    transaction.on_commit(lambda: _index.upsert(row))
+
+
+def material_deleted(sender, instance, **kwargs):
+    if _index is None:
+        return
+    material_id = instance.pk
+    transaction.on_commit(lambda: _index.remove(material_id))
@@ -0,0 +1,244 @@
+"""
+月结与期间锁
+
+月末结账（manage.py close_month）按业务时间从流水账汇总当月各物料的期初、入库、出库与期末，
+写入 MonthlyClosing 快照并锁定该期间（ClosedPeriod）：
+- 结账须按月份顺序，最近一个已结账月份月末之前业务时间的出入库记录不得新增、修改或撤销
+- 已结账期间的数据不再变化，月报、趋势等报表结果永久缓存（PeriodReportCache），无需失效逻辑
+- 结账先提交"结账中"的期间锁，快照与状态改为"已结账"在同一事务中写入；结账中断时期间保持锁定，
+  再次结账该月即可继续
+- 反结账（reopen_month）只能针对最近一个已结账月份，须填写原因并记录操作日志，
+  同时删除该月快照与报表缓存；出入库记录已归档（archive.py）的月份不能反结账
+已结账月份的月报直接读取快照（(month, stock) 唯一索引上的范围读取），未结账月份（含当前月）实时计算。
+"""
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .checkpoints import balances_as_of
+from .ledger import entry_totals, lock_ledger_table
+from .models import (
+    ClosedPeriod, MonthlyClosing, MovementArchive, PeriodAuditLog, PeriodReportCache, Stock,
+)
+
+CENT = Decimal('0.01')
+
+
+def parse_month(value):
+    """解析 YYYY-MM 为当月一日的 date，格式错误抛出 ValueError"""
+    year, month = map(int, value.split('-'))
+    return datetime(year, month, 1).date()
+
+
+def next_month(month):
+    """下月一日"""
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def month_range(month):
+    """month 月在当前时区下的起止时间 [start, end)"""
+    start = timezone.make_aware(datetime(month.year, month.month, 1))
+    following = next_month(month)
+    return start, timezone.make_aware(datetime(following.year, following.month, 1))
+
+
+def month_of(value):
+    """业务时间所在月份（当月一日），未带时区的时间按当前时区"""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def get_closed_period(month):
+    """month 月已结账时返回 ClosedPeriod，否则（含结账中）返回 None"""
+    return ClosedPeriod.objects.filter(month=month, status='closed').first()
+
+
+def is_month_closed(month):
+    return ClosedPeriod.objects.filter(month=month, status='closed').exists()
+
+
+def latest_closed_month():
+    """最近一个已锁定（已结账或结账中）的月份，尚未结账时返回 None"""
+    return ClosedPeriod.objects.order_by('-month').values_list('month', flat=True).first()
+
+
+def closed_months(times):
+    """
+    times 中业务时间落在已结账期间的月份集合
+
+    须在写入出入库记录的事务中调用。当月及以后的期间不可能已结账，全部落在其中时不查询数据库；
+    否则 PostgreSQL 上先对流水账表加 ROW EXCLUSIVE 锁（写分录本就需要），结账在锁定期间后
+    以 SHARE 锁等待这些事务结束再汇总快照：检查时期间尚未锁定的写入必定计入快照，
+    之后开始的写入必定看到期间已锁定。
+    """
+    current = timezone.localdate().replace(day=1)
+    months = {month_of(value) for value in times}
+    if all(month >= current for month in months):
+        return set()
+    if connection.in_atomic_block:
+        lock_ledger_table('ROW EXCLUSIVE')
+    latest = latest_closed_month()
+    return {month for month in months if latest is not None and month <= latest}
+
+
+def closed_period_error(times):
+    """times 中有业务时间落在已结账期间时返回错误信息，否则返回 None"""
+    locked = closed_months(times)
+    if locked:
+        return period_locked_message(min(locked))
+    return None
+
+
+def period_locked_message(month):
+    return f"{month:%Y-%m} 已结账，不能新增、修改或撤销该期间的出入库记录"
+
+
+def compute_month_closing(month):
+    """
+    实时计算 month 月各物料的月结数据，返回按物料编号排序的未保存 MonthlyClosing
+
+    期初取上月快照的期末，上月未结账时按时点余额计算；期初、期末为零且当月无变动的物料不列出。
+    """
+    start, end = month_range(month)
+    opening = defaultdict(lambda: [0, Decimal('0')])
+    previous = MonthlyClosing.objects.filter(month=(month - timedelta(days=1)).replace(day=1))
+    if previous.exists():
+        for stock_id, quantity, value in previous.values_list('stock_id', 'closing_quantity', 'closing_value'):
+            opening[stock_id] = [quantity, value]
+    else:
+        opening.update(balances_as_of(start - timedelta(microseconds=1))[1])
+
+    movements = defaultdict(lambda: {
+        'in': [0, 0, Decimal('0')], 'out': [0, 0, Decimal('0')], 'opening': [0, Decimal('0')],
+    })
+    entries = entry_totals(
+        Q(occurred_at__gte=start, occurred_at__lt=end), ['stock_id', 'source_type', 'entry_type'],
+    )
+    for stock_id, source_type, entry_type, quantity, value, count in entries:
+        totals = movements[stock_id]
+        if source_type == 'stock':
+            totals['opening'][0] += quantity
+            totals['opening'][1] += value
+            continue
+        # 出入库单的分录与其冲销按来源归并为净额，出库分录为负数
+        direction, sign = ('in', 1) if source_type == 'stock_in' else ('out', -1)
+        bucket = totals[direction]
+        bucket[0] += -count if entry_type == 'reversal' else count
+        bucket[1] += sign * quantity
+        bucket[2] += sign * value
+
+    stock_ids = set(movements) | {pk for pk, balance in opening.items() if any(balance)}
+    closings = []
+    stocks = Stock.objects.filter(pk__in=stock_ids).values_list('pk', 'material_code', 'material_name')
+    for stock_id, material_code, material_name in stocks:
+        totals = movements.get(stock_id) or movements.default_factory()
+        opening_quantity = opening[stock_id][0] + totals['opening'][0]
+        opening_value = (opening[stock_id][1] + totals['opening'][1]).quantize(CENT)
+        in_count, in_quantity, in_value = totals['in']
+        out_count, out_quantity, out_value = totals['out']
+        in_value, out_value = in_value.quantize(CENT), out_value.quantize(CENT)
+        closings.append(MonthlyClosing(
+            month=month, stock_id=stock_id, material_code=material_code, material_name=material_name,
+            opening_quantity=opening_quantity, opening_value=opening_value,
+            in_count=in_count, in_quantity=in_quantity, in_value=in_value,
+            out_count=out_count, out_quantity=out_quantity, out_value=out_value,
+            closing_quantity=opening_quantity + in_quantity - out_quantity,
+            closing_value=opening_value + in_value - out_value,
+        ))
+    closings.sort(key=lambda closing: closing.material_code)
+    return closings
+
+
+def close_month(month, operator=''):
+    """
+    结账：锁定 month 月并写入月结快照，返回快照行数
+
+    月份尚未结束、已结账（含并发结账）或上月尚未结账时抛出 ValueError。
+    上次结账中断、期间仍为"结账中"时继续完成该月结账。
+    """
+    if month_range(month)[1] > timezone.now():
+        raise ValueError(f"{month:%Y-%m} 尚未结束，不能结账")
+    latest = ClosedPeriod.objects.order_by('-month').first()
+    if latest is not None and latest.month == month and latest.status == 'closing':
+        period = latest
+    else:
+        if latest is not None and month <= latest.month:
+            raise ValueError(f"{month:%Y-%m} 已结账")
+        if latest is not None and latest.status == 'closing':
+            raise ValueError(f"{latest.month:%Y-%m} 结账尚未完成，请先结账 {latest.month:%Y-%m}")
+        if latest is not None and month != next_month(latest.month):
+            raise ValueError(f"请先结账 {next_month(latest.month):%Y-%m}")
+        # 先提交期间锁，此后开始的写入都会被拒绝；再等待进行中的写入结束后汇总快照
+        try:
+            with transaction.atomic():
+                period = ClosedPeriod.objects.create(month=month, closed_by=operator, status='closing')
+        except IntegrityError:
+            raise ValueError(f"{month:%Y-%m} 已结账或正在结账")
+
+    try:
+        with transaction.atomic():
+            # 与同时继续结账同一月份的调用互斥，只有一方写入快照
+            closing = ClosedPeriod.objects.select_for_update().filter(pk=period.pk, status='closing')
+            if not closing.exists():
+                raise ValueError(f"{month:%Y-%m} 已结账")
+            lock_ledger_table('SHARE')
+            closings = compute_month_closing(month)
+            MonthlyClosing.objects.bulk_create(closings, batch_size=1000)
+            closing.update(status='closed', closed_by=operator, closed_at=timezone.now())
+            PeriodAuditLog.objects.create(month=month, action='close', operator=operator)
+    except Exception:
+        # 汇总出错时解除期间锁；已由其他调用完成结账的期间不受影响
+        ClosedPeriod.objects.filter(pk=period.pk, status='closing').delete()
+        raise
+    return len(closings)
+
+
+def reopen_month(month, operator, reason):
+    """
+    反结账：解除 month 月的期间锁，删除该月快照与报表缓存并记录操作日志
+
+    只能反结账最近一个已结账且未归档的月份，须填写原因，否则抛出 ValueError。
+    """
+    if not reason:
+        raise ValueError("反结账须填写原因")
+    with transaction.atomic():
+        period = ClosedPeriod.objects.select_for_update().filter(month=month, status='closed').first()
+        if period is None:
+            raise ValueError(f"{month:%Y-%m} 尚未结账")
+        if ClosedPeriod.objects.filter(month__gt=month).exists():
+            raise ValueError("只能反结账最近一个已结账月份")
+        if MovementArchive.objects.filter(month=month).exists():
+            raise ValueError(f"{month:%Y-%m} 的出入库记录已归档，不能反结账")
+        MonthlyClosing.objects.filter(month=month).delete()
+        period.delete()
+        PeriodAuditLog.objects.create(month=month, action='reopen', operator=operator, reason=reason)
+
+
+def cached_period_report(period, key, build):
+    """
+    已结账期间的报表结果永久缓存
+
+    period 为 ClosedPeriod，为 None（期间未结账）时直接返回 build() 的结果。
+    缓存按 JSON 保存，首次生成的结果同样经 JSON 往返，保证前后返回一致。
+    """
+    if period is None:
+        return build()
+    cached = PeriodReportCache.objects.filter(period=period, key=key).values_list('payload', flat=True).first()
+    if cached is not None:
+        return cached
+    payload = json.loads(json.dumps(build(), cls=DjangoJSONEncoder))
+    with transaction.atomic():
+        # 锁定期间行，与并发的反结账互斥，避免为已解除的期间写入缓存
+        locked = ClosedPeriod.objects.select_for_update(
+            no_key=connection.features.has_select_for_no_key_update,
+        ).filter(pk=period.pk)
+        if locked.exists():
+            PeriodReportCache.objects.get_or_create(period=period, key=key, defaults={'payload': payload})
+    return payload
@@ -0,0 +1,164 @@
+"""
+出入库组提交（group commit）
+
+高峰期大量单行出入库请求各自开启事务、各自刷盘。开启 GROUP_COMMIT_ENABLED 后，
+创建入库/出库的视图不再直接写库，而是把校验后的明细交给本进程内的提交线程：
+提交线程收集 GROUP_COMMIT_WINDOW_MS 毫秒内（最多 GROUP_COMMIT_MAX_BATCH 条）到达的明细，
+通过 post_movements 在一个事务中批量过账。每个请求仍拿到自己的单据号，
+并且只有在共享事务提交之后才会返回响应。
+
+携带 Idempotency-Key 的请求不走组提交：幂等键须与明细在同一事务内提交，
+否则两次提交之间崩溃或超时后，客户端重试会重复过账。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from django.conf import settings
+from django.db import connection
+
+from .posting import post_movements
+
+DEFAULT_WINDOW_MS = 5
+DEFAULT_MAX_BATCH = 200
+# 空闲超过该时间（秒）后释放提交线程持有的数据库连接
+IDLE_CLOSE_SECONDS = 1
+_STOP = object()
+# 等待提交结果的最长时间（秒）
+SUBMIT_TIMEOUT = 30
+BUSY_MESSAGE = "系统繁忙，出入库未执行，请稍后重试"
+
+
+class GroupCommitter:
+    """进程内组提交器，由单个后台线程串行执行每一组事务"""
+
+    def __init__(self, window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.commit_count = 0
+        self.line_count = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, kind, line, timeout=SUBMIT_TIMEOUT):
+        """
+        提交一条明细并阻塞等待所在组提交，返回 post_movements 的单行结果
+
+        超时仍在排队的明细会被撤回、不再过账，返回 503 错误，客户端可以安全重试；
+        已被提交线程取走的明细无法撤回，继续等待所在组的结果，避免重试造成重复过账。
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((kind, line, future))
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            if future.cancel():
+                return {"error": BUSY_MESSAGE, "code": 503}
+            return future.result()
+
+    def stop(self, timeout=None):
+        """处理完已排队的明细后停止提交线程并释放数据库连接"""
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stock-group-commit", daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        """
+        阻塞等待第一条明细，然后在时间窗口内尽量多收集
+
+        返回 (batch, stopping)，收到停止信号时 stopping 为 True。
+        """
+        while True:
+            try:
+                first = self._queue.get(timeout=IDLE_CLOSE_SECONDS)
+                break
+            except queue.Empty:
+                connection.close()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if batch:
+                self._flush(batch)
+        connection.close()
+
+    def _flush(self, batch):
+        """过账一组明细，跳过等待超时、已被调用方撤回的明细"""
+        batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+        if batch:
+            self._post(batch)
+
+    def _post(self, batch):
+        """
+        在一个事务中过账一组明细；整组事务出错（数据库错误、死锁等）时二分重试，
+        只有最终单独失败的明细收到异常，同组其他请求不受影响
+        """
+        try:
+            results = post_movements([(kind, line) for kind, line, _ in batch])
+        except Exception as exc:
+            connection.close_if_unusable_or_obsolete()
+            if len(batch) == 1:
+                batch[0][2].set_exception(exc)
+                return
+            middle = len(batch) // 2
+            self._post(batch[:middle])
+            self._post(batch[middle:])
+        else:
+            self.commit_count += 1
+            self.line_count += len(batch)
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+_committer = None
+_committer_lock = threading.Lock()
+
+
+def get_group_committer():
+    """获取本进程的组提交器（首次使用时按 settings 创建）"""
+    global _committer
+    if _committer is None:
+        with _committer_lock:
+            if _committer is None:
+                _committer = GroupCommitter(
+                    window_ms=getattr(settings, "GROUP_COMMIT_WINDOW_MS", DEFAULT_WINDOW_MS),
+                    max_batch=getattr(settings, "GROUP_COMMIT_MAX_BATCH", DEFAULT_MAX_BATCH),
+                )
+    return _committer
+
+
+def group_commit_enabled(request=None):
+    """是否对该请求使用组提交（携带 Idempotency-Key 的请求直接在请求线程内过账）"""
+    if request is not None and request.headers.get("Idempotency-Key", "").strip():
+        return False
+    return getattr(settings, "GROUP_COMMIT_ENABLED", False)
@@ -0,0 +1,142 @@
+"""
+物料出入库历史
+
+把一个物料的入库、出库记录按业务时间倒序合并为一条时间线：
+每侧各自按 (stock_id, 业务时间, id) 索引倒序读取至多 limit + 1 行（过滤条件、游标条件都下推到各侧），
+再以 UNION ALL 合并、整体排序截取。分区表上各侧按月份分区顺序扫描，取够即停。
+
+分页用游标（键集分页）而不是 OFFSET：游标记录上一页最后一行的 (业务时间, 方向, id)，
+下一页只读取排在其后的行，翻到多深都只读取 limit + 1 行。
+同一时刻的记录按方向（出库在前）、id 倒序排列，保证顺序唯一。
+"""
+import base64
+from datetime import datetime
+
+from django.db import connection
+
+from .models import StockIn, StockOut
+from .posting import MOVEMENT_IN, MOVEMENT_OUT
+
+# 单页最大行数
+HISTORY_MAX_LIMIT = 200
+
+# 方向 -> (模型, 业务时间列, 类型列, 数量列, 价值列, 供应商列)
+HISTORY_SOURCES = {
+    MOVEMENT_IN: (StockIn, 'in_time', 'in_type', 'in_quantity', 'in_value', 'supplier'),
+    MOVEMENT_OUT: (StockOut, 'out_time', 'out_type', 'out_quantity', 'out_value', None),
+}
+
+HISTORY_COLUMNS = (
+    'direction', 'id', 'bill_no', 'moved_at', 'movement_type', 'quantity', 'value', 'supplier', 'operator', 'remark',
+)
+
+
+def encode_cursor(moved_at, direction, record_id):
+    raw = f"{moved_at.isoformat()}|{direction}|{record_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """解析游标为 (业务时间, 方向, id)，格式错误时抛出 ValueError"""
+    try:
+        moved_at, direction, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        moved_at = datetime.fromisoformat(moved_at)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("游标格式错误") from exc
+    if direction not in HISTORY_SOURCES or moved_at.tzinfo is None:
+        raise ValueError("游标格式错误")
+    return moved_at, direction, int(record_id)
+
+
+def _side_sql(direction, stock_id, movement_type, operator, start, end, after, limit):
+    """一侧（入库或出库）的查询：全部过滤条件与游标条件都作用在该表上"""
+    model, time_column, type_column, quantity_column, value_column, supplier_column = HISTORY_SOURCES[direction]
+    where, params = ["stock_id = %s"], [stock_id]
+    if movement_type:
+        where.append(f"{type_column} = %s")
+        params.append(movement_type)
+    if operator:
+        where.append("operator = %s")
+        params.append(operator)
+    if start:
+        where.append(f"{time_column} >= %s")
+        params.append(connection.ops.adapt_datetimefield_value(start))
+    if end:
+        where.append(f"{time_column} <= %s")
+        params.append(connection.ops.adapt_datetimefield_value(end))
+    if after:
+        # 倒序下排在游标之后：方向排在游标方向之后（'in' < 'out'）的一侧可与游标同一时刻
+        after_time, after_direction, after_id = after
+        after_time = connection.ops.adapt_datetimefield_value(after_time)
+        if direction == after_direction:
+            where.append(f"({time_column}, id) < (%s, %s)")
+            params += [after_time, after_id]
+        elif direction < after_direction:
+            where.append(f"{time_column} <= %s")
+            params.append(after_time)
+        else:
+            where.append(f"{time_column} < %s")
+            params.append(after_time)
+    supplier = supplier_column or "''"
+    sql = (
+        f"SELECT '{direction}' AS direction, id, bill_no, {time_column} AS moved_at, "
+        f"{type_column} AS movement_type, {quantity_column} AS quantity, {value_column} AS value, "
+        f"{supplier} AS supplier, operator, remark "
+        f"FROM {model._meta.db_table} WHERE {' AND '.join(where)} "
+        f"ORDER BY {time_column} DESC, id DESC LIMIT %s"
+    )
+    return sql, [*params, limit]
+
+
+def _converters(direction):
+    """按数据库后端把原始 SQL 读出的业务时间、价值转换为 datetime / Decimal（SQLite 返回字符串与浮点数）"""
+    model, time_column, _, _, value_column, _ = HISTORY_SOURCES[direction]
+    converters = {}
+    for name, column in (('moved_at', time_column), ('value', value_column)):
+        col = model._meta.get_field(column).get_col(model._meta.db_table)
+        converters[name] = (col, connection.ops.get_db_converters(col) + col.get_db_converters(connection))
+    return converters
+
+
+def movement_history(stock_id, *, directions=(MOVEMENT_IN, MOVEMENT_OUT), movement_type=None, operator=None,
+                     start=None, end=None, cursor=None, limit=50):
+    """
+    物料的出入库历史，按业务时间倒序
+
+    directions 限定方向；movement_type 为入库/出库类型，只作用于有该类型的一侧；
+    start / end 为业务时间范围（含两端）；cursor 为上一页返回的 next_cursor。
+    返回 (rows, next_cursor)，rows 为 HISTORY_COLUMNS 组成的字典，没有下一页时 next_cursor 为 None。
+    游标格式错误时抛出 ValueError。
+    """
+    after = decode_cursor(cursor) if cursor else None
+    sides, params = [], []
+    for direction in directions:
+        model, _, type_column, *_ = HISTORY_SOURCES[direction]
+        if movement_type and movement_type not in dict(model._meta.get_field(type_column).choices):
+            continue
+        sql, side_params = _side_sql(direction, stock_id, movement_type, operator, start, end, after, limit + 1)
+        sides.append(f"SELECT * FROM ({sql}) AS {direction}_side")
+        params += side_params
+    if not sides:
+        return [], None
+
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(
+            f"{' UNION ALL '.join(sides)} ORDER BY moved_at DESC, direction DESC, id DESC LIMIT %s",
+            [*params, limit + 1],
+        )
+        raw_rows = db_cursor.fetchall()
+
+    converters = {direction: _converters(direction) for direction in directions}
+    rows = []
+    for raw in raw_rows[:limit]:
+        row = dict(zip(HISTORY_COLUMNS, raw))
+        for name, (col, functions) in converters[row['direction']].items():
+            for function in functions:
+                row[name] = function(row[name], col, connection)
+        rows.append(row)
+    next_cursor = None
+    if len(raw_rows) > limit:
+        last = rows[-1]
+        next_cursor = encode_cursor(last['moved_at'], last['direction'], last['id'])
+    return rows, next_cursor
@@ -0,0 +1,108 @@
+"""
+出入库接口幂等支持
+
+客户端在 POST 请求头中携带 Idempotency-Key，同一用户对同一接口重复提交相同的键时，
+直接回放首次成功的响应，不再重复生成单据和变更库存。键与请求体摘要一同保存，
+同一个键换了请求内容时返回 422，而不是回放与本次请求无关的响应。
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+from .utils import json_error
+
+# 幂等键默认保留 24 小时，可通过 settings.IDEMPOTENCY_KEY_TTL（秒）调整
+DEFAULT_IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+
+def get_idempotency_ttl():
+    """幂等键有效期"""
+    return timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", DEFAULT_IDEMPOTENCY_KEY_TTL))
+
+
+class _DiscardKey(Exception):
+    """视图未成功时回滚幂等键，允许客户端用同一个键重试"""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+REUSED_KEY_MESSAGE = "Idempotency-Key 已用于内容不同的请求"
+
+
+def _replay(record):
+    response = HttpResponse(record.response_body, status=record.status_code, content_type="application/json")
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(view_func):
+    """
+    幂等装饰器，需放在 require_permission 之后
+
+    - 未携带 Idempotency-Key 时行为不变
+    - 命中未过期的键时通过唯一索引单次查询取回响应并回放
+    - 首次请求时键的插入与视图的写操作处于同一事务，只有 2xx 响应会被保存；
+      并发的重复请求会阻塞在唯一索引上，待首个请求提交后回放其响应
+    - 同一个键的请求体与首次不同时返回 422
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key", "").strip()
+        if not key:
+            return view_func(request, *args, **kwargs)
+        if len(key) > 100:
+            return json_error("Idempotency-Key 长度不能超过100", 400)
+
+        scope = f"{view_func.__name__}:{request.user.pk}"
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        expires_before = timezone.now() - get_idempotency_ttl()
+
+        record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+        if record is not None:
+            if record.created_at < expires_before:
+                record.delete()
+            elif record.request_hash and record.request_hash != request_hash:
+                return json_error(REUSED_KEY_MESSAGE, 422)
+            elif record.status_code:
+                return _replay(record)
+
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(scope=scope, key=key, request_hash=request_hash)
+                response = view_func(request, *args, **kwargs)
+                if not 200 <= response.status_code < 300:
+                    raise _DiscardKey(response)
+                IdempotencyKey.objects.filter(scope=scope, key=key).update(
+                    status_code=response.status_code,
+                    response_body=response.content.decode("utf-8"),
+                )
+        except _DiscardKey as exc:
+            return exc.response
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+            if record is None:
+                raise
+            if record.request_hash and record.request_hash != request_hash:
+                return json_error(REUSED_KEY_MESSAGE, 422)
+            if record.status_code:
+                return _replay(record)
+            return json_error("相同 Idempotency-Key 的请求正在处理中，请稍后重试", 409)
+
+        return response
+
+    return wrapper
+
+
+def purge_expired_idempotency_keys():
+    """删除已过期的幂等键，返回删除数量"""
+    expires_before = timezone.now() - get_idempotency_ttl()
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expires_before).delete()
+    return deleted
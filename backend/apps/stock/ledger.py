@@ -0,0 +1,203 @@
+"""
+库存流水账
+
+每次库存变动都在 stock_ledger 追加一行，记录带符号的数量/价值以及变动后的结存；
+修改、撤销出入库记录时追加冲销分录，不改写历史。
+物料内的顺序号由 Stock.ledger_seq 分配：余额更新语句同时递增 ledger_seq，
+行锁保证同一物料的顺序号与结存按提交顺序连续。分片物料快路径不锁 Stock 行，
+分录先写入暂存表（StockLedgerPending），折叠分片时编号入账。
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import StockIn, StockLedger, StockLedgerPending
+from .utils import day_range
+
+# 暂存分录入账时原样带入流水账的字段
+PENDING_ENTRY_FIELDS = ('entry_type', 'source_type', 'source_id', 'bill_no', 'quantity', 'value', 'occurred_at')
+
+
+def lock_ledger_table(mode):
+    """
+    PostgreSQL 上以 mode 表锁锁定流水账表直至事务结束，其他数据库不做处理
+
+    写入分录本身即持有 ROW EXCLUSIVE 锁；以 SHARE 模式加锁可等待进行中的写入事务全部结束。
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {StockLedger._meta.db_table} IN {mode} MODE')
+
+
+def posting_movement(record):
+    """出入库记录过账对应的分录参数（数量、价值带符号，出库为负）"""
+    if isinstance(record, StockIn):
+        return {
+            "entry_type": 'in', "source_type": 'stock_in', "source_id": record.pk,
+            "bill_no": record.bill_no, "quantity": record.in_quantity, "value": record.in_value,
+            "occurred_at": record.in_time,
+        }
+    return {
+        "entry_type": 'out', "source_type": 'stock_out', "source_id": record.pk,
+        "bill_no": record.bill_no, "quantity": -record.out_quantity, "value": -record.out_value,
+        "occurred_at": record.out_time,
+    }
+
+
+def reversal_movement(movement):
+    """
+    冲销分录参数：抵消 movement（posting_movement 的返回值）对库存的影响
+
+    冲销沿用原分录的业务时间，按业务时间汇总（时点余额、月结）时与原分录在同一期间抵消；
+    记账时间见 created_at。
+    """
+    return dict(
+        movement, entry_type='reversal', quantity=-movement["quantity"], value=-movement["value"],
+    )
+
+
+def ledger_entries(stock, movements):
+    """
+    为一次余额更新生成分录（未保存）
+
+    stock 为 posting.change_balance 返回的库存：current_stock / stock_value 为全部变动之后的余额，
+    ledger_seq 为分配给最后一条分录的顺序号。movements 按发生顺序排列，各条结存由最终余额倒推。
+    """
+    entries = []
+    balance_quantity, balance_value = stock.current_stock, stock.stock_value
+    sequence = stock.ledger_seq
+    for movement in reversed(movements):
+        entries.append(StockLedger(
+            stock_id=stock.pk, sequence=sequence,
+            balance_quantity=balance_quantity, balance_value=balance_value, **movement,
+        ))
+        balance_quantity -= movement["quantity"]
+        balance_value -= movement["value"]
+        sequence -= 1
+    entries.reverse()
+    return entries
+
+
+def write_ledger_entries(stock, movements):
+    """
+    写入一次余额更新的分录
+
+    stock.ledger_seq 为 None 表示分片快路径写入：分录暂存到 StockLedgerPending，折叠时再入账。
+    """
+    if stock.ledger_seq is None:
+        StockLedgerPending.objects.bulk_create([
+            StockLedgerPending(stock_id=stock.pk, **movement) for movement in movements
+        ])
+    else:
+        StockLedger.objects.bulk_create(ledger_entries(stock, movements))
+
+
+def batch_entries(stocks, records):
+    """
+    为批量过账的出入库记录按顺序生成分录（未保存）
+
+    stocks: {stock_id: 已锁定的 Stock}，余额为本批过账前的值（分片已折叠）；
+    records 为已保存的记录，按过账顺序排列。实例上的 ledger_seq 随之递增，
+    返回 (分录列表, {stock_id: 新顺序号})，顺序号由调用方通过 apply_stock_deltas 写回。
+    """
+    balances = {pk: [stock.current_stock, stock.stock_value] for pk, stock in stocks.items()}
+    entries = []
+    for record in records:
+        stock = stocks[record.stock_id]
+        movement = posting_movement(record)
+        balance = balances[stock.pk]
+        balance[0] += movement["quantity"]
+        balance[1] += movement["value"]
+        stock.ledger_seq += 1
+        entries.append(StockLedger(
+            stock_id=stock.pk, sequence=stock.ledger_seq,
+            balance_quantity=balance[0], balance_value=balance[1], **movement,
+        ))
+    return entries, {stock_id: stocks[stock_id].ledger_seq for stock_id in {r.stock_id for r in records}}
+
+
+def seal_pending_entries(stock):
+    """
+    把分片快路径暂存的分录编号入账
+
+    stock 必须已锁定且分片已折叠（current_stock / stock_value 为精确余额）；
+    所有写过分片的事务都已提交，暂存分录按写入顺序编号、补齐结存后追加到流水账，
+    再从暂存表删除。返回入账的分录数，实例上的 ledger_seq 随之递增，由调用方写回。
+    """
+    pending = list(StockLedgerPending.objects.filter(stock_id=stock.pk).order_by('pk'))
+    if not pending:
+        return 0
+    balance_quantity = stock.current_stock - sum(entry.quantity for entry in pending)
+    balance_value = stock.stock_value - sum(entry.value for entry in pending)
+    entries = []
+    for entry in pending:
+        balance_quantity += entry.quantity
+        balance_value += entry.value
+        stock.ledger_seq += 1
+        entries.append(StockLedger(
+            stock_id=stock.pk, sequence=stock.ledger_seq,
+            balance_quantity=balance_quantity, balance_value=balance_value,
+            **{field: getattr(entry, field) for field in PENDING_ENTRY_FIELDS},
+        ))
+    StockLedger.objects.bulk_create(entries)
+    StockLedgerPending.objects.filter(pk__in=[entry.pk for entry in pending]).delete()
+    return len(entries)
+
+
+def entry_totals(condition, fields, pending_condition=None, **annotations):
+    """
+    按 fields 分组汇总流水账与暂存分录，返回 [(*分组值, 数量, 价值, 分录数)]
+
+    condition 为流水账上的 Q 条件，pending_condition 为暂存表上的条件（默认同 condition），
+    annotations 为分组用的计算列（如按日截断）。
+    两张表以 UNION ALL 在同一条语句中读取：折叠在一个事务内把分录从暂存表移入流水账，
+    分两次查询可能漏算或重复计算正在折叠的分录。
+    计算列的值不经 ORM 转换（SQLite 上日期为字符串），由调用方规整；价值统一规整为两位小数。
+    """
+    selects, params = [], []
+    if pending_condition is None:
+        pending_condition = condition
+    for model, model_condition in ((StockLedger, condition), (StockLedgerPending, pending_condition)):
+        query = model.objects.filter(model_condition).annotate(**annotations).order_by().values(
+            *fields, 'quantity', 'value',
+        ).query
+        try:
+            sql, query_params = query.sql_with_params()
+        except EmptyResultSet:
+            continue
+        selects.append(sql)
+        params.extend(query_params)
+    if not selects:
+        return []
+    columns = ', '.join(connection.ops.quote_name(field) for field in fields)
+    sql = (
+        f"SELECT {columns}, SUM(quantity), SUM(value), COUNT(*)"
+        f" FROM ({' UNION ALL '.join(selects)}) AS entries GROUP BY {columns}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [
+            (*row[:-3], row[-3], Decimal(str(row[-2])).quantize(Decimal('0.01')), row[-1])
+            for row in cursor.fetchall()
+        ]
+
+
+def daily_net_quantities(stock_id, days):
+    """
+    物料最近 days 天（含今天，按当前时区的业务日）每天的净变动数量 [(日期, 数量)]，没有变动的日子为 0
+
+    一条按 (stock, occurred_at) 索引范围读取的聚合查询（含尚未入账的暂存分录）；冲销分录按原业务时间计入。
+    """
+    last = timezone.localdate()
+    first = last - timedelta(days=days - 1)
+    condition = Q(stock_id=stock_id, occurred_at__gte=day_range(first)[0], occurred_at__lt=day_range(last)[1])
+    totals = {
+        date.fromisoformat(str(day)): quantity
+        for day, quantity, _, _ in entry_totals(condition, ['day'], day=TruncDate('occurred_at'))
+    }
+    return [(first + timedelta(days=n), totals.get(first + timedelta(days=n), 0)) for n in range(days)]
@@ -0,0 +1,39 @@
+"""
+出入库记录冷归档（只归档已结账月份）
+
+    python manage.py archive_movements                   # 归档一年以前的已结账月份
+    python manage.py archive_movements --until 2022-12   # 归档 2022-12 及之前的已结账月份
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.stock.archive import archive_movements
+from apps.stock.closing import parse_month
+
+
+class Command(BaseCommand):
+    help = '把指定月份及之前已结账月份的出入库记录移入压缩归档文件，并保留按日汇总'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', help='归档截止月份（YYYY-MM，含），默认为 12 个月前')
+
+    def handle(self, *args, **options):
+        if options['until']:
+            try:
+                until = parse_month(options['until'])
+            except ValueError:
+                raise CommandError('月份格式错误，应为 YYYY-MM')
+        else:
+            this_month = timezone.localdate().replace(day=1)
+            until = this_month.replace(year=this_month.year - 1)
+
+        try:
+            archives = archive_movements(until)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if not archives:
+            self.stdout.write(f'{until:%Y-%m} 及之前没有待归档的已结账月份')
+            return
+        for archive in archives:
+            self.stdout.write(f'{archive.get_direction_display()} {archive.month:%Y-%m}：{archive.row_count} 条 -> {archive.path}')
+        self.stdout.write(self.style.SUCCESS(f'归档完成，共 {sum(archive.row_count for archive in archives)} 条'))
@@ -0,0 +1,28 @@
+"""
+生成库存余额检查点（建议每日凌晨定时执行）
+
+    python manage.py balance_checkpoint                              # 当日零点的检查点
+    python manage.py balance_checkpoint --at 2024-06-30T23:59:59     # 指定时点
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.stock.checkpoints import create_balance_checkpoint
+from apps.stock.utils import parse_aware_datetime
+
+
+class Command(BaseCommand):
+    help = '生成指定时点全部物料的余额检查点，供时点余额查询使用'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', help='检查点时间（ISO 格式），默认当日零点')
+
+    def handle(self, *args, **options):
+        if options['at']:
+            at = parse_aware_datetime(options['at'])
+            if at is None:
+                raise CommandError('--at 需要是 ISO 格式时间')
+        else:
+            at = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+        count = create_balance_checkpoint(at)
+        self.stdout.write(self.style.SUCCESS(f'已生成 {timezone.localtime(at):%Y-%m-%d %H:%M:%S} 的检查点，共 {count} 个物料'))
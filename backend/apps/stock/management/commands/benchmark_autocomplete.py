@@ -0,0 +1,70 @@
+"""
+物料联想索引性能（内存，不访问数据库）
+
+在合成物料（中文名称）上建立 MaterialIndex，输出建立耗时、索引占用内存（tracemalloc，另建一份统计）以及
+各类关键字单次查询耗时的中位数与 P99（微秒）。
+
+    python manage.py benchmark_autocomplete --materials 100000 --limit 10
+"""
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.stock.autocomplete import MaterialIndex
+
+# 合成物料名称：材质 + 品名 + 规格
+MATERIALS = ['不锈钢', '碳钢', '铝合金', '黄铜', '尼龙', '镀锌', '铸铁', '合金钢']
+PRODUCTS = ['六角螺栓', '螺母', '平垫片', '深沟球轴承', '法兰', '球阀', '弯头', '压缩弹簧', '密封圈', '链条']
+
+# (说明, 关键字)
+SEARCH_TERMS = [
+    ("空关键字", ""),
+    ("编号前缀", "MAT00123"),
+    ("名称前缀", "不锈钢六角"),
+    ("拼音首字母", "bxglj"),
+    ("名称包含", "球阀M4"),
+    ("编号包含", "0099"),
+    ("无匹配", "钛合金齿轮"),
+]
+
+
+class Command(BaseCommand):
+    help = '在合成物料上测量联想索引的建立耗时、内存与查询耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--materials', type=int, default=100_000, help='合成的物料数')
+        parser.add_argument('--limit', type=int, default=10, help='每次联想返回的条数')
+        parser.add_argument('--repeat', type=int, default=1000, help='每个关键字的查询次数')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        rows = [{
+            'id': n, 'updated_at': now, 'material_code': f"MAT{n:07d}", 'spec': '', 'unit': '个', 'status': 'active',
+            'material_name': f"{MATERIALS[n % len(MATERIALS)]}{PRODUCTS[n // len(MATERIALS) % len(PRODUCTS)]}M{n % 50}",
+        } for n in range(options['materials'])]
+        index = MaterialIndex(max_entries=options['materials'])
+        started = time.perf_counter()
+        index.load(rows)
+        elapsed = time.perf_counter() - started
+        # 另建一份统计内存（tracemalloc 会明显拖慢建立过程，不计入耗时）
+        tracemalloc.start()
+        traced = MaterialIndex(max_entries=options['materials'])
+        traced.load(rows)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del traced
+        self.stdout.write(f"{len(index)} 个物料，建立耗时 {elapsed:.2f}s，索引约 {memory / 1024 / 1024:.1f} MB")
+
+        self.stdout.write(f"{'关键字':<16}{'结果数':>8}{'中位数(µs)':>12}{'P99(µs)':>10}")
+        for description, term in SEARCH_TERMS:
+            durations = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                found = index.search(term, options['limit'])
+                durations.append((time.perf_counter() - started) * 1_000_000)
+            durations.sort()
+            p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+            self.stdout.write(f"{description:<16}{len(found):>8}{statistics.median(durations):>12.1f}{p99:>10.1f}")
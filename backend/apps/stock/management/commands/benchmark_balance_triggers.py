@@ -0,0 +1,111 @@
+"""
+触发器维护余额性能对比（PostgreSQL）
+
+在临时物料上并发提交单行入库/出库请求，分别以 Python 过账和触发器维护余额两种模式运行，
+输出吞吐量以及 p50/p99 延迟，并核对两种模式下的余额与流水账。结束后删除临时物料及其流水。
+
+    python manage.py benchmark_balance_triggers --requests 4000 --workers 16 --materials 8
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory, override_settings
+
+from apps.stock.models import Stock, StockLedger
+from apps.stock.views import stock_in_create_view, stock_out_create_view
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = '对比 Python 过账与数据库触发器维护余额两种模式下单行出入库的吞吐量和延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='每种模式的请求总数')
+        parser.add_argument('--workers', type=int, default=16, help='并发线程数')
+        parser.add_argument('--materials', type=int, default=4, help='请求轮流落在的物料数')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('触发器维护余额仅支持 PostgreSQL')
+        total, workers = options['requests'], options['workers']
+        prefix = f"BENCH-{int(time.time())}"
+        stocks = [
+            Stock.objects.create(
+                material_code=f"{prefix}-{n}", material_name='触发器压测物料', current_stock=total * 10,
+            )
+            for n in range(options['materials'])
+        ]
+        codes = [stock.material_code for stock in stocks]
+        try:
+            rows = [
+                self._run(codes, total, workers, triggers=False),
+                self._run(codes, total, workers, triggers=True),
+            ]
+            # 两种模式各入库、出库一半，余额应回到初始值，流水账每个请求一条分录
+            balances = set(Stock.objects.filter(pk__in=[s.pk for s in stocks]).values_list('current_stock', flat=True))
+            entries = StockLedger.objects.filter(stock__in=stocks).count()
+            if balances != {total * 10} or entries != total * 2:
+                raise CommandError(f"余额或流水账不一致：余额 {sorted(balances)}，分录 {entries} 条")
+        finally:
+            for stock in stocks:
+                stock.delete()
+
+        self.stdout.write(f"{'模式':<12}{'请求数':>8}{'请求/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['mode']:<12}{row['requests']:>8}{row['requests_per_sec']:>10.0f}"
+                f"{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            )
+
+    def _run(self, codes, total, workers, triggers):
+        factory = RequestFactory()
+        user = User(username='benchmark', is_superuser=True)
+        barrier = threading.Barrier(workers)
+
+        def worker(worker_id):
+            latencies = []
+            try:
+                barrier.wait()
+                for n in range(worker_id, total, workers):
+                    material_code = codes[(n // 2) % len(codes)]
+                    if n % 2 == 0:
+                        view, body = stock_in_create_view, {
+                            "material_code": material_code, "in_quantity": 1, "in_value": 1, "in_type": "other",
+                        }
+                    else:
+                        view, body = stock_out_create_view, {
+                            "material_code": material_code, "out_quantity": 1, "out_value": 1, "out_type": "other",
+                        }
+                    request = factory.post('/', data=body, content_type='application/json')
+                    request.user = user
+                    started = time.perf_counter()
+                    response = view(request)
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise RuntimeError(response.content.decode('utf-8'))
+            finally:
+                connection.close()
+            return latencies
+
+        # 各线程新建的数据库连接按 STOCK_BALANCE_TRIGGERS 设置会话参数
+        with override_settings(STOCK_BALANCE_TRIGGERS=triggers):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                latencies = [lat for chunk in executor.map(worker, range(workers)) for lat in chunk]
+            elapsed = time.perf_counter() - started
+
+        return {
+            "mode": "trigger" if triggers else "python",
+            "requests": total,
+            "requests_per_sec": total / elapsed,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+        }
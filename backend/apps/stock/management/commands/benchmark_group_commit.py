@@ -0,0 +1,100 @@
+"""
+组提交性能对比
+
+在临时物料上并发提交单行入库/出库请求，分别以逐请求事务和组提交两种模式运行，
+输出事务提交次数、每秒提交数、吞吐量以及 p50/p99 延迟。结束后删除临时物料及其流水。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+
+from apps.stock.group_commit import get_group_committer
+from apps.stock.models import Stock
+from apps.stock.views import stock_in_create_view, stock_out_create_view
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = '对比逐请求事务与组提交模式下单行出入库的吞吐量和延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='每种模式的请求总数')
+        parser.add_argument('--workers', type=int, default=32, help='并发线程数')
+
+    def handle(self, *args, **options):
+        total, workers = options['requests'], options['workers']
+        material_code = f"BENCH-{int(time.time())}"
+        stock = Stock.objects.create(
+            material_code=material_code, material_name='组提交压测物料', current_stock=total * 10,
+        )
+        try:
+            rows = [
+                self._run(material_code, total, workers, group_commit=False),
+                self._run(material_code, total, workers, group_commit=True),
+            ]
+        finally:
+            stock.delete()
+
+        self.stdout.write(f"{'模式':<12}{'请求数':>8}{'提交数':>8}{'提交/秒':>10}{'请求/秒':>10}{'p50(ms)':>10}{'p99(ms)':>10}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['mode']:<12}{row['requests']:>8}{row['commits']:>8}{row['commits_per_sec']:>10.0f}"
+                f"{row['requests_per_sec']:>10.0f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            )
+
+    def _run(self, material_code, total, workers, group_commit):
+        factory = RequestFactory()
+        user = User(username='benchmark', is_superuser=True)
+        barrier = threading.Barrier(workers)
+        committer = get_group_committer()
+        commits_before = committer.commit_count
+
+        def worker(worker_id):
+            latencies = []
+            try:
+                barrier.wait()
+                for n in range(worker_id, total, workers):
+                    if n % 2 == 0:
+                        view, body = stock_in_create_view, {
+                            "material_code": material_code, "in_quantity": 1, "in_value": 1, "in_type": "other",
+                        }
+                    else:
+                        view, body = stock_out_create_view, {
+                            "material_code": material_code, "out_quantity": 1, "out_value": 1, "out_type": "other",
+                        }
+                    request = factory.post('/', data=body, content_type='application/json')
+                    request.user = user
+                    started = time.perf_counter()
+                    response = view(request)
+                    latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise RuntimeError(response.content.decode('utf-8'))
+            finally:
+                connection.close()
+            return latencies
+
+        with override_settings(GROUP_COMMIT_ENABLED=group_commit):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                latencies = [lat for chunk in executor.map(worker, range(workers)) for lat in chunk]
+            elapsed = time.perf_counter() - started
+
+        commits = committer.commit_count - commits_before if group_commit else total
+        return {
+            "mode": "group" if group_commit else "per-request",
+            "requests": total,
+            "commits": commits,
+            "commits_per_sec": commits / elapsed,
+            "requests_per_sec": total / elapsed,
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p99_ms": _percentile(latencies, 99) * 1000,
+        }
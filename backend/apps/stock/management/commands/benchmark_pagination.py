@@ -0,0 +1,99 @@
+"""
+列表分页性能对比（PostgreSQL）
+
+在临时物料下合成大量入库记录，分别以页码分页（OFFSET + COUNT）与游标分页（键集）请求入库列表的
+第 1、10、100 …… 页，输出各页耗时中位数。游标分页第 N 页的游标取自第 N - 1 页最后一行（不计时）。
+--count 为页码分页的总数计数方式（exact / estimate / none）。结束后删除临时物料及其记录。
+
+    python manage.py benchmark_pagination --rows 1000000 --page-size 10 --count estimate
+"""
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+
+from apps.stock.closing import month_of
+from apps.stock.models import Stock, StockIn
+from apps.stock.pagination import COUNT_MODES, encode_keyset_cursor
+from apps.stock.partitioning import ensure_partitions, is_partitioned
+from apps.stock.triggers import balance_triggers_suspended
+from apps.stock.views import stock_in_list_view
+from apps.stock.views.stock_in import STOCK_IN_LIST_ORDERING
+
+
+class Command(BaseCommand):
+    help = '在合成数据上对比入库列表页码分页与游标分页的深页耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='合成的入库记录数')
+        parser.add_argument('--days', type=int, default=90, help='记录分布的天数（截至现在）')
+        parser.add_argument('--page-size', type=int, default=10, help='每页行数')
+        parser.add_argument('--repeat', type=int, default=5, help='每页的请求次数')
+        parser.add_argument('--count', choices=COUNT_MODES, default='exact', help='页码分页的总数计数方式')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('分页对比需要 PostgreSQL')
+        rows, page_size = options['rows'], options['page_size']
+        pages = [page for page in (10 ** n for n in range(7)) if (page - 1) * page_size < rows]
+        stock = Stock.objects.create(material_code=f"BENCH-{int(time.time())}", material_name='分页压测物料')
+        try:
+            started = time.perf_counter()
+            self._load(stock, rows, options['days'])
+            self.stdout.write(f"合成 {rows} 条入库记录，装载耗时 {time.perf_counter() - started:.1f}s")
+            self.stdout.write(f"{'页码':>10}{'页码分页(ms)':>14}{'游标分页(ms)':>14}")
+            for page in pages:
+                offset_ms = self._time({"page": page, "page_size": page_size, "count": options['count']},
+                                       options['repeat'])
+                cursor_ms = self._time({"cursor": self._cursor_before(page, page_size), "page_size": page_size},
+                                       options['repeat'])
+                self.stdout.write(f"{page:>10}{offset_ms:>14.1f}{cursor_ms:>14.1f}")
+        finally:
+            with balance_triggers_suspended(), connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {StockIn._meta.db_table} WHERE stock_id = %s", [stock.pk])
+            stock.delete()
+
+    def _load(self, stock, rows, days):
+        end = timezone.now()
+        start = end - timedelta(days=days)
+        if is_partitioned(StockIn._meta.db_table):
+            ensure_partitions(month_of(start), month_of(end))
+        with balance_triggers_suspended(), connection.cursor() as cursor:
+            # 记录均匀分布在 [start, end) 内，约每 3 条同一时刻
+            cursor.execute(
+                f"INSERT INTO {StockIn._meta.db_table} (bill_no, stock_id, material_code, material_name, supplier,"
+                " in_time, in_quantity, in_value, in_type, operator, remark, version, created_at)"
+                " SELECT %s || n, %s, %s, %s, '', to_timestamp(%s + (n / 3) * 3 * %s), 1, 1, 'other', '', '', 0, now()"
+                " FROM generate_series(0, %s - 1) AS n",
+                [f"{stock.material_code}-", stock.pk, stock.material_code, stock.material_name,
+                 start.timestamp(), (end - start).total_seconds() / rows, rows],
+            )
+            cursor.execute(f"ANALYZE {StockIn._meta.db_table}")
+
+    @staticmethod
+    def _cursor_before(page, page_size):
+        """第 page 页的游标：第 page - 1 页最后一行生成的 next_cursor，首页为空串"""
+        if page == 1:
+            return ""
+        last = StockIn.objects.order_by(*STOCK_IN_LIST_ORDERING)[(page - 1) * page_size - 1]
+        return encode_keyset_cursor(last, STOCK_IN_LIST_ORDERING)
+
+    @staticmethod
+    def _time(params, repeat):
+        factory = RequestFactory()
+        user = User(username='benchmark', is_superuser=True)
+        durations = []
+        for _ in range(repeat):
+            request = factory.get('/', params)
+            request.user = user
+            started = time.perf_counter()
+            response = stock_in_list_view(request)
+            durations.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                raise CommandError(response.content.decode('utf-8'))
+        return statistics.median(durations)
@@ -0,0 +1,140 @@
+"""
+出入库分区性能对比（PostgreSQL）
+
+生成多年的合成出入库数据，分别写入普通表与按月分区表（结构同 stock_in），
+执行统计、月报视图中的按时间范围查询，输出耗时中位数及扫描的表/分区数。结束后删除临时表。
+
+    python manage.py benchmark_partitions --years 3 --rows-per-day 2000
+"""
+import json
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from apps.stock.closing import month_range, next_month
+from apps.stock.utils import day_range
+
+PLAIN_TABLE = 'bench_movement_plain'
+PARTITIONED_TABLE = 'bench_movement_partitioned'
+
+
+class Command(BaseCommand):
+    help = '在合成的多年数据上对比普通表与按月分区表的按时间范围查询'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=3, help='合成数据的年数')
+        parser.add_argument('--rows-per-day', type=int, default=1000, help='每天的记录数')
+        parser.add_argument('--repeat', type=int, default=5, help='每条查询的执行次数')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('分区对比需要 PostgreSQL')
+        today = timezone.localdate()
+        first_month = today.replace(day=1)
+        for _ in range(options['years'] * 12):
+            first_month = (first_month - timedelta(days=1)).replace(day=1)
+
+        try:
+            started = time.perf_counter()
+            rows = self._load(first_month, today, options['rows_per_day'])
+            self.stdout.write(f"合成 {rows} 行（{first_month:%Y-%m} 至今），装载耗时 {time.perf_counter() - started:.1f}s")
+            self._report(self._queries(today), options['repeat'])
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {PLAIN_TABLE}, {PARTITIONED_TABLE}")
+
+    def _load(self, first_month, today, rows_per_day):
+        start = month_range(first_month)[0]
+        end = day_range(today)[1]
+        columns = (
+            "id bigint NOT NULL, stock_id bigint NOT NULL, in_time timestamptz NOT NULL,"
+            " in_quantity integer NOT NULL, in_value numeric(12, 2) NOT NULL"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {PLAIN_TABLE}, {PARTITIONED_TABLE}")
+            cursor.execute(f"CREATE TABLE {PLAIN_TABLE} ({columns}, PRIMARY KEY (id))")
+            cursor.execute(f"CREATE TABLE {PARTITIONED_TABLE} ({columns}, PRIMARY KEY (id, in_time))"
+                           f" PARTITION BY RANGE (in_time)")
+            month = first_month
+            while month <= today:
+                month_start, month_end = month_range(month)
+                cursor.execute(
+                    f"CREATE TABLE {PARTITIONED_TABLE}_p{month:%Y%m} PARTITION OF {PARTITIONED_TABLE}"
+                    f" FOR VALUES FROM (%s) TO (%s)",
+                    [month_start, month_end],
+                )
+                month = next_month(month)
+            # 记录均匀分布在 [start, end) 内
+            total = (end - start).days * rows_per_day
+            cursor.execute(
+                f"INSERT INTO {PLAIN_TABLE}"
+                f" SELECT n, 1 + n %% 500, to_timestamp(%s + n * %s), 1 + n %% 20, (1 + n %% 20) * 1.5"
+                f" FROM generate_series(0, %s - 1) AS n",
+                [start.timestamp(), (end - start).total_seconds() / total, total],
+            )
+            cursor.execute(f"INSERT INTO {PARTITIONED_TABLE} SELECT * FROM {PLAIN_TABLE}")
+            for table in (PLAIN_TABLE, PARTITIONED_TABLE):
+                cursor.execute(f"CREATE INDEX ON {table} (stock_id)")
+                cursor.execute(f"ANALYZE {table}")
+            cursor.execute(f"SELECT count(*) FROM {PLAIN_TABLE}")
+            return cursor.fetchone()[0]
+
+    def _queries(self, today):
+        """与统计、月报视图相同形式的查询；{table} 替换为表名"""
+        today_start, today_end = day_range(today)
+        month_start, month_end = month_range(today.replace(day=1))
+        trend_start = day_range(today - timedelta(days=6))[0]
+        year_start = month_range((today.replace(day=1) - timedelta(days=365)).replace(day=1))[0]
+        tz = timezone.get_current_timezone_name()
+        return [
+            ("今日汇总", "SELECT count(*), sum(in_quantity), sum(in_value) FROM {table}"
+                       " WHERE in_time >= %s AND in_time < %s", [today_start, today_end]),
+            ("近 7 日趋势", "SELECT (in_time AT TIME ZONE %s)::date AS day, sum(in_quantity), sum(in_value)"
+                         " FROM {table} WHERE in_time >= %s GROUP BY day ORDER BY day", [tz, trend_start]),
+            ("当月明细", "SELECT stock_id, sum(in_quantity), sum(in_value) FROM {table}"
+                       " WHERE in_time >= %s AND in_time < %s GROUP BY stock_id", [month_start, month_end]),
+            ("近一年月报", "SELECT date_trunc('month', in_time AT TIME ZONE %s) AS month, count(*), sum(in_quantity)"
+                        " FROM {table} WHERE in_time >= %s GROUP BY month", [tz, year_start]),
+            ("按日期函数过滤（无法裁剪）", "SELECT count(*) FROM {table} WHERE (in_time AT TIME ZONE %s)::date >= %s",
+             [tz, today - timedelta(days=6)]),
+        ]
+
+    def _report(self, queries, repeat):
+        self.stdout.write(f"{'查询':<16}{'普通表(ms)':>12}{'分区表(ms)':>12}{'扫描分区':>10}")
+        for name, sql, params in queries:
+            timings = [self._time(sql.format(table=table), params, repeat) for table in (PLAIN_TABLE, PARTITIONED_TABLE)]
+            scanned = self._scanned_relations(sql.format(table=PARTITIONED_TABLE), params)
+            self.stdout.write(f"{name:<16}{timings[0]:>12.1f}{timings[1]:>12.1f}{scanned:>10}")
+
+    @staticmethod
+    def _time(sql, params, repeat):
+        durations = []
+        with connection.cursor() as cursor:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                durations.append((time.perf_counter() - started) * 1000)
+        return statistics.median(durations)
+
+    @staticmethod
+    def _scanned_relations(sql, params):
+        """执行计划中访问的分区数"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        relations = set()
+
+        def walk(node):
+            if 'Relation Name' in node:
+                relations.add(node['Relation Name'])
+            for child in node.get('Plans', []):
+                walk(child)
+        walk(plan[0]['Plan'])
+        return len(relations)
@@ -0,0 +1,149 @@
+"""
+物料模糊搜索性能对比（PostgreSQL + pg_trgm）
+
+生成合成的物料表与出入库流水表（中文物料名称），按列表接口 search 参数生成的
+UPPER(列::text) LIKE UPPER('%关键字%') 条件查询前 20 条及总数：先在无索引时执行（顺序扫描），
+再建立与迁移 0021 相同的三元组 GIN 索引后执行，并按相似度排序，输出耗时中位数与是否用到索引。
+结束后删除临时表。
+
+    python manage.py benchmark_search --materials 1000000 --movements 20000000
+"""
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from apps.stock.search import trigram_search_enabled
+
+MATERIAL_TABLE = 'bench_search_material'
+MOVEMENT_TABLE = 'bench_search_movement'
+SEARCH_COLUMNS = ('material_code', 'material_name')
+
+# 合成物料名称：材质 + 品名 + 规格
+MATERIALS = ['不锈钢', '碳钢', '铝合金', '黄铜', '尼龙', '镀锌', '铸铁', '合金钢']
+PRODUCTS = ['六角螺栓', '螺母', '平垫片', '深沟球轴承', '法兰', '球阀', '弯头', '压缩弹簧', '密封圈', '链条']
+
+# (说明, 关键字)
+SEARCH_TERMS = [
+    ("编码片段", "AT0012345"),
+    ("完整名称", "不锈钢六角螺栓M10"),
+    ("名称片段", "铝合金球阀"),
+    ("不存在的名称", "钛合金齿轮"),
+    ("两个字（无法用索引）", "轴承"),
+]
+
+
+class Command(BaseCommand):
+    help = '在合成数据上对比三元组索引前后的物料模糊搜索耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--materials', type=int, default=1_000_000, help='合成的物料数')
+        parser.add_argument('--movements', type=int, default=20_000_000, help='合成的出入库流水数')
+        parser.add_argument('--repeat', type=int, default=3, help='每条查询的执行次数')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('搜索对比需要 PostgreSQL')
+        if not trigram_search_enabled():
+            raise CommandError('数据库未安装 pg_trgm 扩展（CREATE EXTENSION pg_trgm）')
+        try:
+            started = time.perf_counter()
+            self._load(options['materials'], options['movements'])
+            self.stdout.write(f"合成 {options['materials']} 个物料、{options['movements']} 条流水，"
+                              f"装载耗时 {time.perf_counter() - started:.1f}s")
+            before = {table: self._run(table, ranked=False, repeat=options['repeat'])
+                      for table in (MATERIAL_TABLE, MOVEMENT_TABLE)}
+            started = time.perf_counter()
+            self._create_indexes()
+            self.stdout.write(f"建立三元组索引耗时 {time.perf_counter() - started:.1f}s")
+            after = {table: self._run(table, ranked=True, repeat=options['repeat'])
+                     for table in (MATERIAL_TABLE, MOVEMENT_TABLE)}
+            self._report(before, after)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {MATERIAL_TABLE}, {MOVEMENT_TABLE}")
+
+    def _load(self, materials, movements):
+        name = (
+            f"(ARRAY{MATERIALS!r})[1 + n % {len(MATERIALS)}]"
+            f" || (ARRAY{PRODUCTS!r})[1 + (n / {len(MATERIALS)}) % {len(PRODUCTS)}]"
+            f" || 'M' || (n % 50)"
+        ).replace('%', '%%')
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {MATERIAL_TABLE}, {MOVEMENT_TABLE}")
+            cursor.execute(f"CREATE TABLE {MATERIAL_TABLE} (id bigint PRIMARY KEY, material_code varchar(50),"
+                           f" material_name varchar(200))")
+            cursor.execute(f"CREATE TABLE {MOVEMENT_TABLE} (id bigint PRIMARY KEY, material_code varchar(50),"
+                           f" material_name varchar(200), operator varchar(50))")
+            cursor.execute(
+                f"INSERT INTO {MATERIAL_TABLE} SELECT n, 'MAT' || lpad(n::text, 7, '0'), {name}"
+                f" FROM generate_series(0, %s - 1) AS n",
+                [materials],
+            )
+            # 流水的物料取自物料表（按 id 取模），冗余编码与名称
+            cursor.execute(
+                f"INSERT INTO {MOVEMENT_TABLE}"
+                f" SELECT s.n, m.material_code, m.material_name, '操作员' || (s.n %% 30)"
+                f" FROM generate_series(0, %s - 1) AS s(n) JOIN {MATERIAL_TABLE} m ON m.id = s.n %% %s",
+                [movements, materials],
+            )
+            for table in (MATERIAL_TABLE, MOVEMENT_TABLE):
+                cursor.execute(f"ANALYZE {table}")
+
+    def _create_indexes(self):
+        with connection.cursor() as cursor:
+            for table in (MATERIAL_TABLE, MOVEMENT_TABLE):
+                for column in SEARCH_COLUMNS:
+                    cursor.execute(f"CREATE INDEX ON {table} USING gin ((UPPER({column}::text)) gin_trgm_ops)")
+                cursor.execute(f"ANALYZE {table}")
+
+    @staticmethod
+    def _queries(table, term, ranked):
+        """与列表接口相同形式的搜索条件：取前 20 条（有索引时按相似度排序）与总数"""
+        where = " OR ".join(f"UPPER({column}::text) LIKE UPPER(%s)" for column in SEARCH_COLUMNS)
+        params = [f"%{term}%"] * len(SEARCH_COLUMNS)
+        if ranked:
+            rank = f"GREATEST({', '.join(f'similarity({column}, %s)' for column in SEARCH_COLUMNS)})"
+            page = (f"SELECT id, material_code, material_name FROM {table} WHERE {where}"
+                    f" ORDER BY {rank} DESC, id DESC LIMIT 20", params + [term] * len(SEARCH_COLUMNS))
+        else:
+            page = (f"SELECT id, material_code, material_name FROM {table} WHERE {where}"
+                    f" ORDER BY id DESC LIMIT 20", params)
+        return [page, (f"SELECT count(*) FROM {table} WHERE {where}", params)]
+
+    def _run(self, table, ranked, repeat):
+        """各关键字 -> (耗时中位数 ms, 命中行数, 是否用到三元组索引)"""
+        results = {}
+        for _, term in SEARCH_TERMS:
+            durations = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                with connection.cursor() as cursor:
+                    for sql, params in self._queries(table, term, ranked):
+                        cursor.execute(sql, params)
+                        rows = cursor.fetchall()
+                durations.append((time.perf_counter() - started) * 1000)
+            count_sql, count_params = self._queries(table, term, ranked)[1]
+            results[term] = (statistics.median(durations), rows[0][0], self._uses_index(count_sql, count_params))
+        return results
+
+    @staticmethod
+    def _uses_index(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return 'Bitmap Index Scan' in json.dumps(plan)
+
+    def _report(self, before, after):
+        for table, label in ((MATERIAL_TABLE, '物料表'), (MOVEMENT_TABLE, '流水表')):
+            self.stdout.write(f"\n{label}")
+            self.stdout.write(f"{'关键字':<24}{'命中行数':>10}{'无索引(ms)':>12}{'三元组索引(ms)':>16}{'用到索引':>10}")
+            for description, term in SEARCH_TERMS:
+                scan_ms, count, _ = before[table][term]
+                index_ms, _, used = after[table][term]
+                self.stdout.write(f"{description:<24}{count:>10}{scan_ms:>12.1f}{index_ms:>16.1f}"
+                                  f"{'是' if used else '否':>10}")
@@ -0,0 +1,47 @@
+"""
+月末结账，锁定期间并写入月结快照（建议每月一日凌晨定时执行）
+
+    python manage.py close_month                    # 结上月
+    python manage.py close_month --month 2024-06    # 结指定月份（须按月份顺序）
+    python manage.py close_month --month 2024-06 --reopen --reason "补录采购单"   # 反结账
+"""
+import getpass
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.stock.closing import close_month, parse_month, reopen_month
+
+
+class Command(BaseCommand):
+    help = '结账指定月份（默认上月），写入各物料的期初、入库、出库与期末快照；或反结账最近一个已结账月份'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='月份（YYYY-MM），默认上月')
+        parser.add_argument('--reopen', action='store_true', help='反结账')
+        parser.add_argument('--reason', default='', help='反结账原因（必填）')
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                month = parse_month(options['month'])
+            except ValueError:
+                raise CommandError('月份格式错误，应为 YYYY-MM')
+        elif options['reopen']:
+            raise CommandError('反结账时需要指定 --month')
+        else:
+            month = (timezone.localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+
+        operator = getpass.getuser()
+        try:
+            if options['reopen']:
+                reopen_month(month, operator, options['reason'].strip())
+            else:
+                count = close_month(month, operator=operator)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['reopen']:
+            self.stdout.write(self.style.SUCCESS(f'{month:%Y-%m} 已反结账'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{month:%Y-%m} 已结账，共 {count} 个物料'))
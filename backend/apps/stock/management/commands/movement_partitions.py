@@ -0,0 +1,32 @@
+"""
+出入库表分区维护（建议每月定时执行）
+
+    python manage.py movement_partitions              # 建好当前月之后 3 个月的分区
+    python manage.py movement_partitions --ahead 12
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from apps.stock.closing import next_month
+from apps.stock.partitioning import DEFAULT_MONTHS_AHEAD, PARTITIONED_TABLES, ensure_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = '为出入库分区表提前创建月份分区，并把默认分区中的记录迁入对应月份分区'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=DEFAULT_MONTHS_AHEAD, help='提前创建的月份数')
+
+    def handle(self, *args, **options):
+        if options['ahead'] < 0:
+            raise CommandError('--ahead 不能为负数')
+        if not all(is_partitioned(table) for table in PARTITIONED_TABLES):
+            raise CommandError('出入库表不是分区表（仅 PostgreSQL 在迁移时启用分区）')
+        first_month = timezone.localdate().replace(day=1)
+        last_month = first_month
+        for _ in range(options['ahead']):
+            last_month = next_month(last_month)
+        created = ensure_partitions(first_month, last_month)
+        for name in created:
+            self.stdout.write(f'  新建分区 {name}')
+        self.stdout.write(self.style.SUCCESS(f'分区已就绪，新建 {len(created)} 个'))
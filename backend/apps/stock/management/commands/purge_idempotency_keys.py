@@ -0,0 +1,14 @@
+"""
+清理过期的幂等键
+"""
+from django.core.management.base import BaseCommand
+
+from apps.stock.idempotency import purge_expired_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = '清理超过有效期的 Idempotency-Key 记录'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_idempotency_keys()
+        self.stdout.write(self.style.SUCCESS(f'已清理 {deleted} 条过期幂等键'))
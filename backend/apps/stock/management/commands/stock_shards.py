@@ -0,0 +1,39 @@
+"""
+热点物料分片余额管理
+
+    python manage.py stock_shards M001 --shards 8   # 开启或调整分片数
+    python manage.py stock_shards M001 --shards 0   # 关闭分片，余额折叠回 Stock 行
+    python manage.py stock_shards --rebalance       # 重新分摊全部分片物料（建议定时执行）
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.stock.models import Stock
+from apps.stock.sharding import rebalance_stock_shards, set_shard_count
+
+
+class Command(BaseCommand):
+    help = '为热点物料开启/关闭分片余额，或重新分摊分片子余额'
+
+    def add_arguments(self, parser):
+        parser.add_argument('material_codes', nargs='*', help='物料编号')
+        parser.add_argument('--shards', type=int, help='分片数，0 表示关闭分片')
+        parser.add_argument('--rebalance', action='store_true', help='重新分摊分片子余额')
+
+    def handle(self, *args, **options):
+        material_codes = options['material_codes']
+        if options['shards'] is not None:
+            if not material_codes:
+                raise CommandError('设置分片数时需要指定物料编号')
+            for material_code in material_codes:
+                try:
+                    set_shard_count(material_code, options['shards'])
+                except Stock.DoesNotExist:
+                    raise CommandError(f'物料 {material_code} 不存在')
+                except ValueError as exc:
+                    raise CommandError(str(exc))
+                self.stdout.write(self.style.SUCCESS(f'物料 {material_code} 分片数已设置为 {options["shards"]}'))
+        elif options['rebalance']:
+            count = rebalance_stock_shards(material_codes or None)
+            self.stdout.write(self.style.SUCCESS(f'已重新分摊 {count} 个分片物料'))
+        else:
+            raise CommandError('请指定 --shards 或 --rebalance')
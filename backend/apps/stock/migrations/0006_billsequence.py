@@ -0,0 +1,78 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:00
+
+from datetime import datetime
+
+from django.db import migrations, models
+
+
+def seed_bill_sequence(apps, schema_editor):
+    """根据已有单据号初始化计数器，避免上线当天与历史单据号冲突"""
+    BillSequence = apps.get_model("stock", "BillSequence")
+    sources = [
+        (apps.get_model("stock", "StockIn"), "bill_no"),
+        (apps.get_model("stock", "StockOut"), "bill_no"),
+        (apps.get_model("stock", "StockCountTask"), "task_no"),
+    ]
+
+    last_nos = {}
+    for model_class, field in sources:
+        for no in model_class.objects.values_list(field, flat=True).iterator():
+            parts = (no or "").split("-")
+            if len(parts) != 3:
+                continue
+            try:
+                biz_date = datetime.strptime(parts[1], "%Y%m%d").date()
+                seq = int(parts[2])
+            except ValueError:
+                continue
+            key = (parts[0], biz_date)
+            last_nos[key] = max(last_nos.get(key, 0), seq)
+
+    BillSequence.objects.bulk_create(
+        [
+            BillSequence(prefix=prefix, biz_date=biz_date, last_no=last_no)
+            for (prefix, biz_date), last_no in last_nos.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0005_stockcounttask_stockcountitem"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BillSequence",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("prefix", models.CharField(max_length=10, verbose_name="单据前缀")),
+                ("biz_date", models.DateField(verbose_name="业务日期")),
+                (
+                    "last_no",
+                    models.IntegerField(default=0, verbose_name="已分配的最大序号"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="更新时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "单据号计数器",
+                "verbose_name_plural": "单据号计数器",
+                "db_table": "bill_sequence",
+                "unique_together": {("prefix", "biz_date")},
+            },
+        ),
+        migrations.RunPython(seed_bill_sequence, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0006_billsequence"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scope", models.CharField(max_length=100, verbose_name="作用域")),
+                ("key", models.CharField(max_length=100, verbose_name="幂等键")),
+                (
+                    "status_code",
+                    models.SmallIntegerField(
+                        blank=True, null=True, verbose_name="响应状态码"
+                    ),
+                ),
+                (
+                    "response_body",
+                    models.TextField(blank=True, default="", verbose_name="响应内容"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, db_index=True, verbose_name="创建时间"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "幂等键",
+                "verbose_name_plural": "幂等键",
+                "db_table": "idempotency_key",
+                "unique_together": {("scope", "key")},
+            },
+        ),
+    ]
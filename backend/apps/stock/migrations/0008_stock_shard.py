@@ -0,0 +1,61 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0007_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stock",
+            name="shard_count",
+            field=models.PositiveSmallIntegerField(
+                default=0, verbose_name="余额分片数"
+            ),
+        ),
+        migrations.CreateModel(
+            name="StockShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("shard_no", models.PositiveSmallIntegerField(verbose_name="分片序号")),
+                ("quantity", models.IntegerField(default=0, verbose_name="分片数量")),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=2,
+                        default=0,
+                        max_digits=12,
+                        verbose_name="分片价值",
+                    ),
+                ),
+                (
+                    "stock",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="shards",
+                        to="stock.stock",
+                        verbose_name="关联库存",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "库存分片余额",
+                "verbose_name_plural": "库存分片余额",
+                "db_table": "stock_shard",
+                "unique_together": {("stock", "shard_no")},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0008_stock_shard"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stock",
+            name="version",
+            field=models.PositiveIntegerField(default=0, verbose_name="版本号"),
+        ),
+        migrations.AddField(
+            model_name="stockin",
+            name="version",
+            field=models.PositiveIntegerField(default=0, verbose_name="版本号"),
+        ),
+        migrations.AddField(
+            model_name="stockout",
+            name="version",
+            field=models.PositiveIntegerField(default=0, verbose_name="版本号"),
+        ),
+    ]
@@ -0,0 +1,226 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:26
+
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_ledger(apps, schema_editor):
+    """
+    按业务时间把已有出入库记录补记到流水账
+
+    结存由当前余额倒推；历史记录之和与当前余额不一致（如直接初始化了库存）时，
+    差额作为第一条期初分录。
+    """
+    Stock = apps.get_model("stock", "Stock")
+    StockIn = apps.get_model("stock", "StockIn")
+    StockOut = apps.get_model("stock", "StockOut")
+    StockShard = apps.get_model("stock", "StockShard")
+    StockLedger = apps.get_model("stock", "StockLedger")
+
+    for stock in Stock.objects.all().iterator():
+        movements = [
+            (
+                r.in_time,
+                r.pk,
+                "in",
+                "stock_in",
+                r.pk,
+                r.bill_no,
+                r.in_quantity,
+                r.in_value,
+            )
+            for r in StockIn.objects.filter(stock=stock)
+        ] + [
+            (
+                r.out_time,
+                r.pk,
+                "out",
+                "stock_out",
+                r.pk,
+                r.bill_no,
+                -r.out_quantity,
+                -r.out_value,
+            )
+            for r in StockOut.objects.filter(stock=stock)
+        ]
+        movements.sort(key=lambda m: (m[0], m[2], m[1]))
+
+        shards = StockShard.objects.filter(stock=stock).aggregate(
+            quantity=models.Sum("quantity"), value=models.Sum("value")
+        )
+        balance_quantity = stock.current_stock + (shards["quantity"] or 0)
+        balance_value = stock.stock_value + (shards["value"] or Decimal("0"))
+        opening_quantity = balance_quantity - sum(m[6] for m in movements)
+        opening_value = balance_value - sum((m[7] for m in movements), Decimal("0"))
+
+        entries = []
+        if opening_quantity or opening_value:
+            entries.append(
+                StockLedger(
+                    stock=stock,
+                    entry_type="opening",
+                    source_type="stock",
+                    source_id=stock.pk,
+                    quantity=opening_quantity,
+                    value=opening_value,
+                    occurred_at=movements[0][0] if movements else stock.created_at,
+                )
+            )
+        for (
+            occurred_at,
+            _,
+            entry_type,
+            source_type,
+            source_id,
+            bill_no,
+            quantity,
+            value,
+        ) in movements:
+            entries.append(
+                StockLedger(
+                    stock=stock,
+                    entry_type=entry_type,
+                    source_type=source_type,
+                    source_id=source_id,
+                    bill_no=bill_no,
+                    quantity=quantity,
+                    value=value,
+                    occurred_at=occurred_at,
+                )
+            )
+
+        running_quantity, running_value = 0, Decimal("0")
+        for sequence, entry in enumerate(entries, 1):
+            running_quantity += entry.quantity
+            running_value += entry.value
+            entry.sequence = sequence
+            entry.balance_quantity, entry.balance_value = (
+                running_quantity,
+                running_value,
+            )
+        StockLedger.objects.bulk_create(entries, batch_size=1000)
+        Stock.objects.filter(pk=stock.pk).update(ledger_seq=len(entries))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0009_movement_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stock",
+            name="ledger_seq",
+            field=models.PositiveBigIntegerField(
+                default=0, verbose_name="流水账顺序号"
+            ),
+        ),
+        migrations.CreateModel(
+            name="StockLedger",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "sequence",
+                    models.PositiveBigIntegerField(
+                        blank=True, null=True, verbose_name="顺序号"
+                    ),
+                ),
+                (
+                    "entry_type",
+                    models.CharField(
+                        choices=[
+                            ("opening", "期初"),
+                            ("in", "入库"),
+                            ("out", "出库"),
+                            ("reversal", "冲销"),
+                        ],
+                        max_length=10,
+                        verbose_name="分录类型",
+                    ),
+                ),
+                (
+                    "source_type",
+                    models.CharField(
+                        choices=[
+                            ("stock", "库存"),
+                            ("stock_in", "入库单"),
+                            ("stock_out", "出库单"),
+                        ],
+                        max_length=10,
+                        verbose_name="来源类型",
+                    ),
+                ),
+                (
+                    "source_id",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="来源记录ID"
+                    ),
+                ),
+                (
+                    "bill_no",
+                    models.CharField(
+                        blank=True, default="", max_length=30, verbose_name="单据号"
+                    ),
+                ),
+                ("quantity", models.IntegerField(verbose_name="变动数量")),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="变动价值"
+                    ),
+                ),
+                (
+                    "balance_quantity",
+                    models.IntegerField(blank=True, null=True, verbose_name="结存数量"),
+                ),
+                (
+                    "balance_value",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=12,
+                        null=True,
+                        verbose_name="结存价值",
+                    ),
+                ),
+                ("occurred_at", models.DateTimeField(verbose_name="业务时间")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="记账时间"),
+                ),
+                (
+                    "stock",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_entries",
+                        to="stock.stock",
+                        verbose_name="关联库存",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "库存流水账",
+                "verbose_name_plural": "库存流水账",
+                "db_table": "stock_ledger",
+                "indexes": [
+                    models.Index(
+                        fields=["source_type", "source_id"],
+                        name="stock_ledger_source_idx",
+                    )
+                ],
+                "unique_together": {("stock", "sequence")},
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0010_stockledger"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BalanceCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("as_of", models.DateTimeField(verbose_name="检查点时间")),
+                ("quantity", models.IntegerField(verbose_name="结存数量")),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="结存价值"
+                    ),
+                ),
+                ("ledger_id", models.BigIntegerField(verbose_name="流水账高水位")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="生成时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "库存余额检查点",
+                "verbose_name_plural": "库存余额检查点",
+                "db_table": "balance_checkpoint",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="stockledger",
+            index=models.Index(
+                fields=["occurred_at"], name="stock_ledger_occurred_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="balancecheckpoint",
+            name="stock",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="checkpoints",
+                to="stock.stock",
+                verbose_name="关联库存",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="balancecheckpoint",
+            unique_together={("as_of", "stock")},
+        ),
+    ]
@@ -0,0 +1,86 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0011_balancecheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyClosing",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField(verbose_name="月份")),
+                (
+                    "material_code",
+                    models.CharField(max_length=50, verbose_name="物料编号"),
+                ),
+                (
+                    "material_name",
+                    models.CharField(max_length=100, verbose_name="物料名称"),
+                ),
+                ("opening_quantity", models.IntegerField(verbose_name="期初数量")),
+                (
+                    "opening_value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="期初价值"
+                    ),
+                ),
+                ("in_count", models.IntegerField(verbose_name="入库笔数")),
+                ("in_quantity", models.IntegerField(verbose_name="入库数量")),
+                (
+                    "in_value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="入库价值"
+                    ),
+                ),
+                ("out_count", models.IntegerField(verbose_name="出库笔数")),
+                ("out_quantity", models.IntegerField(verbose_name="出库数量")),
+                (
+                    "out_value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="出库价值"
+                    ),
+                ),
+                ("closing_quantity", models.IntegerField(verbose_name="期末数量")),
+                (
+                    "closing_value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="期末价值"
+                    ),
+                ),
+                (
+                    "closed_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="结账时间"),
+                ),
+                (
+                    "stock",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="monthly_closings",
+                        to="stock.stock",
+                        verbose_name="关联库存",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "月结快照",
+                "verbose_name_plural": "月结快照",
+                "db_table": "monthly_closing",
+                "unique_together": {("month", "stock")},
+            },
+        ),
+    ]
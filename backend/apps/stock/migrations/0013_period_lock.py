@@ -0,0 +1,129 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:38
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0012_monthlyclosing"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClosedPeriod",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField(unique=True, verbose_name="月份")),
+                (
+                    "closed_by",
+                    models.CharField(
+                        blank=True, default="", max_length=150, verbose_name="结账人"
+                    ),
+                ),
+                (
+                    "closed_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="结账时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "已结账期间",
+                "verbose_name_plural": "已结账期间",
+                "db_table": "closed_period",
+            },
+        ),
+        migrations.CreateModel(
+            name="PeriodAuditLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("month", models.DateField(verbose_name="月份")),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[("close", "结账"), ("reopen", "反结账")],
+                        max_length=10,
+                        verbose_name="操作",
+                    ),
+                ),
+                (
+                    "operator",
+                    models.CharField(
+                        blank=True, default="", max_length=150, verbose_name="操作人"
+                    ),
+                ),
+                (
+                    "reason",
+                    models.TextField(blank=True, default="", verbose_name="原因"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="操作时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "结账操作记录",
+                "verbose_name_plural": "结账操作记录",
+                "db_table": "period_audit_log",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.CreateModel(
+            name="PeriodReportCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=50, verbose_name="报表标识")),
+                (
+                    "payload",
+                    models.JSONField(
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        verbose_name="报表结果",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="生成时间"),
+                ),
+                (
+                    "period",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="report_cache",
+                        to="stock.closedperiod",
+                        verbose_name="期间",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "期间报表缓存",
+                "verbose_name_plural": "期间报表缓存",
+                "db_table": "period_report_cache",
+                "unique_together": {("period", "key")},
+            },
+        ),
+    ]
@@ -0,0 +1,147 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:42
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+# 迁移只依赖本文件中的定义：以下为编写时 apps.stock.partitioning / closing 中对应逻辑的副本，
+# 之后这些模块的修改不影响本迁移
+PARTITIONED_TABLES = {
+    "stock_in": "in_time",
+    "stock_out": "out_time",
+}
+MONTHS_AHEAD = 3
+
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def month_range(month):
+    """month 月在当前时区下的起止时间 [start, end)"""
+    start = timezone.make_aware(datetime(month.year, month.month, 1))
+    following = next_month(month)
+    return start, timezone.make_aware(datetime(following.year, following.month, 1))
+
+
+def month_of(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def convert_to_partitioned(cursor, table, first_month, last_month):
+    """
+    把普通表 table 改为按月分区的分区表，保留全部记录、id 序列、外键与索引
+
+    建 [first_month, last_month] 各月分区及默认分区后整表复制；
+    不含分区键的唯一索引（单据号）改为普通索引，主键改为 (id, 分区键)。
+    """
+    column = PARTITIONED_TABLES[table]
+    legacy = f"{table}_unpartitioned"
+    cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s AND indexname <> %s",
+        [table, f"{table}_pkey"],
+    )
+    indexes = cursor.fetchall()
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint"
+        " WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [table],
+    )
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    cursor.execute(
+        f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS)"
+        f" PARTITION BY RANGE ({column})"
+    )
+    cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    month = first_month
+    while month <= last_month:
+        start, end = month_range(month)
+        cursor.execute(
+            f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+            [start, end],
+        )
+        month = next_month(month)
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), GREATEST(COALESCE(MAX(id), 0), 1), MAX(id) IS NOT NULL)"
+        f" FROM {table}",
+        [table],
+    )
+    cursor.execute(f"DROP TABLE {legacy}")
+
+    cursor.execute(
+        f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY (id, {column})"
+    )
+    # 索引定义取自改名之前，仍指向 table
+    for name, definition in indexes:
+        if definition.startswith("CREATE UNIQUE INDEX") and column not in definition:
+            definition = definition.replace("CREATE UNIQUE INDEX", "CREATE INDEX", 1)
+        cursor.execute(definition)
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+def partition_movement_tables(apps, schema_editor):
+    """
+    PostgreSQL 上把 stock_in / stock_out 改为按月分区，已有记录原样迁入
+
+    为最早一条记录所在月份至当前月之后 MONTHS_AHEAD 个月建分区；其他数据库不做处理，
+    单据号保留原唯一约束。分区无法自动还原为普通表，本迁移不可回滚。
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    current = timezone.localdate().replace(day=1)
+    last_month = current
+    for _ in range(MONTHS_AHEAD):
+        last_month = next_month(last_month)
+    with schema_editor.connection.cursor() as cursor:
+        for table, column in PARTITIONED_TABLES.items():
+            if is_partitioned(cursor, table):
+                continue
+            cursor.execute(f"SELECT MIN({column}) FROM {table}")
+            earliest = cursor.fetchone()[0]
+            first_month = min(month_of(earliest), current) if earliest else current
+            convert_to_partitioned(cursor, table, first_month, last_month)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0013_period_lock"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="stockin",
+                    name="bill_no",
+                    field=models.CharField(
+                        db_index=True, default="", max_length=30, verbose_name="单据号"
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="stockout",
+                    name="bill_no",
+                    field=models.CharField(
+                        db_index=True, default="", max_length=30, verbose_name="单据号"
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(partition_movement_tables),
+            ],
+        ),
+    ]
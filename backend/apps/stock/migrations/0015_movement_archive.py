@@ -0,0 +1,104 @@
+# Generated by Django 4.2.30 on 2026-10-17 19:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0014_partition_movements"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MovementArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "direction",
+                    models.CharField(
+                        choices=[("in", "入库"), ("out", "出库")],
+                        max_length=10,
+                        verbose_name="方向",
+                    ),
+                ),
+                ("month", models.DateField(verbose_name="月份")),
+                ("path", models.CharField(max_length=255, verbose_name="归档文件")),
+                ("row_count", models.IntegerField(verbose_name="记录数")),
+                ("checksum", models.CharField(max_length=64, verbose_name="SHA-256")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="归档时间"),
+                ),
+            ],
+            options={
+                "verbose_name": "出入库归档",
+                "verbose_name_plural": "出入库归档",
+                "db_table": "movement_archive",
+                "unique_together": {("direction", "month")},
+            },
+        ),
+        migrations.CreateModel(
+            name="ArchivedMovementSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "direction",
+                    models.CharField(
+                        choices=[("in", "入库"), ("out", "出库")],
+                        max_length=10,
+                        verbose_name="方向",
+                    ),
+                ),
+                ("day", models.DateField(verbose_name="日期")),
+                (
+                    "material_code",
+                    models.CharField(max_length=50, verbose_name="物料编号"),
+                ),
+                (
+                    "material_name",
+                    models.CharField(max_length=100, verbose_name="物料名称"),
+                ),
+                ("count", models.IntegerField(verbose_name="笔数")),
+                ("quantity", models.IntegerField(verbose_name="数量")),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=14, verbose_name="价值"
+                    ),
+                ),
+                (
+                    "stock",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_summaries",
+                        to="stock.stock",
+                        verbose_name="关联库存",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "归档出入库汇总",
+                "verbose_name_plural": "归档出入库汇总",
+                "db_table": "archived_movement_summary",
+                "unique_together": {("direction", "day", "stock")},
+            },
+        ),
+    ]
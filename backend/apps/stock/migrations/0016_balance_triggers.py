@@ -0,0 +1,155 @@
+from django.db import migrations
+
+# 按条件调整一个物料的余额并追加流水账分录（数量、价值带符号，出库为负）。
+# 先锁定库存行再读取分片子余额，余额校验按精确余额进行；校验不通过时以 check_violation 报错。
+POST_ENTRIES_FUNCTION = """
+CREATE OR REPLACE FUNCTION stock_post_entries(
+    p_stock_id bigint, p_check_max boolean, p_entry_types text[], p_source_type text, p_source_id bigint,
+    p_bill_no text, p_quantities integer[], p_values numeric[], p_occurred_at timestamptz[]
+) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    v_count integer := array_length(p_quantities, 1);
+    v_quantity integer;
+    v_value numeric;
+    v_shard_count integer;
+    v_shard_quantity integer := 0;
+    v_shard_value numeric := 0;
+    v_balance_quantity integer;
+    v_balance_value numeric;
+    v_sequence bigint;
+BEGIN
+    SELECT sum(q), sum(v) INTO v_quantity, v_value FROM unnest(p_quantities, p_values) AS t(q, v);
+    SELECT shard_count INTO v_shard_count FROM stock WHERE id = p_stock_id FOR NO KEY UPDATE;
+    IF v_shard_count > 0 THEN
+        SELECT COALESCE(sum(quantity), 0), COALESCE(sum(value), 0) INTO v_shard_quantity, v_shard_value
+          FROM stock_shard WHERE stock_id = p_stock_id;
+    END IF;
+
+    UPDATE stock
+       SET current_stock = current_stock + v_quantity,
+           stock_value = stock_value + v_value,
+           ledger_seq = ledger_seq + v_count,
+           version = version + 1,
+           updated_at = now()
+     WHERE id = p_stock_id
+       AND (v_quantity >= 0 OR current_stock + v_shard_quantity + v_quantity >= 0)
+       AND (NOT p_check_max OR max_stock <= 0 OR current_stock + v_shard_quantity + v_quantity <= max_stock)
+    RETURNING current_stock + v_shard_quantity - v_quantity, stock_value + v_shard_value - v_value,
+              ledger_seq - v_count
+      INTO v_balance_quantity, v_balance_value, v_sequence;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION USING ERRCODE = 'check_violation', MESSAGE = 'stock balance check failed: ' || p_stock_id;
+    END IF;
+
+    FOR i IN 1..v_count LOOP
+        v_balance_quantity := v_balance_quantity + p_quantities[i];
+        v_balance_value := v_balance_value + p_values[i];
+        v_sequence := v_sequence + 1;
+        INSERT INTO stock_ledger (
+            stock_id, sequence, entry_type, source_type, source_id, bill_no, quantity, value,
+            balance_quantity, balance_value, occurred_at, created_at
+        ) VALUES (
+            p_stock_id, v_sequence, p_entry_types[i], p_source_type, p_source_id, p_bill_no,
+            p_quantities[i], p_values[i], v_balance_quantity, v_balance_value, p_occurred_at[i], now()
+        );
+    END LOOP;
+END
+$$;
+"""
+
+# 出入库表的触发器函数：{table} 为表名，{sign} / {reverse} 为记账方向及其相反方向，{entry} 为分录类型，
+# {check_max} 为插入时是否校验最大库存
+MOVEMENT_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION {table}_balance_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF current_setting('kucun.balance_triggers', true) IS DISTINCT FROM 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        PERFORM stock_post_entries(
+            NEW.stock_id, {check_max}, ARRAY['{entry}'], '{table}', NEW.id, NEW.bill_no,
+            ARRAY[({sign}) * NEW.{prefix}_quantity], ARRAY[({sign}) * NEW.{prefix}_value], ARRAY[NEW.{prefix}_time]);
+    ELSIF TG_OP = 'DELETE' OR OLD.stock_id <> NEW.stock_id THEN
+        PERFORM stock_post_entries(
+            OLD.stock_id, false, ARRAY['reversal'], '{table}', OLD.id, OLD.bill_no,
+            ARRAY[({reverse}) * OLD.{prefix}_quantity], ARRAY[({reverse}) * OLD.{prefix}_value], ARRAY[OLD.{prefix}_time]);
+        IF TG_OP = 'UPDATE' THEN
+            PERFORM stock_post_entries(
+                NEW.stock_id, false, ARRAY['{entry}'], '{table}', NEW.id, NEW.bill_no,
+                ARRAY[({sign}) * NEW.{prefix}_quantity], ARRAY[({sign}) * NEW.{prefix}_value], ARRAY[NEW.{prefix}_time]);
+        END IF;
+    ELSE
+        -- 修改：先冲销原记录，再按修改后的数量/价值重新记账，余额按净额校验
+        PERFORM stock_post_entries(
+            NEW.stock_id, false, ARRAY['reversal', '{entry}'], '{table}', NEW.id, NEW.bill_no,
+            ARRAY[({reverse}) * OLD.{prefix}_quantity, ({sign}) * NEW.{prefix}_quantity],
+            ARRAY[({reverse}) * OLD.{prefix}_value, ({sign}) * NEW.{prefix}_value],
+            ARRAY[OLD.{prefix}_time, NEW.{prefix}_time]);
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER {table}_balance AFTER INSERT OR DELETE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION {table}_balance_trigger();
+CREATE TRIGGER {table}_balance_update AFTER UPDATE ON {table}
+    FOR EACH ROW
+    WHEN (OLD.{prefix}_quantity IS DISTINCT FROM NEW.{prefix}_quantity
+          OR OLD.{prefix}_value IS DISTINCT FROM NEW.{prefix}_value
+          OR OLD.stock_id IS DISTINCT FROM NEW.stock_id)
+    EXECUTE FUNCTION {table}_balance_trigger();
+"""
+
+MOVEMENT_TABLES = [
+    {
+        "table": "stock_in",
+        "prefix": "in",
+        "sign": "1",
+        "reverse": "-1",
+        "entry": "in",
+        "check_max": "NEW.in_type <> 'adjust_gain'",
+    },
+    {
+        "table": "stock_out",
+        "prefix": "out",
+        "sign": "-1",
+        "reverse": "1",
+        "entry": "out",
+        "check_max": "false",
+    },
+]
+
+
+def install_balance_triggers(apps, schema_editor):
+    """PostgreSQL 上安装维护库存余额的触发器（只在开启 kucun.balance_triggers 的连接上生效）"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(POST_ENTRIES_FUNCTION)
+    for options in MOVEMENT_TABLES:
+        schema_editor.execute(MOVEMENT_TRIGGER_FUNCTION.format(**options))
+
+
+def remove_balance_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for options in MOVEMENT_TABLES:
+        table = options["table"]
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_balance ON {table}")
+        schema_editor.execute(
+            f"DROP TRIGGER IF EXISTS {table}_balance_update ON {table}"
+        )
+        schema_editor.execute(f"DROP FUNCTION IF EXISTS {table}_balance_trigger()")
+    schema_editor.execute(
+        "DROP FUNCTION IF EXISTS stock_post_entries(bigint, boolean, text[], text, bigint, text, integer[], numeric[], timestamptz[])"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0015_movement_archive"),
+    ]
+
+    operations = [
+        migrations.RunPython(install_balance_triggers, remove_balance_triggers),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0016_balance_triggers"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="stockin",
+            index=models.Index(
+                fields=["stock", "in_time", "id"], name="stock_in_stock_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stockout",
+            index=models.Index(
+                fields=["stock", "out_time", "id"], name="stock_out_stock_time_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0017_movement_history_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="stockledger",
+            index=models.Index(
+                fields=["stock", "occurred_at"], name="stock_ledger_stock_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stockwarning",
+            index=models.Index(
+                fields=["stock", "status"], name="stock_warning_stock_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:28
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# 按精确余额（基础余额 + 分片子余额）回填库存状态，规则同 models.classify_stock_status
+BACKFILL_SQL = """
+UPDATE stock SET stock_status = CASE
+    WHEN min_stock > 0 AND current_stock + COALESCE(
+        (SELECT SUM(quantity) FROM stock_shard WHERE stock_shard.stock_id = stock.id), 0) <= min_stock THEN 'low'
+    WHEN max_stock > 0 AND current_stock + COALESCE(
+        (SELECT SUM(quantity) FROM stock_shard WHERE stock_shard.stock_id = stock.id), 0) >= max_stock THEN 'high'
+    ELSE 'normal' END
+"""
+
+# 触发器维护余额时，过账函数在同一条 UPDATE 中按过账后的精确余额重算库存状态
+POST_ENTRIES_FUNCTION = """
+CREATE OR REPLACE FUNCTION stock_post_entries(
+    p_stock_id bigint, p_check_max boolean, p_entry_types text[], p_source_type text, p_source_id bigint,
+    p_bill_no text, p_quantities integer[], p_values numeric[], p_occurred_at timestamptz[]
+) RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    v_count integer := array_length(p_quantities, 1);
+    v_quantity integer;
+    v_value numeric;
+    v_shard_count integer;
+    v_shard_quantity integer := 0;
+    v_shard_value numeric := 0;
+    v_balance_quantity integer;
+    v_balance_value numeric;
+    v_sequence bigint;
+BEGIN
+    SELECT sum(q), sum(v) INTO v_quantity, v_value FROM unnest(p_quantities, p_values) AS t(q, v);
+    SELECT shard_count INTO v_shard_count FROM stock WHERE id = p_stock_id FOR NO KEY UPDATE;
+    IF v_shard_count > 0 THEN
+        SELECT COALESCE(sum(quantity), 0), COALESCE(sum(value), 0) INTO v_shard_quantity, v_shard_value
+          FROM stock_shard WHERE stock_id = p_stock_id;
+    END IF;
+
+    UPDATE stock
+       SET current_stock = current_stock + v_quantity,
+           stock_value = stock_value + v_value,
+           ledger_seq = ledger_seq + v_count,
+           stock_status = CASE
+               WHEN min_stock > 0 AND current_stock + v_shard_quantity + v_quantity <= min_stock THEN 'low'
+               WHEN max_stock > 0 AND current_stock + v_shard_quantity + v_quantity >= max_stock THEN 'high'
+               ELSE 'normal' END,
+           version = version + 1,
+           updated_at = now()
+     WHERE id = p_stock_id
+       AND (v_quantity >= 0 OR current_stock + v_shard_quantity + v_quantity >= 0)
+       AND (NOT p_check_max OR max_stock <= 0 OR current_stock + v_shard_quantity + v_quantity <= max_stock)
+    RETURNING current_stock + v_shard_quantity - v_quantity, stock_value + v_shard_value - v_value,
+              ledger_seq - v_count
+      INTO v_balance_quantity, v_balance_value, v_sequence;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION USING ERRCODE = 'check_violation', MESSAGE = 'stock balance check failed: ' || p_stock_id;
+    END IF;
+
+    FOR i IN 1..v_count LOOP
+        v_balance_quantity := v_balance_quantity + p_quantities[i];
+        v_balance_value := v_balance_value + p_values[i];
+        v_sequence := v_sequence + 1;
+        INSERT INTO stock_ledger (
+            stock_id, sequence, entry_type, source_type, source_id, bill_no, quantity, value,
+            balance_quantity, balance_value, occurred_at, created_at
+        ) VALUES (
+            p_stock_id, v_sequence, p_entry_types[i], p_source_type, p_source_id, p_bill_no,
+            p_quantities[i], p_values[i], v_balance_quantity, v_balance_value, p_occurred_at[i], now()
+        );
+    END LOOP;
+END
+$$;
+"""
+
+
+def backfill_stock_status(apps, schema_editor):
+    schema_editor.execute(BACKFILL_SQL)
+
+
+def update_post_entries(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(POST_ENTRIES_FUNCTION)
+
+
+def restore_post_entries(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    previous = import_module("apps.stock.migrations.0016_balance_triggers")
+    schema_editor.execute(previous.POST_ENTRIES_FUNCTION)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0018_detail_expansion_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="stock",
+            name="stock_status",
+            field=models.CharField(
+                choices=[("low", "库存不足"), ("normal", "正常"), ("high", "库存过高")],
+                default="normal",
+                max_length=10,
+                verbose_name="库存状态",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stock",
+            index=models.Index(
+                fields=["stock_status", "-created_at"], name="stock_status_created_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_stock_status, migrations.RunPython.noop),
+        migrations.RunPython(update_post_entries, restore_post_entries),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0019_stock_status"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="stock",
+            index=models.Index(fields=["created_at", "id"], name="stock_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="stockcounttask",
+            index=models.Index(
+                fields=["created_at", "id"], name="stock_count_task_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="stockin",
+            index=models.Index(fields=["in_time", "id"], name="stock_in_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="stockout",
+            index=models.Index(fields=["out_time", "id"], name="stock_out_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="stockwarning",
+            index=models.Index(
+                fields=["created_at", "id"], name="stock_warning_created_idx"
+            ),
+        ),
+    ]
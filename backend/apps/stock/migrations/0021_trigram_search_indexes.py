@@ -0,0 +1,50 @@
+from django.db import migrations
+
+# 表 -> 建三元组索引的列（与 apps.stock.search.TRIGRAM_INDEXES 一致，迁移中固定下来）
+TRIGRAM_INDEXES = {
+    "stock": ("material_code", "material_name", "supplier"),
+    "stock_in": ("material_code", "material_name", "supplier", "operator"),
+    "stock_out": ("material_code", "material_name", "operator"),
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """
+    PostgreSQL 上安装 pg_trgm 并为 icontains 搜索的列建立三元组 GIN 索引
+
+    索引表达式与 Django icontains 生成的 UPPER(列::text) 一致；扩展不可用时跳过，搜索回退为扫描。
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm')"
+        )
+        if not cursor.fetchone()[0]:
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, columns in TRIGRAM_INDEXES.items():
+        for column in columns:
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_{column}_trgm ON {table}"
+                f" USING gin ((UPPER({column}::text)) gin_trgm_ops)"
+            )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table, columns in TRIGRAM_INDEXES.items():
+        for column in columns:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_{column}_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0020_list_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
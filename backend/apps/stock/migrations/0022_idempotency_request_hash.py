@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0021_trigram_search_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="idempotencykey",
+            name="request_hash",
+            field=models.CharField(
+                blank=True, default="", max_length=64, verbose_name="请求体摘要"
+            ),
+        ),
+    ]
@@ -0,0 +1,138 @@
+# Generated by Django 4.2.30 on 2026-10-17 22:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+PENDING_ENTRY_FIELDS = (
+    "stock_id",
+    "entry_type",
+    "source_type",
+    "source_id",
+    "bill_no",
+    "quantity",
+    "value",
+    "occurred_at",
+    "created_at",
+)
+
+
+def move_unsealed_entries(apps, schema_editor):
+    """把快路径写入、尚未编号的流水账分录移到暂存表，下次折叠分片时入账"""
+    StockLedger = apps.get_model("stock", "StockLedger")
+    StockLedgerPending = apps.get_model("stock", "StockLedgerPending")
+    unsealed = StockLedger.objects.filter(sequence__isnull=True).order_by("pk")
+    StockLedgerPending.objects.bulk_create(
+        [
+            StockLedgerPending(
+                **{field: getattr(entry, field) for field in PENDING_ENTRY_FIELDS}
+            )
+            for entry in unsealed.iterator()
+        ],
+        batch_size=1000,
+    )
+    unsealed.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0022_idempotency_request_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StockLedgerPending",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entry_type",
+                    models.CharField(
+                        choices=[
+                            ("opening", "期初"),
+                            ("in", "入库"),
+                            ("out", "出库"),
+                            ("reversal", "冲销"),
+                        ],
+                        max_length=10,
+                        verbose_name="分录类型",
+                    ),
+                ),
+                (
+                    "source_type",
+                    models.CharField(
+                        choices=[
+                            ("stock", "库存"),
+                            ("stock_in", "入库单"),
+                            ("stock_out", "出库单"),
+                        ],
+                        max_length=10,
+                        verbose_name="来源类型",
+                    ),
+                ),
+                (
+                    "source_id",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="来源记录ID"
+                    ),
+                ),
+                (
+                    "bill_no",
+                    models.CharField(
+                        blank=True, default="", max_length=30, verbose_name="单据号"
+                    ),
+                ),
+                ("quantity", models.IntegerField(verbose_name="变动数量")),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="变动价值"
+                    ),
+                ),
+                ("occurred_at", models.DateTimeField(verbose_name="业务时间")),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="写入时间"),
+                ),
+                (
+                    "stock",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pending_ledger_entries",
+                        to="stock.stock",
+                        verbose_name="关联库存",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "流水账暂存分录",
+                "verbose_name_plural": "流水账暂存分录",
+                "db_table": "stock_ledger_pending",
+            },
+        ),
+        migrations.RunPython(move_unsealed_entries, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="stockledger",
+            name="sequence",
+            field=models.PositiveBigIntegerField(verbose_name="顺序号"),
+        ),
+        migrations.AlterField(
+            model_name="stockledger",
+            name="balance_quantity",
+            field=models.IntegerField(verbose_name="结存数量"),
+        ),
+        migrations.AlterField(
+            model_name="stockledger",
+            name="balance_value",
+            field=models.DecimalField(
+                decimal_places=2, max_digits=12, verbose_name="结存价值"
+            ),
+        ),
+    ]
@@ -0,0 +1,143 @@
+# Generated by Django 4.2.30 on 2026-10-17 23:05
+
+from django.db import migrations, models
+
+# 分区出入库表的单据号登记触发器：TG_ARGV[0] 为表名（触发器在各分区上执行，TG_TABLE_NAME 为分区名）。
+# 插入登记、删除注销、修改单据号时先注销再登记；跨分区的修改按删除 + 插入触发，同样成对执行。
+REGISTRY_TRIGGER_FUNCTION = """
+CREATE OR REPLACE FUNCTION bill_no_registry_trigger() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM bill_no_registry WHERE table_name = TG_ARGV[0] AND bill_no = OLD.bill_no;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO bill_no_registry (table_name, bill_no) VALUES (TG_ARGV[0], NEW.bill_no);
+    END IF;
+    RETURN NULL;
+END
+$$;
+"""
+
+REGISTRY_TRIGGERS = """
+CREATE TRIGGER {table}_bill_no AFTER INSERT OR DELETE ON {table}
+    FOR EACH ROW EXECUTE FUNCTION bill_no_registry_trigger('{table}');
+CREATE TRIGGER {table}_bill_no_update AFTER UPDATE OF bill_no ON {table}
+    FOR EACH ROW WHEN (OLD.bill_no IS DISTINCT FROM NEW.bill_no)
+    EXECUTE FUNCTION bill_no_registry_trigger('{table}');
+"""
+
+MOVEMENT_MODELS = {"stock_in": "StockIn", "stock_out": "StockOut"}
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cursor.fetchone()
+    return row is not None and row[0] == "p"
+
+
+def unique_bill_no_field(model):
+    field = models.CharField(
+        max_length=30, unique=True, default="", verbose_name="单据号"
+    )
+    field.set_attributes_from_name("bill_no")
+    field.model = model
+    return field
+
+
+def enforce_bill_no_uniqueness(apps, schema_editor):
+    """
+    恢复出入库单据号的唯一性
+
+    PostgreSQL 分区表：登记已有单据号（有重复时迁移失败）并安装登记触发器；
+    未分区的表（其他数据库，或未执行分区转换）缺少唯一约束时补建。
+    """
+    connection = schema_editor.connection
+    if connection.vendor == "postgresql":
+        schema_editor.execute(REGISTRY_TRIGGER_FUNCTION)
+    for table, model_name in MOVEMENT_MODELS.items():
+        model = apps.get_model("stock", model_name)
+        with connection.cursor() as cursor:
+            partitioned = connection.vendor == "postgresql" and is_partitioned(
+                cursor, table
+            )
+        if partitioned:
+            schema_editor.execute(
+                f"INSERT INTO bill_no_registry (table_name, bill_no) SELECT %s, bill_no FROM {table}",
+                [table],
+            )
+            schema_editor.execute(REGISTRY_TRIGGERS.format(table=table))
+            continue
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        if not any(
+            c["unique"] and c["columns"] == ["bill_no"] for c in constraints.values()
+        ):
+            schema_editor.alter_field(
+                model, model._meta.get_field("bill_no"), unique_bill_no_field(model)
+            )
+
+
+def remove_registry_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for table in MOVEMENT_MODELS:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_bill_no ON {table}")
+        schema_editor.execute(
+            f"DROP TRIGGER IF EXISTS {table}_bill_no_update ON {table}"
+        )
+    schema_editor.execute("DROP FUNCTION IF EXISTS bill_no_registry_trigger()")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0023_stockledgerpending"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BillNoRegistry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("table_name", models.CharField(max_length=20, verbose_name="表名")),
+                ("bill_no", models.CharField(max_length=30, verbose_name="单据号")),
+            ],
+            options={
+                "verbose_name": "单据号登记",
+                "verbose_name_plural": "单据号登记",
+                "db_table": "bill_no_registry",
+                "unique_together": {("table_name", "bill_no")},
+            },
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name="stockin",
+                    name="bill_no",
+                    field=models.CharField(
+                        default="", max_length=30, unique=True, verbose_name="单据号"
+                    ),
+                ),
+                migrations.AlterField(
+                    model_name="stockout",
+                    name="bill_no",
+                    field=models.CharField(
+                        default="", max_length=30, unique=True, verbose_name="单据号"
+                    ),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(
+                    enforce_bill_no_uniqueness, remove_registry_triggers
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 21:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("stock", "0024_bill_no_uniqueness"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="closedperiod",
+            name="status",
+            field=models.CharField(
+                choices=[("closing", "结账中"), ("closed", "已结账")],
+                default="closed",
+                max_length=10,
+                verbose_name="状态",
+            ),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Sum
 from django.utils import timezone
 
 
@@ -8,6 +10,23 @@ def generate_bill_no(prefix):
     return f"{prefix}-{today}-"
 
 
+STOCK_STATUS_CHOICES = [('low', '库存不足'), ('normal', '正常'), ('high', '库存过高')]
+
+
+def classify_stock_status(quantity, min_stock, max_stock):
+    """
+    库存状态判定规则（全系统唯一口径）
+
+    设置了最小库存量（大于 0）且库存不高于它为 low；设置了最大库存量（大于 0）且库存不低于它为 high；
+    其余为 normal。数据库侧的同一规则见 utils.stock_status_expression / STOCK_STATUS_SQL。
+    """
+    if min_stock > 0 and quantity <= min_stock:
+        return 'low'
+    if max_stock > 0 and quantity >= max_stock:
+        return 'high'
+    return 'normal'
+
+
 class Stock(models.Model):
     """库存表"""
     material_code = models.CharField(max_length=50, unique=True, verbose_name='物料编号')
@@ -22,6 +41,10 @@ class Stock(models.Model):
     unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='单价')
     stock_value = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='库存价值')
     status = models.CharField(max_length=10, choices=[('active', '启用'), ('inactive', '停用')], default='active', verbose_name='状态')
+    stock_status = models.CharField(max_length=10, choices=STOCK_STATUS_CHOICES, default='normal', verbose_name='库存状态')
+    shard_count = models.PositiveSmallIntegerField(default=0, verbose_name='余额分片数')
+    version = models.PositiveIntegerField(default=0, verbose_name='版本号')
+    ledger_seq = models.PositiveBigIntegerField(default=0, verbose_name='流水账顺序号')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
 
@@ -30,28 +53,30 @@ class Stock(models.Model):
         verbose_name = '库存'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['stock_status', '-created_at'], name='stock_status_created_idx'),
+            # 列表按 (创建时间, id) 倒序的键集分页（见 pagination.py）
+            models.Index(fields=['created_at', 'id'], name='stock_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.material_code} - {self.material_name}"
 
-    @property
-    def stock_status(self):
-        """计算库存状态"""
-        if self.current_stock <= self.min_stock:
-            return 'low'
-        elif self.current_stock >= self.max_stock:
-            return 'high'
-        return 'normal'
+    def save(self, *args, **kwargs):
+        """保存时按精确余额（含分片子余额）与上下限重算库存状态"""
+        quantity = self.current_stock
+        if self.pk and self.shard_count:
+            quantity += StockShard.objects.filter(stock_id=self.pk).aggregate(total=Sum('quantity'))['total'] or 0
+        self.stock_status = classify_stock_status(quantity, self.min_stock, self.max_stock)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'stock_status'}
+        super().save(*args, **kwargs)
 
     @property
     def stock_status_display(self):
         """库存状态显示名称"""
-        status_map = {
-            'low': '库存不足',
-            'high': '库存过高',
-            'normal': '正常',
-        }
-        return status_map.get(self.stock_status, '正常')
+        return self.get_stock_status_display()
 
 
 class StockIn(models.Model):
@@ -64,6 +89,7 @@ class StockIn(models.Model):
         ('adjust_gain', '盘点盘盈'),
     ]
 
+    # PostgreSQL 分区表上无法建不含分区键的唯一索引，改由单据号登记表保证唯一（见 BillNoRegistry）
     bill_no = models.CharField(max_length=30, unique=True, default='', verbose_name='单据号')
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE, verbose_name='关联库存')
     material_code = models.CharField(max_length=50, verbose_name='物料编号')
@@ -75,6 +101,7 @@ class StockIn(models.Model):
     in_type = models.CharField(max_length=20, choices=IN_TYPE_CHOICES, default='purchase', verbose_name='入库类型')
     operator = models.CharField(max_length=50, blank=True, default='', verbose_name='操作人')
     remark = models.TextField(blank=True, default='', verbose_name='备注')
+    version = models.PositiveIntegerField(default=0, verbose_name='版本号')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
 
     class Meta:
@@ -82,6 +109,12 @@ class StockIn(models.Model):
         verbose_name = '入库记录'
         verbose_name_plural = verbose_name
         ordering = ['-in_time']
+        indexes = [
+            # 物料出入库历史按 (业务时间, id) 倒序的键集分页（见 history.py）
+            models.Index(fields=['stock', 'in_time', 'id'], name='stock_in_stock_time_idx'),
+            # 入库列表按 (业务时间, id) 倒序的键集分页（见 pagination.py）
+            models.Index(fields=['in_time', 'id'], name='stock_in_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.material_code} - {self.in_quantity}"
@@ -101,6 +134,7 @@ class StockOut(models.Model):
         ('adjust_loss', '盘点盘亏'),
     ]
 
+    # PostgreSQL 分区表上无法建不含分区键的唯一索引，改由单据号登记表保证唯一（见 BillNoRegistry）
     bill_no = models.CharField(max_length=30, unique=True, default='', verbose_name='单据号')
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE, verbose_name='关联库存')
     material_code = models.CharField(max_length=50, verbose_name='物料编号')
@@ -111,6 +145,7 @@ class StockOut(models.Model):
     out_type = models.CharField(max_length=20, choices=OUT_TYPE_CHOICES, verbose_name='出库类型')
     operator = models.CharField(max_length=50, blank=True, default='', verbose_name='操作人')
     remark = models.TextField(blank=True, default='', verbose_name='备注')
+    version = models.PositiveIntegerField(default=0, verbose_name='版本号')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
 
     class Meta:
@@ -118,6 +153,12 @@ class StockOut(models.Model):
         verbose_name = '出库记录'
         verbose_name_plural = verbose_name
         ordering = ['-out_time']
+        indexes = [
+            # 物料出入库历史按 (业务时间, id) 倒序的键集分页（见 history.py）
+            models.Index(fields=['stock', 'out_time', 'id'], name='stock_out_stock_time_idx'),
+            # 出库列表按 (业务时间, id) 倒序的键集分页（见 pagination.py）
+            models.Index(fields=['out_time', 'id'], name='stock_out_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.material_code} - {self.out_quantity}"
@@ -160,6 +201,10 @@ class StockWarning(models.Model):
         verbose_name = '库存预警'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['stock', 'status'], name='stock_warning_stock_idx'),
+            models.Index(fields=['created_at', 'id'], name='stock_warning_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.material_code} - {self.get_warning_type_display()}"
@@ -198,6 +243,9 @@ class StockCountTask(models.Model):
         verbose_name = '盘点任务'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='stock_count_task_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.task_no}"
@@ -240,3 +288,327 @@ class StockCountItem(models.Model):
     @property
     def diff_type_display(self):
         return dict(self.DIFF_TYPE_CHOICES).get(self.diff_type, '')
+
+
+class BillSequence(models.Model):
+    """单据号计数器表（按前缀 + 日期分段）"""
+    prefix = models.CharField(max_length=10, verbose_name='单据前缀')
+    biz_date = models.DateField(verbose_name='业务日期')
+    last_no = models.IntegerField(default=0, verbose_name='已分配的最大序号')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'bill_sequence'
+        verbose_name = '单据号计数器'
+        verbose_name_plural = verbose_name
+        unique_together = [('prefix', 'biz_date')]
+
+    def __str__(self):
+        return f"{self.prefix}-{self.biz_date:%Y%m%d} #{self.last_no}"
+
+
+class BillNoRegistry(models.Model):
+    """
+    出入库单据号登记表
+
+    PostgreSQL 上 stock_in / stock_out 按业务时间分区，唯一索引必须包含分区键，
+    单据号的唯一性改由本表的唯一索引保证：分区表上的行触发器在插入、删除、修改单据号时
+    同一事务内登记或注销单据号，重复时插入失败（见迁移 0024）。未分区的表直接使用唯一约束，不写本表。
+    """
+    table_name = models.CharField(max_length=20, verbose_name='表名')
+    bill_no = models.CharField(max_length=30, verbose_name='单据号')
+
+    class Meta:
+        db_table = 'bill_no_registry'
+        verbose_name = '单据号登记'
+        verbose_name_plural = verbose_name
+        unique_together = [('table_name', 'bill_no')]
+
+    def __str__(self):
+        return f"{self.table_name}: {self.bill_no}"
+
+
+class IdempotencyKey(models.Model):
+    """幂等键表：记录客户端 Idempotency-Key 对应的首次响应，用于重试时直接回放"""
+    scope = models.CharField(max_length=100, verbose_name='作用域')
+    key = models.CharField(max_length=100, verbose_name='幂等键')
+    request_hash = models.CharField(max_length=64, blank=True, default='', verbose_name='请求体摘要')
+    status_code = models.SmallIntegerField(null=True, blank=True, verbose_name='响应状态码')
+    response_body = models.TextField(blank=True, default='', verbose_name='响应内容')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='创建时间')
+
+    class Meta:
+        db_table = 'idempotency_key'
+        verbose_name = '幂等键'
+        verbose_name_plural = verbose_name
+        unique_together = [('scope', 'key')]
+
+    def __str__(self):
+        return f"{self.scope} - {self.key}"
+
+
+class StockShard(models.Model):
+    """库存分片余额表：热点物料的余额拆分为多行子余额，分散单行锁竞争"""
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='shards', verbose_name='关联库存')
+    shard_no = models.PositiveSmallIntegerField(verbose_name='分片序号')
+    quantity = models.IntegerField(default=0, verbose_name='分片数量')
+    value = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name='分片价值')
+
+    class Meta:
+        db_table = 'stock_shard'
+        verbose_name = '库存分片余额'
+        verbose_name_plural = verbose_name
+        unique_together = [('stock', 'shard_no')]
+
+    def __str__(self):
+        return f"{self.stock_id} #{self.shard_no}: {self.quantity}"
+
+
+class StockLedger(models.Model):
+    """
+    库存流水账表：只追加，每次库存变动记录一行及变动后的结存
+
+    sequence 为物料内的连续顺序号。分片物料快路径的分录先写入 StockLedgerPending，
+    在分片折叠（sharding.fold_stock_shards）时按写入顺序编号后追加到本表。
+    """
+    ENTRY_TYPE_CHOICES = [
+        ('opening', '期初'),
+        ('in', '入库'),
+        ('out', '出库'),
+        ('reversal', '冲销'),
+    ]
+    SOURCE_TYPE_CHOICES = [
+        ('stock', '库存'),
+        ('stock_in', '入库单'),
+        ('stock_out', '出库单'),
+    ]
+
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='ledger_entries', verbose_name='关联库存')
+    sequence = models.PositiveBigIntegerField(verbose_name='顺序号')
+    entry_type = models.CharField(max_length=10, choices=ENTRY_TYPE_CHOICES, verbose_name='分录类型')
+    source_type = models.CharField(max_length=10, choices=SOURCE_TYPE_CHOICES, verbose_name='来源类型')
+    source_id = models.BigIntegerField(null=True, blank=True, verbose_name='来源记录ID')
+    bill_no = models.CharField(max_length=30, blank=True, default='', verbose_name='单据号')
+    quantity = models.IntegerField(verbose_name='变动数量')
+    value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='变动价值')
+    balance_quantity = models.IntegerField(verbose_name='结存数量')
+    balance_value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='结存价值')
+    occurred_at = models.DateTimeField(verbose_name='业务时间')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='记账时间')
+
+    class Meta:
+        db_table = 'stock_ledger'
+        verbose_name = '库存流水账'
+        verbose_name_plural = verbose_name
+        unique_together = [('stock', 'sequence')]
+        indexes = [
+            models.Index(fields=['source_type', 'source_id'], name='stock_ledger_source_idx'),
+            models.Index(fields=['occurred_at'], name='stock_ledger_occurred_idx'),
+            # 物料按业务日汇总净变动（库存详情的趋势数据）
+            models.Index(fields=['stock', 'occurred_at'], name='stock_ledger_stock_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.stock_id} #{self.sequence}: {self.quantity:+d}"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("流水账只允许追加，不能修改")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("流水账只允许追加，不能删除")
+
+
+class StockLedgerPending(models.Model):
+    """
+    流水账暂存表：分片物料快路径写入的分录
+
+    快路径不锁定 Stock 行，无法分配顺序号和结存；分录先写入本表，
+    分片折叠时按写入顺序编号、追加到 StockLedger 并从本表删除。
+    """
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='pending_ledger_entries', verbose_name='关联库存')
+    entry_type = models.CharField(max_length=10, choices=StockLedger.ENTRY_TYPE_CHOICES, verbose_name='分录类型')
+    source_type = models.CharField(max_length=10, choices=StockLedger.SOURCE_TYPE_CHOICES, verbose_name='来源类型')
+    source_id = models.BigIntegerField(null=True, blank=True, verbose_name='来源记录ID')
+    bill_no = models.CharField(max_length=30, blank=True, default='', verbose_name='单据号')
+    quantity = models.IntegerField(verbose_name='变动数量')
+    value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='变动价值')
+    occurred_at = models.DateTimeField(verbose_name='业务时间')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='写入时间')
+
+    class Meta:
+        db_table = 'stock_ledger_pending'
+        verbose_name = '流水账暂存分录'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.stock_id} (待入账): {self.quantity:+d}"
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    库存余额检查点：as_of 时点（按业务时间）各物料的结存
+
+    ledger_id 为生成检查点时已提交的最大流水账 ID，之后补录的、业务时间早于 as_of 的分录
+    在查询时点余额时单独补上。
+    """
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='checkpoints', verbose_name='关联库存')
+    as_of = models.DateTimeField(verbose_name='检查点时间')
+    quantity = models.IntegerField(verbose_name='结存数量')
+    value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='结存价值')
+    ledger_id = models.BigIntegerField(verbose_name='流水账高水位')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='生成时间')
+
+    class Meta:
+        db_table = 'balance_checkpoint'
+        verbose_name = '库存余额检查点'
+        verbose_name_plural = verbose_name
+        unique_together = [('as_of', 'stock')]
+
+    def __str__(self):
+        return f"{self.stock_id} @ {self.as_of:%Y-%m-%d %H:%M}: {self.quantity}"
+
+
+class MonthlyClosing(models.Model):
+    """
+    月结快照：month 月（按业务时间）各物料的期初、入库、出库与期末
+
+    结账后不再修改；期初含当月建账的期初分录，期末 = 期初 + 入库 - 出库。
+    入库/出库为当月出入库单的净额（已扣除改单、撤销的冲销），笔数同理。
+    """
+    month = models.DateField(verbose_name='月份')
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='monthly_closings', verbose_name='关联库存')
+    material_code = models.CharField(max_length=50, verbose_name='物料编号')
+    material_name = models.CharField(max_length=100, verbose_name='物料名称')
+    opening_quantity = models.IntegerField(verbose_name='期初数量')
+    opening_value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='期初价值')
+    in_count = models.IntegerField(verbose_name='入库笔数')
+    in_quantity = models.IntegerField(verbose_name='入库数量')
+    in_value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='入库价值')
+    out_count = models.IntegerField(verbose_name='出库笔数')
+    out_quantity = models.IntegerField(verbose_name='出库数量')
+    out_value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='出库价值')
+    closing_quantity = models.IntegerField(verbose_name='期末数量')
+    closing_value = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='期末价值')
+    closed_at = models.DateTimeField(auto_now_add=True, verbose_name='结账时间')
+
+    class Meta:
+        db_table = 'monthly_closing'
+        verbose_name = '月结快照'
+        verbose_name_plural = verbose_name
+        unique_together = [('month', 'stock')]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.material_code}: {self.closing_quantity}"
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("月结快照不能修改")
+        super().save(*args, **kwargs)
+
+
+class ClosedPeriod(models.Model):
+    """
+    已结账期间（按月）
+
+    结账须按月份顺序进行，最近一个已结账月份月末之前业务时间的出入库记录不得新增、修改或撤销；
+    只能反结账最近一个已结账月份。结账时先写入"结账中"的期间锁定写入，月结快照写入的同一事务中
+    改为"已结账"；报表、归档只认"已结账"的期间。
+    """
+    STATUS_CHOICES = [
+        ('closing', '结账中'),
+        ('closed', '已结账'),
+    ]
+
+    month = models.DateField(unique=True, verbose_name='月份')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='closed', verbose_name='状态')
+    closed_by = models.CharField(max_length=150, blank=True, default='', verbose_name='结账人')
+    closed_at = models.DateTimeField(auto_now_add=True, verbose_name='结账时间')
+
+    class Meta:
+        db_table = 'closed_period'
+        verbose_name = '已结账期间'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.month:%Y-%m}"
+
+
+class PeriodReportCache(models.Model):
+    """已结账期间的报表结果，期间锁定后数据不再变化，永久有效；反结账时随期间一并删除"""
+    period = models.ForeignKey(ClosedPeriod, on_delete=models.CASCADE, related_name='report_cache', verbose_name='期间')
+    key = models.CharField(max_length=50, verbose_name='报表标识')
+    payload = models.JSONField(encoder=DjangoJSONEncoder, verbose_name='报表结果')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='生成时间')
+
+    class Meta:
+        db_table = 'period_report_cache'
+        verbose_name = '期间报表缓存'
+        verbose_name_plural = verbose_name
+        unique_together = [('period', 'key')]
+
+
+class PeriodAuditLog(models.Model):
+    """结账/反结账操作记录"""
+    ACTION_CHOICES = [
+        ('close', '结账'),
+        ('reopen', '反结账'),
+    ]
+
+    month = models.DateField(verbose_name='月份')
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name='操作')
+    operator = models.CharField(max_length=150, blank=True, default='', verbose_name='操作人')
+    reason = models.TextField(blank=True, default='', verbose_name='原因')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='操作时间')
+
+    class Meta:
+        db_table = 'period_audit_log'
+        verbose_name = '结账操作记录'
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.get_action_display()}"
+
+
+class MovementArchive(models.Model):
+    """出入库记录归档文件（按月、按方向），记录归档后从出入库表删除"""
+    DIRECTION_CHOICES = [
+        ('in', '入库'),
+        ('out', '出库'),
+    ]
+
+    direction = models.CharField(max_length=10, choices=DIRECTION_CHOICES, verbose_name='方向')
+    month = models.DateField(verbose_name='月份')
+    path = models.CharField(max_length=255, verbose_name='归档文件')
+    row_count = models.IntegerField(verbose_name='记录数')
+    checksum = models.CharField(max_length=64, verbose_name='SHA-256')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='归档时间')
+
+    class Meta:
+        db_table = 'movement_archive'
+        verbose_name = '出入库归档'
+        verbose_name_plural = verbose_name
+        unique_together = [('direction', 'month')]
+
+    def __str__(self):
+        return f"{self.get_direction_display()} {self.month:%Y-%m}: {self.row_count}"
+
+
+class ArchivedMovementSummary(models.Model):
+    """已归档出入库记录的按日、按物料汇总，供趋势、排行等按出入库记录统计的报表使用"""
+    direction = models.CharField(max_length=10, choices=MovementArchive.DIRECTION_CHOICES, verbose_name='方向')
+    day = models.DateField(verbose_name='日期')
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='archived_summaries', verbose_name='关联库存')
+    material_code = models.CharField(max_length=50, verbose_name='物料编号')
+    material_name = models.CharField(max_length=100, verbose_name='物料名称')
+    count = models.IntegerField(verbose_name='笔数')
+    quantity = models.IntegerField(verbose_name='数量')
+    value = models.DecimalField(max_digits=14, decimal_places=2, verbose_name='价值')
+
+    class Meta:
+        db_table = 'archived_movement_summary'
+        verbose_name = '归档出入库汇总'
+        verbose_name_plural = verbose_name
+        unique_together = [('direction', 'day', 'stock')]
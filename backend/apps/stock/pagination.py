@@ -0,0 +1,178 @@
+"""
+列表接口分页
+
+默认按 page / page_size 分页（Paginator，OFFSET + COUNT），翻页越深越慢。
+请求带 cursor 参数（首页传空串）时改用键集分页：按 排序字段 + id 排序，游标记录上一页最后一行的
+这些字段值，下一页以范围条件只读取排在其后的 page_size + 1 行。首个排序字段上的范围条件
+（如 in_time <= 游标时间）可直接用 (排序字段, id) 索引定位起点，翻到多深耗时都不变；
+没有下一页时 next_cursor 为 None。
+
+总数按 count 参数（none / estimate / exact）统计，total_exact 标明 total 是否为本次精确计数：
+estimate 时无过滤条件的列表取规划器的行数估计，有过滤条件的取短时缓存的计数（见 count_rows）。
+"""
+import base64
+import hashlib
+import json
+from copy import copy
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+
+CURSOR_ERROR = "游标格式错误"
+
+# 列表总数的计数方式
+COUNT_MODES = ('none', 'estimate', 'exact')
+
+
+def _field(model, name, annotations):
+    """排序键对应的字段；注解（如 exact_stock）取其输出字段，按注解名读写实例属性"""
+    if name == 'pk':
+        return model._meta.pk
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        if name not in (annotations or {}):
+            raise
+    field = copy(annotations[name].output_field)
+    field.set_attributes_from_name(name)
+    return field
+
+
+def _fields(model, ordering, annotations=None):
+    return [_field(model, key.lstrip('-'), annotations) for key in ordering]
+
+
+def encode_keyset_cursor(instance, ordering, annotations=None):
+    """由一行记录的排序字段值生成游标；annotations 为查询的注解（排序键含注解时需要）"""
+    values = [field.value_to_string(instance) for field in _fields(type(instance), ordering, annotations)]
+    raw = json.dumps({"ordering": list(ordering), "values": values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_keyset_cursor(model, ordering, cursor, annotations=None):
+    """解析游标为排序字段值列表；格式错误或与 ordering 不符（如换了排序方式）时抛出 ValueError"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if payload["ordering"] != list(ordering) or len(payload["values"]) != len(ordering):
+            raise ValueError(CURSOR_ERROR)
+        fields = _fields(model, ordering, annotations)
+        values = [field.to_python(value) for field, value in zip(fields, payload["values"])]
+    except (ValueError, KeyError, TypeError, ValidationError) as exc:
+        raise ValueError(CURSOR_ERROR) from exc
+    if any(value is None for value in values):
+        raise ValueError(CURSOR_ERROR)
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    按 ordering 排序时排在 values 之后的行
+
+    (a, b) 在 (x, y) 之后展开为 a < x OR (a = x AND b < y)（倒序字段，正序为 >）；
+    再加上首个字段的冗余范围条件 a <= x，使数据库可以直接用索引定位起点而不是从头过滤。
+    """
+    names = [key.lstrip('-') for key in ordering]
+    after = reduce(or_, [
+        Q(**dict(zip(names[:i], values[:i])), **{f"{names[i]}__{'lt' if key.startswith('-') else 'gt'}": values[i]})
+        for i, key in enumerate(ordering)
+    ])
+    bound = Q(**{f"{names[0]}__{'lte' if ordering[0].startswith('-') else 'gte'}": values[0]})
+    return bound & after
+
+
+def table_row_estimate(table):
+    """
+    规划器统计信息中 table 的行数估计（分区表为各分区之和）
+
+    非 PostgreSQL 或表从未被分析过时返回 None。
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT max(reltuples), sum(GREATEST(reltuples, 0)) FROM pg_class WHERE relkind = 'r'"
+            " AND (oid = to_regclass(%s) OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s)))",
+            [table, table],
+        )
+        analyzed, total = cursor.fetchone()
+    if analyzed is None or analyzed < 0:
+        return None
+    return int(total)
+
+
+def _count_cache_key(queryset):
+    sql, params = queryset.order_by().query.sql_with_params()
+    digest = hashlib.sha1(f"{sql}|{params!r}".encode()).hexdigest()
+    return f"stock:list-count:{queryset.model._meta.label_lower}:{digest}"
+
+
+def count_rows(queryset, mode):
+    """
+    按计数方式统计列表总数，返回 (total, total_exact)
+
+    - exact：COUNT(*)
+    - estimate：无过滤条件时取规划器估计值（不足 LIST_COUNT_ESTIMATE_MIN_ROWS 行或没有统计信息时精确计数）；
+      有过滤条件时取 LIST_COUNT_CACHE_SECONDS 秒内缓存的计数，未命中时精确计数并缓存
+    - none：不统计，total 为 None
+    """
+    if mode not in COUNT_MODES:
+        raise ValueError(f"count 只能是 {'/'.join(COUNT_MODES)}")
+    if mode == 'none':
+        return None, False
+    filtered = bool(queryset.query.where)
+    if mode == 'estimate':
+        if not filtered:
+            estimate = table_row_estimate(queryset.model._meta.db_table)
+            if estimate is not None and estimate >= getattr(settings, "LIST_COUNT_ESTIMATE_MIN_ROWS", 10000):
+                return estimate, False
+        else:
+            cached = cache.get(_count_cache_key(queryset))
+            if cached is not None:
+                return cached, False
+    total = queryset.count()
+    if filtered:
+        cache.set(_count_cache_key(queryset), total, getattr(settings, "LIST_COUNT_CACHE_SECONDS", 30))
+    return total, True
+
+
+def paginate(queryset, ordering, *, page, page_size, cursor=None, count=None):
+    """
+    按 ordering（最后一项须为唯一的 id / pk）排序并分页，返回 (本页记录, 分页信息)
+
+    cursor 为 None 时按页码分页，分页信息为 {total, total_exact, page, page_size}；
+    否则为键集分页（空串表示首页），分页信息为 {total, total_exact, page_size, next_cursor}。
+    count 为计数方式（见 count_rows），页码分页默认 exact，键集分页默认 none；
+    非 exact 时页码超出范围返回空列表，不再回退到最后一页。
+    page_size 小于 1、count 取值或游标格式错误时抛出 ValueError。
+    """
+    if page_size < 1:
+        raise ValueError("page_size 必须大于0")
+    queryset = queryset.order_by(*ordering)
+    if cursor is None:
+        if count in (None, 'exact'):
+            paginator = Paginator(queryset, page_size)
+            items = list(paginator.get_page(page))
+            return items, {"total": paginator.count, "total_exact": True, "page": page, "page_size": page_size}
+        total, total_exact = count_rows(queryset, count)
+        offset = (max(page, 1) - 1) * page_size
+        items = list(queryset[offset:offset + page_size])
+        return items, {"total": total, "total_exact": total_exact, "page": page, "page_size": page_size}
+
+    total, total_exact = count_rows(queryset, count or 'none')
+    annotations = queryset.query.annotations
+    if cursor:
+        values = decode_keyset_cursor(queryset.model, ordering, cursor, annotations)
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        next_cursor = encode_keyset_cursor(items[page_size - 1], ordering, annotations)
+    return items[:page_size], {
+        "total": total, "total_exact": total_exact, "page_size": page_size, "next_cursor": next_cursor,
+    }
@@ -0,0 +1,119 @@
+"""
+出入库表按月分区（PostgreSQL）
+
+stock_in / stock_out 按业务时间（in_time / out_time）做声明式范围分区，每月一个分区
+（stock_in_p202406 这样命名，边界为当前时区的月初），另有一个默认分区兜底尚未建分区的时间。
+按业务时间范围过滤的查询（统计、月报）只扫描涉及的月份分区。
+
+分区表的主键与唯一约束必须包含分区键：主键为 (id, 业务时间)，id 仍由自增序列保证唯一；
+单据号只保留普通索引，唯一性由单据号登记表（BillNoRegistry）的唯一索引保证，
+分区表上的触发器在同一事务内登记与注销（见迁移 0024）。
+
+分区需提前建好（manage.py movement_partitions，建议每月定时执行），
+落入默认分区的记录在建对应月份分区时迁入。
+"""
+from django.db import connection
+from django.utils import timezone
+
+from .closing import month_range, next_month
+from .triggers import balance_triggers_suspended
+
+# 分区表及其分区键
+PARTITIONED_TABLES = {
+    'stock_in': 'in_time',
+    'stock_out': 'out_time',
+}
+
+# 默认提前创建的月份数
+DEFAULT_MONTHS_AHEAD = 3
+
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y%m}"
+
+
+def default_partition_name(table):
+    return f"{table}_default"
+
+
+def is_partitioned(table):
+    """table 是否为分区表（非 PostgreSQL 时恒为 False）"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def existing_partitions(table):
+    """table 已有的月份分区名"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits"
+            " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+            " WHERE pg_inherits.inhparent = to_regclass(%s)",
+            [table],
+        )
+        return {name for (name,) in cursor.fetchall()}
+
+
+def create_month_partition(table, month):
+    """
+    为 table 创建 month 月的分区，已存在时不做处理；返回是否新建
+
+    默认分区中已有该月的记录时，先移出再建分区并写回，否则 PostgreSQL 会拒绝建分区。
+    """
+    name = partition_name(table, month)
+    if name in existing_partitions(table):
+        return False
+    column = PARTITIONED_TABLES[table]
+    start, end = month_range(month)
+    default = default_partition_name(table)
+    # 记录只是换了所在分区，不应触发余额变动
+    with balance_triggers_suspended(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE _partition_moved AS"
+            f" WITH moved AS (DELETE FROM {default} WHERE {column} >= %s AND {column} < %s RETURNING *)"
+            f" SELECT * FROM moved",
+            [start, end],
+        )
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)", [start, end],
+        )
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM _partition_moved")
+        cursor.execute("DROP TABLE _partition_moved")
+    return True
+
+
+def default_partition_months(table):
+    """默认分区中记录所在的月份（当前时区）"""
+    column = PARTITIONED_TABLES[table]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', {column} AT TIME ZONE %s)::date"
+            f" FROM {default_partition_name(table)}",
+            [timezone.get_current_timezone_name()],
+        )
+        return sorted(month for (month,) in cursor.fetchall())
+
+
+def ensure_partitions(first_month, last_month):
+    """
+    为全部分区表创建 [first_month, last_month] 各月分区，并把默认分区中的记录迁入各自的月份分区
+
+    返回新建的分区名列表。
+    """
+    created = []
+    for table in PARTITIONED_TABLES:
+        months = set(default_partition_months(table))
+        month = first_month
+        while month <= last_month:
+            months.add(month)
+            month = next_month(month)
+        for month in sorted(months):
+            if create_month_partition(table, month):
+                created.append(partition_name(table, month))
+    return created
+
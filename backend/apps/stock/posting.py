@@ -0,0 +1,556 @@
+"""
+出入库过账服务
+
+所有会改变库存余额的写操作都经由本模块：
+- change_balance：一条语句完成余额更新与读回（PostgreSQL 使用 UPDATE ... RETURNING）
+- post_stock_in / post_stock_out：单条出入库过账，除单据号分配外只需两次数据库往返
+- post_movements：把多条相互独立的明细合并到一个事务中批量过账，逐行返回结果
+- post_batch：整单过账同一方向的多条明细，全部成功或全部失败
+每次余额变动同时在流水账（ledger.py）追加分录。
+开启触发器维护余额（triggers.py）时只写出入库记录，余额与分录由数据库触发器完成。
+"""
+import copy
+import random
+from collections import defaultdict
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .closing import closed_months, closed_period_error, month_of, period_locked_message
+from .ledger import batch_entries, posting_movement, write_ledger_entries
+from .models import Stock, StockIn, StockLedger, StockOut, StockShard, classify_stock_status
+from .sharding import (
+    fold_stock_shards, lock_stocks, refresh_stock_status, spread_stock_shards, with_exact_balance,
+)
+from .triggers import balance_triggers_enabled, is_balance_check_violation
+from .utils import (
+    STOCK_STATUS_SQL, apply_stock_deltas, generate_bill_no, generate_bill_nos, stock_status_expression,
+    supports_update_returning,
+)
+
+MOVEMENT_IN = 'in'
+MOVEMENT_OUT = 'out'
+
+
+# change_balance 读回的库存字段
+BALANCE_FIELDS = (
+    'id', 'material_code', 'material_name', 'supplier',
+    'current_stock', 'stock_value', 'min_stock', 'max_stock', 'ledger_seq', 'stock_status',
+)
+
+
+class PostingError(Exception):
+    """过账失败，用于在外层事务中中止整个操作"""
+
+    def __init__(self, message, code=400):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def change_balance(quantity_delta, value_delta=Decimal('0'), *, stock_id=None,
+                   material_code=None, check_max=False, entry_count=1):
+    """
+    原子地调整单个物料的库存余额，并返回更新后的库存
+
+    按 stock_id 或 material_code 定位物料。扣减时把"库存充足"作为 UPDATE 的条件，
+    check_max 为 True 时再要求入库后不超过最大库存量（max_stock 为 0 表示不限制）。
+    条件不满足或物料不存在时不修改任何数据并返回 None。
+
+    PostgreSQL / SQLite(3.35+) 上通过 UPDATE ... RETURNING 一次往返完成，其他数据库回退为 UPDATE + SELECT。
+    返回的 Stock 只包含 BALANCE_FIELDS 中的字段。开启分片余额的物料改走 _change_sharded_balance。
+    同一语句为本次变动预留 entry_count 个流水账顺序号，返回的 ledger_seq 为其中最后一个，
+    调用方用 ledger.write_ledger_entries 写入分录。
+    """
+    if stock_id is not None:
+        lookup = {"pk": stock_id}
+    else:
+        lookup = {"material_code": material_code}
+    stock = _update_stock_row(lookup, quantity_delta, value_delta, check_max, entry_count)
+    if stock is None:
+        stock = _change_sharded_balance(lookup, quantity_delta, value_delta, check_max, entry_count)
+    return stock
+
+
+def _update_stock_row(lookup, quantity_delta, value_delta, check_max, entry_count, include_sharded=False):
+    """
+    以条件 UPDATE 调整 Stock 行上的余额并重算库存状态；默认跳过开启分片的物料
+
+    include_sharded 时调用方须已折叠分片，基础余额即精确余额。
+    """
+    column, value = ("id", lookup["pk"]) if "pk" in lookup else ("material_code", lookup["material_code"])
+    where, params = [f"{column} = %s"], [value]
+    if not include_sharded:
+        where.append("shard_count = 0")
+    if quantity_delta < 0:
+        where.append("current_stock >= %s")
+        params.append(-quantity_delta)
+    if check_max:
+        where.append("(max_stock <= 0 OR current_stock + %s <= max_stock)")
+        params.append(quantity_delta)
+
+    if supports_update_returning():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Stock._meta.db_table} "
+                "SET current_stock = current_stock + %s, stock_value = stock_value + %s, "
+                f"stock_status = {STOCK_STATUS_SQL.format(balance='current_stock + %s')}, "
+                "ledger_seq = ledger_seq + %s, version = version + 1 "
+                f"WHERE {' AND '.join(where)} "
+                f"RETURNING {', '.join(BALANCE_FIELDS)}",
+                [quantity_delta, value_delta, quantity_delta, quantity_delta, entry_count, *params],
+            )
+            row = cursor.fetchone()
+        return Stock(**dict(zip(BALANCE_FIELDS, row))) if row else None
+
+    queryset = Stock.objects.filter(**lookup)
+    if not include_sharded:
+        queryset = queryset.filter(shard_count=0)
+    if quantity_delta < 0:
+        queryset = queryset.filter(current_stock__gte=-quantity_delta)
+    if check_max:
+        queryset = queryset.filter(
+            Q(max_stock__lte=0) | Q(max_stock__gte=F('current_stock') + quantity_delta)
+        )
+    updated = queryset.update(
+        current_stock=F('current_stock') + quantity_delta,
+        stock_status=stock_status_expression(F('current_stock') + quantity_delta),
+        stock_value=F('stock_value') + value_delta,
+        ledger_seq=F('ledger_seq') + entry_count,
+        version=F('version') + 1,
+    )
+    if not updated:
+        return None
+    return Stock(**Stock.objects.values(*BALANCE_FIELDS).get(**lookup))
+
+
+def _change_sharded_balance(lookup, quantity_delta, value_delta, check_max, entry_count):
+    """
+    调整开启分片余额的物料
+
+    快路径：以条件 UPDATE 更新一个子余额足够的分片，不触碰 Stock 行。
+    需要按整体余额校验（check_max）或找不到可用分片时走慢路径：锁定 Stock 行，
+    折叠分片后在基础余额上调整，再重新分摊到各分片。
+    返回的 Stock 中 current_stock / stock_value 为过账后的精确余额；物料未开启分片时返回 None。
+    快路径不分配流水账顺序号（返回的 ledger_seq 为 None），分录暂存后在下次折叠时编号入账；
+    快路径不在持有分片行锁时写 Stock 行，库存状态发生变化时在事务提交后再刷新（见 sharding.refresh_stock_status）。
+    """
+    info = Stock.objects.filter(**lookup, shard_count__gt=0).values('pk', 'shard_count').first()
+    if info is None:
+        return None
+
+    if (not check_max or quantity_delta < 0) and _update_shard(
+            info['pk'], info['shard_count'], quantity_delta, value_delta):
+        values = with_exact_balance(Stock.objects.filter(pk=info['pk'])).values(
+            *BALANCE_FIELDS, 'exact_stock', 'exact_value').get()
+        values['current_stock'] = values.pop('exact_stock')
+        values['stock_value'] = values.pop('exact_value')
+        values['ledger_seq'] = None
+        stock_status = classify_stock_status(values['current_stock'], values['min_stock'], values['max_stock'])
+        if stock_status != values['stock_status']:
+            values['stock_status'] = stock_status
+            transaction.on_commit(lambda: refresh_stock_status([info['pk']]))
+        return Stock(**values)
+
+    with transaction.atomic(savepoint=False):
+        locked = lock_stocks(Stock.objects).get(pk=info['pk'])
+        fold_stock_shards([locked])
+        stock = _update_stock_row(
+            lookup, quantity_delta, value_delta, check_max, entry_count, include_sharded=True)
+        if stock is not None:
+            locked.current_stock += quantity_delta
+            locked.stock_value += value_delta
+            spread_stock_shards(locked)
+    return stock
+
+
+def _update_shard(stock_id, shard_count, quantity_delta, value_delta):
+    """
+    在一个子余额足够的分片上调整余额，成功返回 True
+
+    支持 SKIP LOCKED 的数据库先挑一个未被锁定的分片更新，不等待其他事务；
+    都被占用时再随机等待一个分片。等待后条件不再满足的 UPDATE 仍会持有该行锁，
+    随后进入慢路径时会与持有 Stock 行锁、等待分片的折叠操作死锁，因此这一步放在保存点中，
+    失败即回滚释放行锁。不支持行锁的数据库（SQLite）按随机顺序逐个尝试。
+    """
+    start = random.randrange(shard_count)
+
+    def shards(shard_no):
+        queryset = StockShard.objects.filter(stock_id=stock_id, shard_no=shard_no)
+        if quantity_delta < 0:
+            queryset = queryset.filter(quantity__gte=-quantity_delta)
+        return queryset
+
+    changes = {"quantity": F('quantity') + quantity_delta, "value": F('value') + value_delta}
+    if not connection.features.has_select_for_update:
+        return any(
+            shards((start + offset) % shard_count).update(**changes)
+            for offset in range(shard_count)
+        )
+
+    if connection.features.has_select_for_update_skip_locked:
+        shard_table = StockShard._meta.db_table
+        condition = " AND quantity >= %s" if quantity_delta < 0 else ""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {shard_table} SET quantity = quantity + %s, value = value + %s "
+                f"WHERE id = (SELECT id FROM {shard_table} WHERE stock_id = %s{condition} "
+                "ORDER BY (shard_no + %s) %% %s LIMIT 1 FOR UPDATE SKIP LOCKED)",
+                [quantity_delta, value_delta, stock_id,
+                 *([-quantity_delta] if quantity_delta < 0 else []), shard_count - start, shard_count],
+            )
+            if cursor.rowcount:
+                return True
+
+    with transaction.atomic():
+        updated = shards(start).update(**changes)
+        if not updated:
+            transaction.set_rollback(True)
+    return bool(updated)
+
+
+def _rejection(material_code, quantity_delta, check_max):
+    """余额更新未命中时读取当前库存，生成与逐条校验一致的错误信息"""
+    stock = with_exact_balance(Stock.objects.filter(material_code=material_code)).only(
+        'max_stock').first()
+    if stock is None:
+        return {"error": f"物料 {material_code} 不存在", "code": 404}
+    if quantity_delta < 0:
+        return {"error": f"库存不足，当前库存量为{stock.exact_stock}", "code": 400}
+    if check_max and stock.exact_stock >= stock.max_stock:
+        return {"error": f"当前库存({stock.exact_stock})已达到或超过最大库存量({stock.max_stock})，禁止入库", "code": 400}
+    return {"error": f"入库后将超过最大库存量({stock.max_stock})", "code": 400}
+
+
+def post_stock_in(line, bill_no=None):
+    """
+    过账一条入库明细
+
+    line 为 clean_stock_in_line 的返回值；bill_no 为空时自动分配。
+    先以条件 UPDATE 更新余额并读回，再插入入库记录，返回格式同 post_movements 的单行结果。
+    在外层事务中调用时不创建保存点，失败由调用方决定是否中止整个事务。
+    """
+    check_max = line["in_type"] != 'adjust_gain'
+    if bill_no is None:
+        bill_no = generate_bill_no(_bill_prefix(MOVEMENT_IN, line))
+    if balance_triggers_enabled():
+        return _post_with_trigger(MOVEMENT_IN, line, bill_no)
+
+    with transaction.atomic(savepoint=False):
+        error = closed_period_error([line["in_time"]])
+        if error:
+            return {"error": error, "code": 400}
+        stock = change_balance(
+            line["in_quantity"], line["in_value"],
+            material_code=line["material_code"], check_max=check_max,
+        )
+        if stock is None:
+            return _rejection(line["material_code"], line["in_quantity"], check_max)
+        record = StockIn.objects.create(
+            bill_no=bill_no, stock_id=stock.pk, material_code=stock.material_code,
+            material_name=stock.material_name, supplier=line["supplier"] or stock.supplier,
+            in_time=line["in_time"], in_quantity=line["in_quantity"], in_value=line["in_value"],
+            in_type=line["in_type"], operator=line["operator"], remark=line["remark"],
+        )
+        write_ledger_entries(stock, [posting_movement(record)])
+    return {"record": record, "stock": stock}
+
+
+def post_stock_out(line, bill_no=None):
+    """
+    过账一条出库明细
+
+    line 为 clean_stock_out_line 的返回值；bill_no 为空时自动分配。
+    库存不足由条件 UPDATE 本身判定，返回格式同 post_movements 的单行结果。
+    """
+    if bill_no is None:
+        bill_no = generate_bill_no(_bill_prefix(MOVEMENT_OUT, line))
+    if balance_triggers_enabled():
+        return _post_with_trigger(MOVEMENT_OUT, line, bill_no)
+
+    with transaction.atomic(savepoint=False):
+        error = closed_period_error([line["out_time"]])
+        if error:
+            return {"error": error, "code": 400}
+        stock = change_balance(
+            -line["out_quantity"], -line["out_value"], material_code=line["material_code"],
+        )
+        if stock is None:
+            return _rejection(line["material_code"], -line["out_quantity"], False)
+        record = StockOut.objects.create(
+            bill_no=bill_no, stock_id=stock.pk, material_code=stock.material_code,
+            material_name=stock.material_name, out_time=line["out_time"],
+            out_quantity=line["out_quantity"], out_value=line["out_value"],
+            out_type=line["out_type"], operator=line["operator"], remark=line["remark"],
+        )
+        write_ledger_entries(stock, [posting_movement(record)])
+    return {"record": record, "stock": stock}
+
+
+def _post_with_trigger(kind, line, bill_no):
+    """
+    触发器维护余额时过账一条明细：只插入出入库记录，再读回触发器更新后的余额
+
+    物料信息在插入语句中从库存行取得，除单据号分配外共两次数据库往返。
+    触发器校验不通过时插入语句报错：独立调用时整个事务回滚，在外层事务中调用时回滚到保存点，
+    随后返回与逐条校验一致的错误信息。
+    """
+    try:
+        with transaction.atomic():
+            error = closed_period_error([_movement_time(kind, line)])
+            if error:
+                return {"error": error, "code": 400}
+            record = _insert_movement(kind, line, bill_no)
+            if record is None:
+                return {"error": f"物料 {line['material_code']} 不存在", "code": 404}
+            stock = _read_balance(record.stock_id)
+    except IntegrityError as error:
+        if not is_balance_check_violation(error):
+            raise
+        if kind == MOVEMENT_IN:
+            return _rejection(line["material_code"], line["in_quantity"], line["in_type"] != 'adjust_gain')
+        return _rejection(line["material_code"], -line["out_quantity"], False)
+    return {"record": record, "stock": stock}
+
+
+def _insert_movement(kind, line, bill_no):
+    """以 INSERT ... SELECT 从库存行取物料信息并插入出入库记录，返回记录；物料不存在时返回 None"""
+    model = StockIn if kind == MOVEMENT_IN else StockOut
+    fields = {
+        "bill_no": bill_no, "operator": line["operator"], "remark": line["remark"],
+        "version": 0, "created_at": timezone.now(),
+        **{f"{kind}_{name}": line[f"{kind}_{name}"] for name in ("time", "quantity", "value", "type")},
+    }
+    stock_columns = ["id", "material_code", "material_name"]
+    params = list(fields.values())
+    if kind == MOVEMENT_IN:
+        stock_columns.append("COALESCE(NULLIF(%s, ''), supplier)")
+        params.append(line["supplier"])
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {model._meta.db_table} "
+            f"({', '.join(fields)}, stock_id, material_code, material_name{', supplier' if kind == MOVEMENT_IN else ''}) "
+            f"SELECT {', '.join(['%s'] * len(fields))}, {', '.join(stock_columns)} "
+            f"FROM {Stock._meta.db_table} WHERE material_code = %s "
+            f"RETURNING id, stock_id, material_code, material_name{', supplier' if kind == MOVEMENT_IN else ''}",
+            [*params, line["material_code"]],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    returned = ["id", "stock_id", "material_code", "material_name", "supplier"]
+    return model(**fields, **dict(zip(returned, row)))
+
+
+def _read_balance(stock_id):
+    """读回库存的 BALANCE_FIELDS，current_stock / stock_value 为含分片子余额的精确余额（仅用于 PostgreSQL）"""
+    columns = [field for field in BALANCE_FIELDS if field not in ('current_stock', 'stock_value')]
+    shard_table = StockShard._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(columns)}, "
+            f"current_stock + COALESCE((SELECT sum(quantity) FROM {shard_table} WHERE stock_id = %s), 0), "
+            f"stock_value + COALESCE((SELECT sum(value) FROM {shard_table} WHERE stock_id = %s), 0) "
+            f"FROM {Stock._meta.db_table} WHERE id = %s",
+            [stock_id, stock_id, stock_id],
+        )
+        row = cursor.fetchone()
+    return Stock(**dict(zip([*columns, 'current_stock', 'stock_value'], row)))
+
+
+def _bill_prefix(kind, line):
+    if kind == MOVEMENT_IN:
+        return "ADJ" if line["in_type"] == 'adjust_gain' else "IN"
+    return "ADJ" if line["out_type"] == 'adjust_loss' else "OUT"
+
+
+def _movement_time(kind, line):
+    return line["in_time"] if kind == MOVEMENT_IN else line["out_time"]
+
+
+def _check_line(kind, line, stock, balance):
+    """按当前余额校验一行明细，返回错误信息，通过时返回 None"""
+    if kind == MOVEMENT_IN:
+        if line["in_type"] != 'adjust_gain' and stock.max_stock > 0:
+            if balance >= stock.max_stock:
+                return f"当前库存({balance})已达到或超过最大库存量({stock.max_stock})，禁止入库"
+            if balance + line["in_quantity"] > stock.max_stock:
+                return f"入库后将超过最大库存量({stock.max_stock})"
+    elif balance < line["out_quantity"]:
+        return f"库存不足，当前库存量为{balance}"
+    return None
+
+
+def _new_record(kind, line, stock, bill_no):
+    """按明细生成未保存的出入库记录，返回 (记录, 带符号的数量, 带符号的价值)"""
+    if kind == MOVEMENT_IN:
+        record = StockIn(
+            bill_no=bill_no, stock=stock, material_code=stock.material_code,
+            material_name=stock.material_name, supplier=line["supplier"] or stock.supplier,
+            in_time=line["in_time"], in_quantity=line["in_quantity"], in_value=line["in_value"],
+            in_type=line["in_type"], operator=line["operator"], remark=line["remark"],
+        )
+        return record, line["in_quantity"], line["in_value"]
+    record = StockOut(
+        bill_no=bill_no, stock=stock, material_code=stock.material_code,
+        material_name=stock.material_name, out_time=line["out_time"],
+        out_quantity=line["out_quantity"], out_value=line["out_value"],
+        out_type=line["out_type"], operator=line["operator"], remark=line["remark"],
+    )
+    return record, -line["out_quantity"], -line["out_value"]
+
+
+def _snapshot(stock, delta):
+    """已锁定的 stock 累计变动 delta（[数量, 价值]）之后的库存快照"""
+    snapshot = copy.copy(stock)
+    snapshot.current_stock = stock.current_stock + delta[0]
+    snapshot.stock_value = stock.stock_value + delta[1]
+    return snapshot
+
+
+def _write_records(stocks, records, deltas):
+    """
+    写入已校验的出入库记录（按过账顺序）及其余额与分录
+
+    stocks 为已锁定、分片已折叠的 {stock_id: Stock}，deltas 为 {stock_id: [数量, 价值]}。
+    触发器维护余额时余额与分录随插入写入：按顺序分段插入，触发器逐行校验的结果与调用方一致。
+    """
+    if balance_triggers_enabled():
+        for model, group in groupby(records, key=type):
+            model.objects.bulk_create(list(group))
+        return
+    for model in (StockIn, StockOut):
+        group = [record for record in records if isinstance(record, model)]
+        if group:
+            model.objects.bulk_create(group)
+    entries, ledger_seqs = batch_entries(stocks, records)
+    StockLedger.objects.bulk_create(entries)
+    apply_stock_deltas(deltas, ledger_seqs)
+
+
+def post_movements(entries):
+    """
+    在一个事务中过账多条出入库明细
+
+    entries: [(kind, line)]，kind 为 'in'/'out'，line 为 clean_stock_in_line /
+    clean_stock_out_line 的返回值。
+    返回与 entries 一一对应的结果：
+    - 成功：{"record": StockIn/StockOut, "stock": 过账后该行对应的库存快照}
+    - 失败：{"error": 错误信息, "code": HTTP 状态码}
+    """
+    # 单据号在事务外按前缀整块预留，校验失败的行会留下空号
+    prefix_counts = defaultdict(int)
+    for kind, line in entries:
+        prefix_counts[_bill_prefix(kind, line)] += 1
+    bill_nos = {prefix: iter(generate_bill_nos(prefix, count)) for prefix, count in prefix_counts.items()}
+
+    results = [None] * len(entries)
+    with transaction.atomic():
+        stocks = {
+            s.material_code: s
+            for s in lock_stocks(Stock.objects).filter(
+                material_code__in={line["material_code"] for _, line in entries}
+            ).order_by('pk')
+        }
+        fold_stock_shards(stocks.values())
+        balances = {code: stock.current_stock for code, stock in stocks.items()}
+        locked = closed_months(_movement_time(kind, line) for kind, line in entries)
+
+        posted = []
+        deltas = defaultdict(lambda: [0, Decimal('0')])
+        for index, (kind, line) in enumerate(entries):
+            bill_no = next(bill_nos[_bill_prefix(kind, line)])
+            stock = stocks.get(line["material_code"])
+            if stock is None:
+                results[index] = {"error": f"物料 {line['material_code']} 不存在", "code": 404}
+                continue
+            month = month_of(_movement_time(kind, line))
+            if month in locked:
+                results[index] = {"error": period_locked_message(month), "code": 400}
+                continue
+            error = _check_line(kind, line, stock, balances[stock.material_code])
+            if error:
+                results[index] = {"error": error, "code": 400}
+                continue
+
+            record, quantity, value = _new_record(kind, line, stock, bill_no)
+            balances[stock.material_code] += quantity
+            deltas[stock.pk][0] += quantity
+            deltas[stock.pk][1] += value
+            results[index] = {"record": record, "stock": _snapshot(stock, deltas[stock.pk])}
+            posted.append(record)
+
+        _write_records({stock.pk: stock for stock in stocks.values()}, posted, deltas)
+
+    return results
+
+
+def post_batch(kind, lines):
+    """
+    整单过账同一方向的多条明细（批量入库、拣货单）：全部成功或全部失败
+
+    lines 为 clean_stock_in_line / clean_stock_out_line 的返回值。同一物料多行时按合计数量校验：
+    入库（盘盈除外）合计后不得超过最大库存量，出库合计不得超过当前库存。
+    成功时返回 {"results": [{"record", "stock"}]}，与 lines 一一对应，stock 为过账到该行后的库存快照；
+    任一行校验不通过时不写入任何数据，返回 {"errors": [{"line" 或 "material_code", "message"}]}。
+    """
+    # 单据号在事务外按前缀整块预留，避免长时间占用计数器行
+    prefix_counts = defaultdict(int)
+    for line in lines:
+        prefix_counts[_bill_prefix(kind, line)] += 1
+    bill_nos = {prefix: iter(generate_bill_nos(prefix, count)) for prefix, count in prefix_counts.items()}
+
+    with transaction.atomic():
+        # 按主键顺序加锁，并发的整单过账始终以相同顺序获取行锁，不会互相死锁
+        stocks = {
+            s.material_code: s
+            for s in lock_stocks(Stock.objects).filter(
+                material_code__in={line["material_code"] for line in lines}
+            ).order_by('pk')
+        }
+        fold_stock_shards(stocks.values())
+        locked = closed_months(_movement_time(kind, line) for line in lines)
+
+        errors = []
+        totals = defaultdict(int)
+        for index, line in enumerate(lines):
+            month = month_of(_movement_time(kind, line))
+            if line["material_code"] not in stocks:
+                errors.append({"line": index, "message": f"物料 {line['material_code']} 不存在"})
+            elif month in locked:
+                errors.append({"line": index, "message": period_locked_message(month)})
+            elif kind == MOVEMENT_OUT:
+                totals[line["material_code"]] += line["out_quantity"]
+            elif line["in_type"] != 'adjust_gain':
+                totals[line["material_code"]] += line["in_quantity"]
+        for code, quantity in totals.items():
+            stock = stocks[code]
+            if kind == MOVEMENT_OUT and stock.current_stock < quantity:
+                errors.append({
+                    "material_code": code,
+                    "message": f"物料 {code} 库存不足，需出库 {quantity}，当前库存量为{stock.current_stock}",
+                })
+            elif kind == MOVEMENT_IN and stock.max_stock > 0 and stock.current_stock + quantity > stock.max_stock:
+                errors.append({
+                    "material_code": code,
+                    "message": f"物料 {code} 入库合计 {quantity}，入库后将超过最大库存量({stock.max_stock})",
+                })
+        if errors:
+            return {"errors": errors}
+
+        results, records = [], []
+        deltas = defaultdict(lambda: [0, Decimal('0')])
+        for line in lines:
+            stock = stocks[line["material_code"]]
+            record, quantity, value = _new_record(kind, line, stock, next(bill_nos[_bill_prefix(kind, line)]))
+            deltas[stock.pk][0] += quantity
+            deltas[stock.pk][1] += value
+            # 行锁保证了余额可在内存中推算，无需回读
+            results.append({"record": record, "stock": _snapshot(stock, deltas[stock.pk])})
+            records.append(record)
+        _write_records({stock.pk: stock for stock in stocks.values()}, records, deltas)
+
+    return {"results": results}
@@ -0,0 +1,123 @@
+"""
+库存余额对账
+
+按出入库记录重算各物料的应有余额，与 Stock 上的精确余额（含分片子余额）比较：
+应有余额 = 期初价值（流水账 source_type='stock' 的分录）+ 入库合计 - 出库合计 + 已归档记录的汇总。
+
+物料按 ID 分块，每块用几条按 stock_id 分组的聚合查询完成；PostgreSQL 上每块在只读的
+可重复读事务中执行，余额与出入库记录来自同一快照，不对库存行加锁，也不会因并发过账误报差异。
+分块可分发到进程池并行执行（manage.py reconcile_balances --workers）。
+
+修正时逐块在短事务中锁定有差异的物料、折叠分片，按锁定后的最新记录重算并写回余额；
+流水账分录的数量与出入库记录一致，无需追加分录。
+"""
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.db import connection, connections, transaction
+from django.db.models import Q, Sum
+
+from .models import ArchivedMovementSummary, Stock, StockIn, StockLedger, StockOut
+from .sharding import fold_stock_shards, lock_stocks, with_exact_balance
+from .utils import apply_stock_deltas
+
+# 每块的物料数
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def stock_id_ranges(chunk_size=DEFAULT_CHUNK_SIZE):
+    """按 ID 顺序把全部物料分为 [(first_id, last_id)] 区间，每段 chunk_size 个物料"""
+    ids = list(Stock.objects.order_by('pk').values_list('pk', flat=True))
+    return [(ids[i], ids[min(i + chunk_size, len(ids)) - 1]) for i in range(0, len(ids), chunk_size)]
+
+
+def expected_balances(stock_filter):
+    """
+    按出入库记录计算应有余额 {stock_id: [数量, 价值]}
+
+    stock_filter 为作用于 stock_id 的 Q 条件；没有任何记录的物料不在结果中。
+    """
+    balances = defaultdict(lambda: [0, Decimal('0')])
+    sources = [
+        (StockIn.objects.filter(stock_filter), 'in_quantity', 'in_value', 1),
+        (StockOut.objects.filter(stock_filter), 'out_quantity', 'out_value', -1),
+        (ArchivedMovementSummary.objects.filter(stock_filter, direction='in'), 'quantity', 'value', 1),
+        (ArchivedMovementSummary.objects.filter(stock_filter, direction='out'), 'quantity', 'value', -1),
+        (StockLedger.objects.filter(stock_filter, source_type='stock'), 'quantity', 'value', 1),
+    ]
+    for queryset, quantity_field, value_field, sign in sources:
+        totals = queryset.values('stock_id').annotate(quantity=Sum(quantity_field), value=Sum(value_field))
+        for stock_id, quantity, value in totals.values_list('stock_id', 'quantity', 'value'):
+            balances[stock_id][0] += sign * quantity
+            balances[stock_id][1] += sign * value
+    return balances
+
+
+def reconcile_chunk(first_id, last_id):
+    """
+    对账 ID 在 [first_id, last_id] 内的物料，返回有差异的物料
+
+    每项为 {stock_id, material_code, current_stock, expected_stock, stock_value, expected_value}。
+    """
+    stock_filter = Q(stock_id__gte=first_id, stock_id__lte=last_id)
+    nested = connection.in_atomic_block
+    with transaction.atomic():
+        if connection.vendor == 'postgresql' and not nested:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+        expected = expected_balances(stock_filter)
+        stocks = with_exact_balance(Stock.objects.filter(pk__gte=first_id, pk__lte=last_id)).values_list(
+            'pk', 'material_code', 'exact_stock', 'exact_value',
+        )
+        drifts = []
+        for stock_id, material_code, quantity, value in stocks:
+            expected_quantity, expected_value = expected.get(stock_id, (0, Decimal('0')))
+            if quantity != expected_quantity or value != expected_value:
+                drifts.append({
+                    "stock_id": stock_id, "material_code": material_code,
+                    "current_stock": quantity, "expected_stock": expected_quantity,
+                    "stock_value": value, "expected_value": expected_value,
+                })
+    return drifts
+
+
+def _reconcile_range(bounds):
+    return reconcile_chunk(*bounds)
+
+
+def reconcile_balances(chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    """
+    对账全部物料，逐块产出 (区间, 有差异的物料列表)
+
+    workers > 1 时以 fork 方式启动进程池并行处理各块，子进程各自建立数据库连接。
+    """
+    ranges = stock_id_ranges(chunk_size)
+    if workers <= 1:
+        for bounds in ranges:
+            yield bounds, reconcile_chunk(*bounds)
+        return
+    # 子进程不能沿用父进程的数据库连接
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+        yield from zip(ranges, executor.map(_reconcile_range, ranges))
+
+
+def repair_drift(stock_ids):
+    """
+    把 stock_ids 的余额修正为按出入库记录计算的应有余额，返回实际修正的物料数
+
+    在一个短事务中锁定这些物料并折叠分片（等待进行中的分片写入提交），再重算并写回。
+    """
+    with transaction.atomic():
+        stocks = list(lock_stocks(Stock.objects.filter(pk__in=stock_ids)).order_by('pk'))
+        fold_stock_shards(stocks)
+        expected = expected_balances(Q(stock_id__in=stock_ids))
+        deltas = {}
+        for stock in stocks:
+            expected_quantity, expected_value = expected.get(stock.pk, (0, Decimal('0')))
+            if (stock.current_stock, stock.stock_value) != (expected_quantity, expected_value):
+                deltas[stock.pk] = (expected_quantity - stock.current_stock, expected_value - stock.stock_value)
+        apply_stock_deltas(deltas)
+    return len(deltas)
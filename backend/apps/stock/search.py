@@ -0,0 +1,66 @@
+"""
+物料模糊搜索
+
+列表接口的 search / supplier / operator 等条件都是 icontains，PostgreSQL 上 Django 生成
+UPPER(列::text) LIKE UPPER('%关键字%')。迁移 0021 在 pg_trgm 扩展可用时为这些列建立同一表达式上的
+三元组（trigram）GIN 索引（TRIGRAM_INDEXES），规划器可直接用索引代替顺序扫描；中文物料名称同样适用。
+关键字少于 3 个字符时无法拆出三元组，规划器会回退为扫描。
+
+有索引时搜索结果按与关键字的相似度（similarity）倒序排在前面；SQLite 或未安装 pg_trgm 时
+仍按 icontains 过滤，保持原有排序。
+"""
+from django.db import connection
+from django.db.models import Q
+
+# 相似度注解名
+SEARCH_RANK = 'search_rank'
+
+# 表 -> 建三元组索引的列
+TRIGRAM_INDEXES = {
+    'stock': ('material_code', 'material_name', 'supplier'),
+    'stock_in': ('material_code', 'material_name', 'supplier', 'operator'),
+    'stock_out': ('material_code', 'material_name', 'operator'),
+}
+
+
+def trigram_index_name(table, column):
+    return f"{table}_{column}_trgm"
+
+
+def trigram_search_enabled():
+    """当前数据库是否已安装 pg_trgm（结果缓存在连接对象上）"""
+    if connection.vendor != 'postgresql':
+        return False
+    enabled = getattr(connection, 'trigram_search', None)
+    if enabled is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            enabled = cursor.fetchone()[0]
+        connection.trigram_search = enabled
+    return enabled
+
+
+def contains_any(fields, term):
+    """任一字段包含 term（不区分大小写）"""
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f"{field}__icontains": term})
+    return condition
+
+
+def fuzzy_search(queryset, fields, term):
+    """
+    按 term 模糊搜索 fields，返回 (queryset, 排序前缀)
+
+    有三元组索引时附加相似度注解 search_rank（各字段相似度的最大值），排序前缀为 ('-search_rank',)，
+    调用方把它放在原有排序之前；否则排序前缀为空。
+    """
+    queryset = queryset.filter(contains_any(fields, term))
+    if not trigram_search_enabled():
+        return queryset, ()
+    from django.contrib.postgres.search import TrigramSimilarity
+    from django.db.models.functions import Greatest
+
+    similarities = [TrigramSimilarity(field, term) for field in fields]
+    rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+    return queryset.annotate(**{SEARCH_RANK: rank}), (f"-{SEARCH_RANK}",)
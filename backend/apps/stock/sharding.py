@@ -0,0 +1,162 @@
+"""
+热点物料分片余额
+
+开启分片（Stock.shard_count > 0）的物料，余额由两部分组成：
+- Stock 行上的 current_stock / stock_value（基础余额）
+- StockShard 各分片行上的 quantity / value（子余额）
+
+精确库存 = 基础余额 + 全部分片子余额。单条出入库只更新其中一个分片，
+并发过账落在不同的行上，不再排队等待同一把行锁（见 posting.change_balance）。
+需要按整体余额校验的路径（批量过账、改单、分片不足时的回退）在锁定 Stock 行后
+先把分片折叠回基础余额；rebalance_stock_shards 再把余额重新平均摊到各分片。
+库存状态（Stock.stock_status）随折叠按精确余额重算，分摊不改变精确余额，状态不变。
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .ledger import seal_pending_entries
+from .models import Stock, StockShard, classify_stock_status
+from .utils import apply_stock_deltas
+
+# 单个物料允许的最大分片数
+MAX_SHARD_COUNT = 64
+
+
+def lock_stocks(queryset):
+    """
+    以 FOR NO KEY UPDATE 锁定库存行（数据库支持时）
+
+    分片快路径在持有分片行锁的同时插入出入库记录，外键校验需要对 Stock 行加 KEY SHARE 锁；
+    FOR UPDATE 与之冲突，会与等待分片行锁的折叠操作形成死锁，NO KEY UPDATE 则不会。
+    """
+    return queryset.select_for_update(no_key=connection.features.has_select_for_no_key_update)
+
+
+def with_exact_balance(queryset):
+    """
+    为库存查询附加精确余额
+
+    exact_stock / exact_value 为基础余额加上分片子余额，未开启分片的物料与
+    current_stock / stock_value 相同。
+    """
+    shard_totals = StockShard.objects.filter(stock=OuterRef('pk')).values('stock').annotate(
+        total_quantity=Sum('quantity'), total_value=Sum('value'),
+    )
+    return queryset.annotate(
+        exact_stock=ExpressionWrapper(
+            F('current_stock') + Coalesce(Subquery(shard_totals.values('total_quantity')), Value(0)),
+            output_field=IntegerField(),
+        ),
+        exact_value=ExpressionWrapper(
+            F('stock_value') + Coalesce(Subquery(shard_totals.values('total_value')), Value(Decimal('0'))),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+    )
+
+
+def fold_stock_shards(stocks):
+    """
+    把分片子余额折叠回基础余额
+
+    stocks 必须是当前事务中已 select_for_update 锁定的 Stock 实例，
+    折叠后实例上的 current_stock / stock_value 即为精确余额，ledger_seq 为最新顺序号。
+    """
+    sharded = {stock.pk: stock for stock in stocks if stock.shard_count}
+    if not sharded:
+        return
+    deltas = defaultdict(lambda: [0, Decimal('0')])
+    shards = StockShard.objects.select_for_update().filter(stock_id__in=list(sharded)).order_by('pk')
+    for stock_id, quantity, value in shards.values_list('stock_id', 'quantity', 'value'):
+        deltas[stock_id][0] += quantity
+        deltas[stock_id][1] += value
+    StockShard.objects.filter(stock_id__in=list(sharded)).update(quantity=0, value=Decimal('0'))
+    for stock_id, (quantity, value) in deltas.items():
+        sharded[stock_id].current_stock += quantity
+        sharded[stock_id].stock_value += value
+    # 快路径暂存的分录此时都已提交，按写入顺序编号入账
+    ledger_seqs = {stock.pk: stock.ledger_seq for stock in sharded.values() if seal_pending_entries(stock)}
+    apply_stock_deltas(deltas, ledger_seqs)
+
+
+def spread_stock_shards(stock):
+    """
+    把已折叠的余额平均分摊到各分片，除不尽的部分留在基础余额
+
+    stock 必须已锁定并折叠（见 fold_stock_shards）。
+    """
+    if not stock.shard_count or stock.current_stock <= 0:
+        return
+    per_quantity = stock.current_stock // stock.shard_count
+    if per_quantity == 0:
+        return
+    per_value = (stock.stock_value * per_quantity / stock.current_stock).quantize(Decimal('0.01'))
+    StockShard.objects.filter(stock=stock).update(quantity=per_quantity, value=per_value)
+    Stock.objects.filter(pk=stock.pk).update(
+        current_stock=F('current_stock') - per_quantity * stock.shard_count,
+        stock_value=F('stock_value') - per_value * stock.shard_count,
+        version=F('version') + 1,
+    )
+
+
+def refresh_stock_status(stock_ids):
+    """
+    按精确余额重算物料的库存状态，只更新状态有变化的物料，返回更新的物料数
+
+    用于分片快路径：快路径不锁 Stock 行，由它在事务提交后补写状态。
+    """
+    stocks = with_exact_balance(Stock.objects.filter(pk__in=stock_ids)).values_list(
+        'pk', 'stock_status', 'exact_stock', 'min_stock', 'max_stock',
+    )
+    count = 0
+    for stock_id, stock_status, quantity, min_stock, max_stock in stocks:
+        expected = classify_stock_status(quantity, min_stock, max_stock)
+        if expected != stock_status:
+            count += Stock.objects.filter(pk=stock_id).update(stock_status=expected)
+    return count
+
+
+def set_shard_count(material_code, shard_count):
+    """
+    为物料开启、调整或关闭（shard_count 为 0）分片余额
+
+    返回更新后的 Stock；物料不存在时抛出 Stock.DoesNotExist。
+    """
+    if not 0 <= shard_count <= MAX_SHARD_COUNT:
+        raise ValueError(f"分片数需在 0 到 {MAX_SHARD_COUNT} 之间")
+    with transaction.atomic():
+        stock = lock_stocks(Stock.objects).get(material_code=material_code)
+        fold_stock_shards([stock])
+        StockShard.objects.filter(stock=stock, shard_no__gte=shard_count).delete()
+        StockShard.objects.bulk_create(
+            [StockShard(stock=stock, shard_no=no) for no in range(shard_count)],
+            ignore_conflicts=True,
+        )
+        stock.shard_count = shard_count
+        Stock.objects.filter(pk=stock.pk).update(shard_count=shard_count, version=F('version') + 1)
+        spread_stock_shards(stock)
+    return stock
+
+
+def rebalance_stock_shards(material_codes=None):
+    """
+    重新平均分摊分片物料的余额，每个物料单独一个事务
+
+    分片余额被单边消耗后，后续扣减会频繁回退到锁定 Stock 行的慢路径，
+    定期执行（manage.py stock_shards --rebalance）可让扣减重新分散到各分片。
+    返回处理的物料数。
+    """
+    queryset = Stock.objects.filter(shard_count__gt=0)
+    if material_codes:
+        queryset = queryset.filter(material_code__in=material_codes)
+    count = 0
+    for stock_id in queryset.values_list('pk', flat=True):
+        with transaction.atomic():
+            stock = lock_stocks(Stock.objects).get(pk=stock_id)
+            fold_stock_shards([stock])
+            spread_stock_shards(stock)
+        count += 1
+    return count
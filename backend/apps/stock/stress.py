@@ -0,0 +1,75 @@
+"""
+出库并发压测工具
+
+多个线程各自持有一个已登录的 Django 测试客户端，同时向同一物料提交出库请求，
+结束后核对最终余额是否等于期初余额减去实际落库的出库数量，且从未出现负库存。
+供测试用例复用，也可在 `manage.py shell` 中针对测试库手动运行。
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.db.models import Max, Sum
+from django.test import Client
+
+from .models import Stock, StockOut
+from .sharding import with_exact_balance
+
+
+def run_stock_out_stress(user, material_code, requests=200, workers=16, quantity=1,
+                         out_value=1, path="/api/stock-out/create/", headers=None):
+    """
+    并发提交 requests 个出库请求，返回压测统计结果
+
+    user: 发起请求的用户（需具备 stock_out:create 权限）
+    headers: 每个请求附带的额外请求头，如 {"HTTP_IDEMPOTENCY_KEY": ...}
+    """
+    stock = with_exact_balance(Stock.objects.all()).get(material_code=material_code)
+    initial_stock = stock.exact_stock
+    last_out_id = StockOut.objects.filter(stock=stock).aggregate(last_id=Max('id'))['last_id'] or 0
+
+    barrier = threading.Barrier(workers)
+    body = {"material_code": material_code, "out_quantity": quantity, "out_value": out_value, "out_type": "sales"}
+
+    def worker(worker_id):
+        client = Client()
+        client.force_login(user)
+        responses = []
+        try:
+            barrier.wait()
+            for _ in range(worker_id, requests, workers):
+                response = client.post(path, data=body, content_type="application/json", **(headers or {}))
+                responses.append((response.status_code, response.json()))
+        finally:
+            connection.close()
+        return responses
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        responses = [r for chunk in executor.map(worker, range(workers)) for r in chunk]
+
+    final_stock = with_exact_balance(Stock.objects.filter(pk=stock.pk)).values_list('exact_stock', flat=True).get()
+    posted_quantity = StockOut.objects.filter(stock=stock, id__gt=last_out_id).aggregate(
+        qty=Sum('out_quantity'))['qty'] or 0
+    reported = [payload["data"]["current_stock"] for status, payload in responses if status == 200]
+
+    return {
+        "requests": len(responses),
+        "succeeded": sum(1 for status, _ in responses if status == 200),
+        "rejected": sum(1 for status, _ in responses if status == 400),
+        "failed": sum(1 for status, _ in responses if status not in (200, 400)),
+        "initial_stock": initial_stock,
+        "final_stock": final_stock,
+        "posted_quantity": posted_quantity,
+        "min_reported_stock": min(reported) if reported else initial_stock,
+    }
+
+
+def assert_stock_consistent(result):
+    """校验压测结果：余额与流水一致、没有负库存、没有非预期错误"""
+    expected = result["initial_stock"] - result["posted_quantity"]
+    if result["final_stock"] != expected:
+        raise AssertionError(f"最终库存 {result['final_stock']} 与流水推算值 {expected} 不一致")
+    if result["final_stock"] < 0 or result["min_reported_stock"] < 0:
+        raise AssertionError(f"出现负库存: {result}")
+    if result["failed"]:
+        raise AssertionError(f"存在 {result['failed']} 个非预期的错误响应")
@@ -0,0 +1,1803 @@
+import json
+import tempfile
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import autocomplete
+from .archive import archive_month, archive_movements, iter_archived
+from .checkpoints import balances_as_of, create_balance_checkpoint
+from .closing import close_month, month_range, next_month, reopen_month
+from .group_commit import GroupCommitter, get_group_committer
+from .idempotency import purge_expired_idempotency_keys
+from .ledger import daily_net_quantities
+from .models import (
+    classify_stock_status, BillNoRegistry, BillSequence, ClosedPeriod, IdempotencyKey, MonthlyClosing, MovementArchive, PeriodAuditLog, PeriodReportCache,
+    Stock, StockCountTask, StockIn, StockLedger, StockLedgerPending, StockOut, StockWarning,
+)
+from .partitioning import default_partition_name, ensure_partitions, is_partitioned, partition_name
+from .posting import MOVEMENT_OUT, change_balance, post_movements, post_stock_in, post_stock_out
+from .reconcile import reconcile_balances, repair_drift
+from .search import TRIGRAM_INDEXES, fuzzy_search, trigram_index_name, trigram_search_enabled
+from .sharding import rebalance_stock_shards, set_shard_count, with_exact_balance
+from .stress import assert_stock_consistent, run_stock_out_stress
+from .triggers import set_balance_triggers
+from .utils import parse_datetime_or_now, supports_update_returning, generate_bill_no, generate_bill_nos, generate_task_no
+
+
+class BillNoTests(TestCase):
+    def test_sequential_numbers(self) -> None:
+        today = timezone.now().strftime('%Y%m%d')
+        self.assertEqual(generate_bill_no("IN"), f"IN-{today}-0001")
+        self.assertEqual(generate_bill_no("IN"), f"IN-{today}-0002")
+        # 不同前缀各自计数
+        self.assertEqual(generate_bill_no("OUT"), f"OUT-{today}-0001")
+        self.assertEqual(generate_task_no(), f"SC-{today}-0001")
+
+    def test_block_reservation(self) -> None:
+        today = timezone.now().strftime('%Y%m%d')
+        generate_bill_no("ADJ")
+        bill_nos = generate_bill_nos("ADJ", 3)
+        self.assertEqual(bill_nos, [f"ADJ-{today}-0002", f"ADJ-{today}-0003", f"ADJ-{today}-0004"])
+        self.assertEqual(BillSequence.objects.get(prefix="ADJ").last_no, 4)
+        self.assertEqual(generate_bill_nos("ADJ", 0), [])
+
+    def test_duplicate_bill_no_rejected(self) -> None:
+        Stock.objects.create(material_code="M001", material_name="螺栓", current_stock=10)
+        line = {
+            "material_code": "M001", "out_quantity": 1, "out_value": Decimal(1), "out_type": "sales",
+            "out_time": timezone.now(), "operator": "", "remark": "",
+        }
+        bill_no = post_stock_out(line)["record"].bill_no
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            post_stock_out(dict(line, out_time=timezone.now() - timedelta(days=400)), bill_no=bill_no)
+        self.assertEqual(StockOut.objects.filter(bill_no=bill_no).count(), 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', "并发分配测试需要 PostgreSQL")
+class BillNoConcurrencyTests(TransactionTestCase):
+    WORKERS = 16
+    PER_WORKER = 250
+
+    def _worker(self, worker_id):
+        try:
+            allocated = []
+            for i in range(self.PER_WORKER):
+                if i % 50 == 0:
+                    allocated.extend(generate_bill_nos("IN", 10))
+                else:
+                    allocated.append(generate_bill_no("IN"))
+            return allocated
+        finally:
+            connection.close()
+
+    def test_parallel_allocation_has_no_collisions(self) -> None:
+        barrier = threading.Barrier(self.WORKERS)
+
+        def run(worker_id):
+            barrier.wait()
+            return self._worker(worker_id)
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            results = list(executor.map(run, range(self.WORKERS)))
+
+        all_nos = [no for chunk in results for no in chunk]
+        expected = self.WORKERS * (self.PER_WORKER + 9 * (self.PER_WORKER // 50))
+        self.assertEqual(len(all_nos), expected)
+        self.assertEqual(len(set(all_nos)), expected)
+        # 号段连续无空号
+        seqs = sorted(int(no.rsplit('-', 1)[-1]) for no in all_nos)
+        self.assertEqual(seqs, list(range(1, expected + 1)))
+
+
+class StockApiTestMixin:
+    def login_admin(self) -> None:
+        user_model = get_user_model()
+        self.user = user_model.objects.create_superuser(
+            username="admin", email="admin@example.com", password="StrongPass123"
+        )
+        self.client = self.admin_client()
+
+    def admin_client(self):
+        client = Client()
+        client.force_login(self.user)
+        return client
+
+    def post_json(self, url, data):
+        return self.client.post(url, data=json.dumps(data), content_type="application/json")
+
+
+class StockInBatchTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.bolt = Stock.objects.create(material_code="M001", material_name="螺栓", max_stock=100)
+        self.nut = Stock.objects.create(material_code="M002", material_name="螺母")
+
+    def test_batch_create_succeeds(self) -> None:
+        response = self.post_json("/api/stock-in/batch-create/", {
+            "operator": "张三",
+            "items": [
+                {"material_code": "M001", "in_quantity": 30, "in_value": 30},
+                {"material_code": "M002", "in_quantity": 5, "in_value": "12.50"},
+                {"material_code": "M001", "in_quantity": 20, "in_value": 20},
+            ],
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual(data["count"], 3)
+        self.assertEqual([line["current_stock"] for line in data["list"]], [30, 5, 50])
+        self.assertEqual(len({line["bill_no"] for line in data["list"]}), 3)
+
+        self.bolt.refresh_from_db()
+        self.nut.refresh_from_db()
+        self.assertEqual(self.bolt.current_stock, 50)
+        self.assertEqual(self.bolt.stock_value, Decimal("50"))
+        self.assertEqual(self.nut.stock_value, Decimal("12.50"))
+        self.assertEqual(StockIn.objects.filter(operator="张三").count(), 3)
+
+    def test_combined_quantity_exceeding_max_stock_rejects_all(self) -> None:
+        response = self.post_json("/api/stock-in/batch-create/", {
+            "items": [
+                {"material_code": "M002", "in_quantity": 5, "in_value": 5},
+                {"material_code": "M001", "in_quantity": 60, "in_value": 60},
+                {"material_code": "M001", "in_quantity": 60, "in_value": 60},
+            ],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(StockIn.objects.count(), 0)
+        self.nut.refresh_from_db()
+        self.assertEqual(self.nut.current_stock, 0)
+
+    def test_invalid_lines_are_reported(self) -> None:
+        response = self.post_json("/api/stock-in/batch-create/", {
+            "items": [
+                {"material_code": "M001", "in_quantity": 0, "in_value": 1},
+                {"material_code": "NOPE", "in_quantity": 1, "in_value": 1},
+            ],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e["line"] for e in response.json()["data"]["errors"]], [0])
+
+        response = self.post_json("/api/stock-in/batch-create/", {
+            "items": [{"material_code": "NOPE", "in_quantity": 1, "in_value": 1}],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["data"]["errors"][0]["line"], 0)
+
+    def test_quantity_accepts_integral_numbers_only(self) -> None:
+        response = self.post_json("/api/stock-in/batch-create/", {
+            "items": [
+                {"material_code": "M001", "in_quantity": True, "in_value": 1},
+                {"material_code": "M001", "in_quantity": 1.5, "in_value": 1},
+                {"material_code": "M001", "in_quantity": "2", "in_value": 1},
+            ],
+        })
+        self.assertEqual([e["line"] for e in response.json()["data"]["errors"]], [0, 1, 2])
+        # 整数值的浮点数（JSON 5.0）按整数处理
+        response = self.post_json("/api/stock-in/create/", {"material_code": "M001", "in_quantity": 5.0, "in_value": 5})
+        self.assertEqual((response.status_code, response.json()["data"]["in_quantity"]), (200, 5))
+        response = self.post_json("/api/stock-out/create/", {
+            "material_code": "M001", "out_quantity": 2.0, "out_value": 2, "out_type": "sales"})
+        self.assertEqual((response.status_code, response.json()["data"]["out_quantity"]), (200, 2))
+        self.assertEqual(self.post_json("/api/stock-out/create/", {
+            "material_code": "M001", "out_quantity": True, "out_value": 1, "out_type": "sales"}).status_code, 400)
+
+
+class StockOutBatchTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.bolt = Stock.objects.create(
+            material_code="M001", material_name="螺栓", current_stock=50, stock_value=Decimal("50")
+        )
+        self.nut = Stock.objects.create(
+            material_code="M002", material_name="螺母", current_stock=10, stock_value=Decimal("20")
+        )
+
+    def test_batch_create_succeeds(self) -> None:
+        response = self.post_json("/api/stock-out/batch-create/", {
+            "out_type": "sales",
+            "items": [
+                {"material_code": "M001", "out_quantity": 20, "out_value": 20},
+                {"material_code": "M002", "out_quantity": 10, "out_value": 20},
+                {"material_code": "M001", "out_quantity": 30, "out_value": 30},
+            ],
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()["data"]
+        self.assertEqual([line["current_stock"] for line in data["list"]], [30, 0, 0])
+
+        self.bolt.refresh_from_db()
+        self.nut.refresh_from_db()
+        self.assertEqual((self.bolt.current_stock, self.bolt.stock_value), (0, Decimal("0")))
+        self.assertEqual((self.nut.current_stock, self.nut.stock_value), (0, Decimal("0")))
+        self.assertEqual(StockOut.objects.filter(out_type="sales").count(), 3)
+
+    def test_combined_shortage_rejects_whole_list(self) -> None:
+        response = self.post_json("/api/stock-out/batch-create/", {
+            "out_type": "sales",
+            "items": [
+                {"material_code": "M002", "out_quantity": 1, "out_value": 2},
+                {"material_code": "M001", "out_quantity": 30, "out_value": 30},
+                {"material_code": "M001", "out_quantity": 30, "out_value": 30},
+            ],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["data"]["errors"][0]["material_code"], "M001")
+        self.assertEqual(StockOut.objects.count(), 0)
+        self.bolt.refresh_from_db()
+        self.nut.refresh_from_db()
+        self.assertEqual((self.bolt.current_stock, self.nut.current_stock), (50, 10))
+
+
+@skipUnless(connection.vendor == 'postgresql', "并发拣货测试需要 PostgreSQL")
+class StockOutBatchConcurrencyTests(StockApiTestMixin, TransactionTestCase):
+    ROUNDS = 20
+
+    def setUp(self) -> None:
+        self.login_admin()
+        self.codes = [f"M{i:03d}" for i in range(1, 6)]
+        for code in self.codes:
+            Stock.objects.create(material_code=code, material_name=code, current_stock=1000)
+
+    def _pick(self, codes):
+        client = self.admin_client()
+        try:
+            statuses = []
+            for _ in range(self.ROUNDS):
+                response = client.post(
+                    "/api/stock-out/batch-create/",
+                    data=json.dumps({
+                        "out_type": "sales",
+                        "items": [{"material_code": c, "out_quantity": 1, "out_value": 1} for c in codes],
+                    }),
+                    content_type="application/json",
+                )
+                statuses.append(response.status_code)
+            return statuses
+        finally:
+            connection.close()
+
+    def test_opposite_line_order_does_not_deadlock(self) -> None:
+        orders = [self.codes, list(reversed(self.codes))] * 4
+        with ThreadPoolExecutor(max_workers=len(orders)) as executor:
+            results = list(executor.map(self._pick, orders))
+
+        self.assertTrue(all(status == 200 for statuses in results for status in statuses))
+        picked = len(orders) * self.ROUNDS
+        for stock in Stock.objects.all():
+            self.assertEqual(stock.current_stock, 1000 - picked)
+
+
+class ConditionalDecrementTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓", current_stock=10)
+
+    def test_stale_read_cannot_oversell(self) -> None:
+        # 模拟视图读到库存后、扣减前被其他请求抢先出库
+        Stock.objects.filter(pk=self.stock.pk).update(current_stock=3)
+        self.assertIsNone(change_balance(-5, Decimal("-5"), stock_id=self.stock.pk))
+        self.assertEqual(change_balance(-3, Decimal("-3"), stock_id=self.stock.pk).current_stock, 0)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 0)
+
+    def test_delete_stock_in_rejects_negative_balance(self) -> None:
+        response = self.post_json("/api/stock-in/create/", {
+            "material_code": "M001", "in_quantity": 5, "in_value": 5,
+        })
+        stock_in_id = response.json()["data"]["id"]
+        self.post_json("/api/stock-out/create/", {
+            "material_code": "M001", "out_quantity": 12, "out_value": 12, "out_type": "sales",
+        })
+        response = self.client.delete(f"/api/stock-in/{stock_in_id}/delete/")
+        self.assertEqual(response.status_code, 400)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 3)
+
+
+@skipUnless(connection.vendor == 'postgresql', "并发出库压测需要 PostgreSQL")
+class StockOutStressTests(StockApiTestMixin, TransactionTestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        Stock.objects.create(material_code="HOT", material_name="畅销品", current_stock=150)
+
+    def test_concurrent_stock_out_never_oversells(self) -> None:
+        result = run_stock_out_stress(self.user, "HOT", requests=300, workers=24)
+        assert_stock_consistent(result)
+        self.assertEqual(result["succeeded"], 150)
+        self.assertEqual(result["rejected"], 150)
+        self.assertEqual(result["final_stock"], 0)
+
+    def test_sharded_stock_out_never_oversells(self) -> None:
+        set_shard_count("HOT", 8)
+        result = run_stock_out_stress(self.user, "HOT", requests=300, workers=24)
+        assert_stock_consistent(result)
+        self.assertEqual(result["succeeded"], 150)
+        self.assertEqual(result["final_stock"], 0)
+        self.assertEqual(rebalance_stock_shards(), 1)
+
+
+
+class MovementVersionTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+        self.record = post_stock_in({
+            "material_code": "M001", "in_quantity": 10, "in_value": Decimal("10"), "in_type": "purchase",
+            "in_time": parse_datetime_or_now(None), "operator": "", "remark": "", "supplier": "",
+        })["record"]
+
+    def put_json(self, url, data):
+        return self.client.put(url, data=json.dumps(data), content_type="application/json")
+
+    def test_update_bumps_version(self) -> None:
+        url = f"/api/stock-in/{self.record.pk}/update/"
+        self.assertEqual(self.client.get(f"/api/stock-in/{self.record.pk}/").json()["data"]["version"], 0)
+        response = self.put_json(url, {"in_quantity": 12, "version": 0})
+        self.assertEqual(response.json()["data"]["version"], 1)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 12)
+
+        # 基于旧版本的修改被拒绝，数量和余额都不变
+        response = self.put_json(url, {"in_quantity": 20, "version": 0})
+        self.assertEqual(response.status_code, 409)
+        self.record.refresh_from_db()
+        self.stock.refresh_from_db()
+        self.assertEqual((self.record.in_quantity, self.record.version, self.stock.current_stock), (12, 1, 12))
+        self.assertEqual(self.put_json(url, {"remark": "x", "version": "abc"}).status_code, 400)
+
+    def test_delete_checks_version(self) -> None:
+        url = f"/api/stock-in/{self.record.pk}/delete/"
+        self.put_json(f"/api/stock-in/{self.record.pk}/update/", {"remark": "改过"})
+        self.assertEqual(self.client.delete(f"{url}?version=0").status_code, 409)
+        self.assertEqual(self.client.delete(f"{url}?version=1").status_code, 200)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 0)
+
+    def test_stock_out_update_conflict(self) -> None:
+        record = post_stock_out({
+            "material_code": "M001", "out_quantity": 4, "out_value": Decimal("4"), "out_type": "sales",
+            "out_time": parse_datetime_or_now(None), "operator": "", "remark": "",
+        })["record"]
+        url = f"/api/stock-out/{record.pk}/update/"
+        self.assertEqual(self.put_json(url, {"out_quantity": 5, "version": 0}).status_code, 200)
+        self.assertEqual(self.put_json(url, {"out_quantity": 6, "version": 0}).status_code, 409)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 5)
+
+
+@skipUnless(connection.vendor == 'postgresql', "并发修改测试需要 PostgreSQL")
+class MovementVersionConcurrencyTests(StockApiTestMixin, TransactionTestCase):
+    WORKERS = 12
+
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+        self.record = post_stock_in({
+            "material_code": "M001", "in_quantity": 100, "in_value": Decimal("100"), "in_type": "purchase",
+            "in_time": parse_datetime_or_now(None), "operator": "", "remark": "", "supplier": "",
+        })["record"]
+        self.url = f"/api/stock-in/{self.record.pk}/"
+
+    def _run(self, worker):
+        barrier = threading.Barrier(self.WORKERS)
+
+        def run(worker_id):
+            client = self.admin_client()
+            try:
+                barrier.wait()
+                return worker(client, worker_id)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            return list(executor.map(run, range(self.WORKERS)))
+
+    def test_same_version_edits_only_one_wins(self) -> None:
+        def edit(client, worker_id):
+            return client.put(
+                f"{self.url}update/", data=json.dumps({"in_quantity": 101 + worker_id, "version": 0}),
+                content_type="application/json",
+            ).status_code
+
+        statuses = self._run(edit)
+        self.assertEqual(sorted(statuses), [200] + [409] * (self.WORKERS - 1))
+        self.record.refresh_from_db()
+        self.stock.refresh_from_db()
+        self.assertEqual(self.record.version, 1)
+        self.assertEqual(self.stock.current_stock, self.record.in_quantity)
+
+    def test_read_modify_write_loses_no_updates(self) -> None:
+        def increment(client, worker_id):
+            while True:
+                current = client.get(self.url).json()["data"]
+                response = client.put(f"{self.url}update/", data=json.dumps({
+                    "in_quantity": current["in_quantity"] + 1, "version": current["version"],
+                }), content_type="application/json")
+                if response.status_code == 200:
+                    return
+                self.assertEqual(response.status_code, 409)
+
+        self._run(increment)
+        self.record.refresh_from_db()
+        self.stock.refresh_from_db()
+        self.assertEqual(self.record.in_quantity, 100 + self.WORKERS)
+        self.assertEqual(self.record.version, self.WORKERS)
+        self.assertEqual(self.stock.current_stock, 100 + self.WORKERS)
+
+class IdempotencyKeyTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓", current_stock=10)
+        self.body = {"material_code": "M001", "out_quantity": 2, "out_value": 2, "out_type": "sales"}
+
+    def post_with_key(self, key, body=None):
+        return self.client.post(
+            "/api/stock-out/create/", data=json.dumps(body or self.body),
+            content_type="application/json", HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_stored_response(self) -> None:
+        first = self.post_with_key("terminal-1-0001")
+        second = self.post_with_key("terminal-1-0001")
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(StockOut.objects.count(), 1)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 8)
+
+    def test_failed_request_does_not_store_key(self) -> None:
+        response = self.post_with_key("terminal-1-0002", dict(self.body, out_quantity=50, out_value=50))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post_with_key("terminal-1-0002").status_code, 200)
+
+    def test_expired_key_is_executed_again(self) -> None:
+        self.post_with_key("terminal-1-0003")
+        IdempotencyKey.objects.update(created_at=timezone.now() - timezone.timedelta(days=2))
+        with self.settings(IDEMPOTENCY_KEY_TTL=3600):
+            response = self.post_with_key("terminal-1-0003")
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(StockOut.objects.count(), 2)
+
+    def test_reused_key_with_different_body_is_rejected(self) -> None:
+        self.assertEqual(self.post_with_key("terminal-1-0006").status_code, 200)
+        response = self.post_with_key("terminal-1-0006", dict(self.body, out_quantity=3, out_value=3))
+        self.assertEqual(response.status_code, 422)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(StockOut.objects.count(), 1)
+
+    def test_keyed_requests_bypass_group_commit(self) -> None:
+        committer = get_group_committer()
+        self.addCleanup(committer.stop)
+        lines_before = committer.line_count
+        with self.settings(GROUP_COMMIT_ENABLED=True):
+            self.assertEqual(self.post_with_key("terminal-1-0007").status_code, 200)
+        # 明细与幂等键在同一事务内由请求线程写入
+        self.assertEqual(committer.line_count, lines_before)
+        self.assertEqual(IdempotencyKey.objects.get(key="terminal-1-0007").status_code, 200)
+
+    def test_purge_expired_keys(self) -> None:
+        self.post_with_key("terminal-1-0004")
+        self.post_with_key("terminal-1-0005")
+        IdempotencyKey.objects.filter(key="terminal-1-0004").update(
+            created_at=timezone.now() - timezone.timedelta(days=2)
+        )
+        self.assertEqual(purge_expired_idempotency_keys(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["terminal-1-0005"])
+
+
+@skipUnless(connection.vendor == 'postgresql', "并发幂等测试需要 PostgreSQL")
+class IdempotencyConcurrencyTests(StockApiTestMixin, TransactionTestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        Stock.objects.create(material_code="M001", material_name="螺栓", current_stock=100)
+
+    def test_parallel_retries_post_once(self) -> None:
+        result = run_stock_out_stress(
+            self.user, "M001", requests=64, workers=16,
+            headers={"HTTP_IDEMPOTENCY_KEY": "terminal-9-0001"},
+        )
+        assert_stock_consistent(result)
+        self.assertEqual(result["succeeded"], 64)
+        self.assertEqual(result["posted_quantity"], 1)
+        self.assertEqual(result["final_stock"], 99)
+
+
+class PostMovementsTests(TestCase):
+    def setUp(self) -> None:
+        self.stock = Stock.objects.create(
+            material_code="M001", material_name="螺栓", current_stock=5, max_stock=20
+        )
+
+    def _in(self, quantity):
+        return ("in", {
+            "material_code": "M001", "in_quantity": quantity, "in_value": Decimal(quantity),
+            "in_type": "purchase", "in_time": parse_datetime_or_now(None),
+            "operator": "", "remark": "", "supplier": "",
+        })
+
+    def _out(self, quantity, code="M001"):
+        return ("out", {
+            "material_code": code, "out_quantity": quantity, "out_value": Decimal(quantity),
+            "out_type": "sales", "out_time": parse_datetime_or_now(None), "operator": "", "remark": "",
+        })
+
+    def test_lines_are_checked_in_order_and_fail_independently(self) -> None:
+        results = post_movements([
+            self._out(8), self._in(10), self._out(8), self._out(1, code="NOPE"), self._in(20),
+        ])
+        self.assertEqual(results[0]["code"], 400)
+        self.assertEqual(results[1]["stock"].current_stock, 15)
+        self.assertEqual(results[2]["stock"].current_stock, 7)
+        self.assertEqual(results[3]["code"], 404)
+        self.assertEqual(results[4]["code"], 400)
+
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 7)
+        self.assertEqual(StockIn.objects.count(), 1)
+        self.assertEqual(StockOut.objects.count(), 1)
+
+
+@skipUnless(connection.vendor == 'postgresql', "组提交测试需要 PostgreSQL")
+class GroupCommitTests(StockApiTestMixin, TransactionTestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        Stock.objects.create(material_code="HOT", material_name="畅销品", current_stock=100)
+
+    def tearDown(self) -> None:
+        get_group_committer().stop()
+
+    def test_concurrent_requests_share_commits(self) -> None:
+        committer = get_group_committer()
+        commits_before = committer.commit_count
+        with self.settings(GROUP_COMMIT_ENABLED=True):
+            result = run_stock_out_stress(self.user, "HOT", requests=200, workers=32)
+
+        assert_stock_consistent(result)
+        self.assertEqual(result["succeeded"], 100)
+        self.assertEqual(result["final_stock"], 0)
+        self.assertLess(committer.commit_count - commits_before, 200)
+        bill_nos = StockOut.objects.values_list("bill_no", flat=True)
+        self.assertEqual(len(set(bill_nos)), 100)
+
+
+class GroupCommitIsolationTests(TransactionTestCase):
+    def setUp(self) -> None:
+        Stock.objects.create(material_code="HOT", material_name="畅销品", current_stock=100)
+        self.committer = GroupCommitter(window_ms=200)
+        self.addCleanup(self.committer.stop)
+
+    def test_failing_line_fails_only_its_own_request(self) -> None:
+        lines = [{
+            "material_code": "HOT", "out_quantity": quantity, "out_value": Decimal("1"), "out_type": "sales",
+            "out_time": timezone.now(), "operator": "", "remark": "",
+        } for quantity in (1, 2, "坏数据", 3, 4)]
+        with ThreadPoolExecutor(len(lines)) as pool:
+            futures = [pool.submit(self.committer.submit, MOVEMENT_OUT, line) for line in lines]
+        with self.assertRaises(TypeError):
+            futures[2].result()
+        results = [futures[i].result() for i in (0, 1, 3, 4)]
+        self.assertTrue(all("record" in result for result in results))
+        self.assertEqual(Stock.objects.get(material_code="HOT").current_stock, 90)
+        self.assertEqual(StockOut.objects.count(), 4)
+
+    def test_timed_out_line_is_withdrawn(self) -> None:
+        committer = GroupCommitter(window_ms=500)
+        self.addCleanup(committer.stop)
+        line = {
+            "material_code": "HOT", "out_quantity": 1, "out_value": Decimal("1"), "out_type": "sales",
+            "out_time": timezone.now(), "operator": "", "remark": "",
+        }
+        outcome = committer.submit(MOVEMENT_OUT, line, timeout=0.05)
+        committer.stop()
+
+        self.assertEqual(outcome["code"], 503)
+        self.assertEqual(StockOut.objects.count(), 0)
+        self.assertEqual(Stock.objects.get(material_code="HOT").current_stock, 100)
+
+
+class MovementStreamTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓", current_stock=5)
+
+    def stream(self, lines):
+        body = "\n".join(line if isinstance(line, str) else json.dumps(line) for line in lines) + "\n"
+        response = self.client.post("/api/movements/stream/", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(chunk) for chunk in b"".join(response.streaming_content).decode().splitlines()]
+
+    def test_stream_is_committed_in_batches(self) -> None:
+        with self.settings(MOVEMENT_STREAM_BATCH_SIZE=2):
+            acks = self.stream([
+                {"type": "in", "material_code": "M001", "in_quantity": 10, "in_value": 10},
+                {"type": "out", "material_code": "M001", "out_quantity": 12, "out_value": 12, "out_type": "production"},
+                "not json",
+                {"type": "out", "material_code": "M001", "out_quantity": 50, "out_value": 50, "out_type": "sales"},
+                {"type": "out", "material_code": "M001", "out_quantity": 0, "out_value": 0, "out_type": "sales"},
+            ])
+
+        self.assertEqual([ack.get("batch") for ack in acks[:-1]], [1, 2, 3])
+        self.assertEqual([a["current_stock"] for a in acks[0]["accepted"]], [15, 3])
+        self.assertEqual([r["line"] for r in acks[1]["rejected"]], [3, 4])
+        self.assertEqual(acks[2]["rejected"][0]["line"], 5)
+        self.assertEqual(acks[-1], {
+            "done": True, "batches": 3, "lines": 5, "accepted_count": 2, "rejected_count": 3,
+        })
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 3)
+
+
+class PostingServiceTests(StockApiTestMixin, TestCase):
+    # 单据号分配 + UPDATE ... RETURNING + 插入记录 + 插入流水账分录
+    POSTING_QUERIES = 4
+
+    def setUp(self) -> None:
+        self.stock = Stock.objects.create(
+            material_code="M001", material_name="螺栓", current_stock=10, max_stock=30
+        )
+
+    def _in_line(self, quantity, in_type="purchase"):
+        return {
+            "material_code": "M001", "in_quantity": quantity, "in_value": Decimal(quantity),
+            "in_type": in_type, "in_time": parse_datetime_or_now(None),
+            "operator": "", "remark": "", "supplier": "",
+        }
+
+    def _out_line(self, quantity):
+        return {
+            "material_code": "M001", "out_quantity": quantity, "out_value": Decimal(quantity),
+            "out_type": "sales", "out_time": parse_datetime_or_now(None), "operator": "", "remark": "",
+        }
+
+    @skipUnless(supports_update_returning(), "数据库不支持 RETURNING")
+    def test_stock_in_posting_round_trips(self) -> None:
+        with self.assertNumQueries(self.POSTING_QUERIES):
+            outcome = post_stock_in(self._in_line(5))
+        self.assertEqual(outcome["stock"].current_stock, 15)
+        self.assertEqual(outcome["record"].stock_id, self.stock.pk)
+
+    @skipUnless(supports_update_returning(), "数据库不支持 RETURNING")
+    def test_stock_out_posting_round_trips(self) -> None:
+        with self.assertNumQueries(self.POSTING_QUERIES):
+            outcome = post_stock_out(self._out_line(4))
+        self.assertEqual(outcome["stock"].current_stock, 6)
+
+    def test_rejections(self) -> None:
+        self.assertEqual(post_stock_out(self._out_line(11))["error"], "库存不足，当前库存量为10")
+        self.assertEqual(post_stock_in(self._in_line(21))["error"], "入库后将超过最大库存量(30)")
+        # 盘盈不受最大库存量限制
+        self.assertEqual(post_stock_in(self._in_line(21, "adjust_gain"))["stock"].current_stock, 31)
+        self.assertIn("禁止入库", post_stock_in(self._in_line(1))["error"])
+        self.assertEqual(post_stock_out(dict(self._out_line(1), material_code="NOPE"))["code"], 404)
+        self.assertEqual(StockOut.objects.count(), 0)
+
+
+class StockCountCompleteTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.bolt = Stock.objects.create(
+            material_code="M001", material_name="螺栓", current_stock=10, unit_price=Decimal("2")
+        )
+        self.nut = Stock.objects.create(
+            material_code="M002", material_name="螺母", current_stock=10, unit_price=Decimal("1")
+        )
+
+    def _count(self, real_qtys):
+        task_id = self.post_json("/api/stock-count/tasks/create/", {"created_by": "张三"}).json()["data"]["id"]
+        for item in StockCountTask.objects.get(pk=task_id).items.all():
+            self.post_json("/api/stock-count/items/submit/", {
+                "item_id": item.id, "real_qty": real_qtys[item.material_code],
+            })
+        return task_id
+
+    def test_complete_posts_adjustments(self) -> None:
+        task_id = self._count({"M001": 12, "M002": 7})
+        response = self.post_json(f"/api/stock-count/tasks/{task_id}/complete/", {})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["data"]["adjust_count"], 2)
+        self.bolt.refresh_from_db()
+        self.nut.refresh_from_db()
+        self.assertEqual((self.bolt.current_stock, self.nut.current_stock), (12, 7))
+        self.assertEqual(StockIn.objects.get().in_value, Decimal("4"))
+        self.assertEqual(StockOut.objects.get().out_value, Decimal("3"))
+
+    def test_loss_exceeding_balance_rolls_back(self) -> None:
+        task_id = self._count({"M001": 12, "M002": 2})
+        Stock.objects.filter(pk=self.nut.pk).update(current_stock=5)
+        response = self.post_json(f"/api/stock-count/tasks/{task_id}/complete/", {})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(StockIn.objects.count() + StockOut.objects.count(), 0)
+        self.assertEqual(StockCountTask.objects.get(pk=task_id).status, "doing")
+
+
+class ShardedBalanceTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(
+            material_code="HOT", material_name="畅销品", current_stock=101,
+            stock_value=Decimal("202"), max_stock=200, min_stock=5,
+        )
+        set_shard_count("HOT", 4)
+
+    def exact(self):
+        return self.client.get(f"/api/stock/{self.stock.pk}/").json()["data"]
+
+    def _out_line(self, quantity):
+        return {
+            "material_code": "HOT", "out_quantity": quantity, "out_value": Decimal(quantity * 2),
+            "out_type": "sales", "out_time": parse_datetime_or_now(None), "operator": "", "remark": "",
+        }
+
+    def test_enable_spreads_balance(self) -> None:
+        self.assertEqual(list(self.stock.shards.values_list("quantity", flat=True)), [25] * 4)
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.current_stock, self.stock.stock_value), (1, Decimal("2")))
+        detail = self.exact()
+        self.assertEqual((detail["current_stock"], Decimal(detail["stock_value"])), (101, Decimal("202")))
+
+    def test_list_orders_by_exact_balance(self) -> None:
+        # 分片物料基础余额为 1、精确余额为 101，应排在库存 50 的物料之前
+        Stock.objects.create(material_code="MID", material_name="普通品", current_stock=50)
+        data = self.client.get("/api/stock/", {"ordering": "-current_stock"}).json()["data"]
+        self.assertEqual([(item["material_code"], item["current_stock"]) for item in data["list"]],
+                         [("HOT", 101), ("MID", 50)])
+        # 游标分页按同一排序翻页
+        first = self.client.get("/api/stock/", {"ordering": "-current_stock", "cursor": "", "page_size": 1}).json()
+        second = self.client.get("/api/stock/", {"ordering": "-current_stock", "page_size": 1,
+                                                 "cursor": first["data"]["next_cursor"]}).json()
+        self.assertEqual([first["data"]["list"][0]["material_code"], second["data"]["list"][0]["material_code"]],
+                         ["HOT", "MID"])
+
+    def test_stock_out_updates_single_shard(self) -> None:
+        outcome = post_stock_out(self._out_line(10))
+        self.assertEqual(outcome["stock"].current_stock, 91)
+        self.assertEqual(sorted(self.stock.shards.values_list("quantity", flat=True)), [15, 25, 25, 25])
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_stock, 1)
+
+        # 单个分片不够扣时折叠后在整体余额上扣减，再重新分摊
+        outcome = post_stock_out(self._out_line(40))
+        self.assertEqual(outcome["stock"].current_stock, 51)
+        self.assertEqual(list(self.stock.shards.values_list("quantity", flat=True)), [12] * 4)
+        self.assertEqual(post_stock_out(self._out_line(52))["error"], "库存不足，当前库存量为51")
+        self.assertEqual(Decimal(self.exact()["stock_value"]), Decimal("102"))
+
+    def test_stock_in_checks_exact_max_stock(self) -> None:
+        line = {
+            "material_code": "HOT", "in_quantity": 100, "in_value": Decimal("100"), "in_type": "purchase",
+            "in_time": parse_datetime_or_now(None), "operator": "", "remark": "", "supplier": "",
+        }
+        self.assertEqual(post_stock_in(line)["error"], "入库后将超过最大库存量(200)")
+        self.assertEqual(post_stock_in(dict(line, in_quantity=99))["stock"].current_stock, 200)
+
+    def test_batch_and_reads_use_exact_totals(self) -> None:
+        response = self.post_json("/api/stock-out/batch-create/", {
+            "out_type": "sales",
+            "items": [{"material_code": "HOT", "out_quantity": 60, "out_value": 120}],
+        })
+        self.assertEqual(response.json()["data"]["list"][0]["current_stock"], 41)
+        post_stock_out(self._out_line(1))
+        self.assertEqual(self.exact()["current_stock"], 40)
+
+        listed = self.client.get("/api/stock/").json()["data"]["list"]
+        self.assertEqual(listed[0]["current_stock"], 40)
+        overview = self.client.get("/api/statistics/overview/").json()["data"]["stock"]
+        self.assertEqual((overview["total_qty"], Decimal(str(overview["total_value"]))), (40, Decimal("80")))
+
+    def test_disable_folds_back(self) -> None:
+        post_stock_out(self._out_line(3))
+        set_shard_count("HOT", 0)
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.current_stock, self.stock.shard_count), (98, 0))
+        self.assertFalse(self.stock.shards.exists())
+        self.assertEqual(post_stock_out(self._out_line(8))["stock"].current_stock, 90)
+
+
+class StockLedgerTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+
+    def _in_line(self, quantity):
+        return {
+            "material_code": "M001", "in_quantity": quantity, "in_value": Decimal(quantity), "in_type": "purchase",
+            "in_time": parse_datetime_or_now(None), "operator": "", "remark": "", "supplier": "",
+        }
+
+    def _out_line(self, quantity):
+        return {
+            "material_code": "M001", "out_quantity": quantity, "out_value": Decimal(quantity), "out_type": "sales",
+            "out_time": parse_datetime_or_now(None), "operator": "", "remark": "",
+        }
+
+    def assertLedgerConsistent(self) -> None:
+        entries = list(StockLedger.objects.filter(stock=self.stock).order_by("sequence"))
+        self.assertEqual([entry.sequence for entry in entries], list(range(1, len(entries) + 1)))
+        balance = 0
+        for entry in entries:
+            balance += entry.quantity
+            self.assertEqual(entry.balance_quantity, balance)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.ledger_seq, len(entries))
+        exact = with_exact_balance(Stock.objects.filter(pk=self.stock.pk)).get()
+        self.assertEqual((balance, entries[-1].balance_value), (exact.exact_stock, exact.exact_value))
+
+    def test_postings_and_reversals(self) -> None:
+        record = post_stock_in(self._in_line(10))["record"]
+        out_record = post_stock_out(self._out_line(3))["record"]
+        self.client.put(f"/api/stock-in/{record.pk}/update/", data=json.dumps({"in_quantity": 12}),
+                        content_type="application/json")
+        # 撤销后库存为负被拒绝，不记账
+        self.assertEqual(self.client.delete(f"/api/stock-in/{record.pk}/delete/").status_code, 400)
+        self.client.delete(f"/api/stock-out/{out_record.pk}/delete/")
+
+        entries = StockLedger.objects.filter(stock=self.stock).order_by("sequence")
+        self.assertEqual(
+            [(e.entry_type, e.quantity, e.balance_quantity) for e in entries],
+            [("in", 10, 10), ("out", -3, 7), ("reversal", -10, -3), ("in", 12, 9), ("reversal", 3, 12)],
+        )
+        self.assertEqual({e.source_id for e in entries if e.source_type == "stock_in"}, {record.pk})
+        self.assertLedgerConsistent()
+
+    def test_entry_times_are_aware(self) -> None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            self.post_json("/api/stock-in/create/", {"material_code": "M001", "in_quantity": 5, "in_value": 5})
+            self.post_json("/api/stock-in/create/", {
+                "material_code": "M001", "in_quantity": 1, "in_value": 1, "in_time": "2024-01-05T10:00:00",
+            })
+        self.assertEqual(
+            StockLedger.objects.filter(stock=self.stock).order_by("sequence").last().occurred_at,
+            timezone.make_aware(datetime(2024, 1, 5, 10)),
+        )
+        self.assertTrue(timezone.is_aware(parse_datetime_or_now("")))
+
+    def test_batch_paths_keep_running_balance(self) -> None:
+        self.post_json("/api/stock-in/batch-create/", {"items": [
+            {"material_code": "M001", "in_quantity": 5, "in_value": 5},
+            {"material_code": "M001", "in_quantity": 7, "in_value": 7},
+        ]})
+        self.post_json("/api/stock-out/batch-create/", {"out_type": "sales", "items": [
+            {"material_code": "M001", "out_quantity": 4, "out_value": 4},
+        ]})
+        post_movements([("out", self._out_line(100)), ("out", self._out_line(2)), ("in", self._in_line(1))])
+        self.assertEqual(
+            list(StockLedger.objects.filter(stock=self.stock).values_list("balance_quantity", flat=True)
+                 .order_by("sequence")),
+            [5, 12, 8, 6, 7],
+        )
+        self.assertLedgerConsistent()
+
+    def test_sharded_entries_sealed_on_fold(self) -> None:
+        post_stock_in(self._in_line(40))
+        set_shard_count("M001", 4)
+        post_stock_out(self._out_line(3))
+        post_stock_out(self._out_line(2))
+        self.assertEqual(StockLedgerPending.objects.filter(stock=self.stock).count(), 2)
+        self.assertEqual(StockLedger.objects.filter(stock=self.stock).count(), 1)
+        # 入账前按业务时间的汇总已包含暂存分录
+        self.assertEqual(balances_as_of(timezone.now())[1][self.stock.pk], [35, Decimal("35.00")])
+        self.assertEqual(daily_net_quantities(self.stock.pk, 1)[0][1], 35)
+
+        with CaptureQueriesContext(connection) as queries:
+            rebalance_stock_shards()
+        # 入账只追加流水账，不改写已有分录
+        self.assertFalse([q for q in queries if q["sql"].startswith('UPDATE "stock_ledger"')])
+        self.assertFalse(StockLedgerPending.objects.exists())
+        self.assertEqual(balances_as_of(timezone.now())[1][self.stock.pk], [35, Decimal("35.00")])
+        self.assertLedgerConsistent()
+
+    def test_ledger_endpoint_pages_by_sequence(self) -> None:
+        for quantity in (1, 2, 3):
+            post_stock_in(self._in_line(quantity))
+        data = self.client.get(f"/api/stock/{self.stock.pk}/ledger/?limit=2").json()["data"]
+        self.assertEqual([e["balance_quantity"] for e in data["list"]], [1, 3])
+        data = self.client.get(f"/api/stock/{self.stock.pk}/ledger/?after={data['next_after']}").json()["data"]
+        self.assertEqual([e["sequence"] for e in data["list"]], [3])
+        self.assertIsNone(data["next_after"])
+
+    def test_entries_are_append_only(self) -> None:
+        post_stock_in(self._in_line(1))
+        entry = StockLedger.objects.get()
+        entry.quantity = 2
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+
+class DatedMovementMixin(StockApiTestMixin):
+    @staticmethod
+    def _at(year, month, day):
+        return timezone.make_aware(datetime(year, month, day))
+
+    def _in(self, quantity, at, material_code="M001"):
+        return post_stock_in({
+            "material_code": material_code, "in_quantity": quantity, "in_value": Decimal(quantity), "in_type": "purchase",
+            "in_time": at, "operator": "", "remark": "", "supplier": "",
+        })["record"]
+
+    def _out(self, quantity, at):
+        return post_stock_out({
+            "material_code": "M001", "out_quantity": quantity, "out_value": Decimal(quantity), "out_type": "sales",
+            "out_time": at, "operator": "", "remark": "",
+        })["record"]
+
+
+class BalanceAsOfTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+        Stock.objects.filter(pk=self.stock.pk).update(created_at=self._at(2023, 12, 1))
+
+    def _quantity_as_of(self, at):
+        return balances_as_of(at)[1].get(self.stock.pk, [0])[0]
+
+    def test_balances_follow_business_time(self) -> None:
+        self._in(10, self._at(2024, 1, 1))
+        self._out(3, self._at(2024, 2, 1))
+        self._in(5, self._at(2024, 3, 1))
+        self.assertEqual(self._quantity_as_of(self._at(2023, 12, 31)), 0)
+        self.assertEqual(self._quantity_as_of(self._at(2024, 1, 15)), 10)
+        self.assertEqual(self._quantity_as_of(self._at(2024, 2, 15)), 7)
+        self.assertEqual(self._quantity_as_of(timezone.now()), 12)
+
+    def test_checkpoint_with_late_entries(self) -> None:
+        self._in(10, self._at(2024, 1, 1))
+        out_record = self._out(3, self._at(2024, 2, 1))
+        self.assertEqual(create_balance_checkpoint(self._at(2024, 2, 10)), 1)
+        self._in(5, self._at(2024, 3, 1))
+        # 检查点之后补录、撤销的单据，业务时间早于检查点
+        self._in(4, self._at(2024, 1, 20))
+        self.client.delete(f"/api/stock-out/{out_record.pk}/delete/")
+
+        checkpoint_at, balances = balances_as_of(self._at(2024, 2, 15))
+        self.assertEqual(checkpoint_at, self._at(2024, 2, 10))
+        self.assertEqual(balances[self.stock.pk], [14, Decimal("14")])
+        self.assertEqual(self._quantity_as_of(self._at(2024, 1, 25)), 14)
+        self.assertEqual(self._quantity_as_of(self._at(2024, 3, 2)), 19)
+
+        # 重新生成检查点吸收补录的分录
+        create_balance_checkpoint(self._at(2024, 2, 10))
+        self.assertEqual(self.stock.checkpoints.get().quantity, 14)
+        self.assertEqual(self._quantity_as_of(self._at(2024, 3, 2)), 19)
+
+    def test_as_of_endpoint(self) -> None:
+        Stock.objects.create(material_code="M002", material_name="螺母")
+        Stock.objects.create(material_code="M003", material_name="垫片")
+        self._in(10, self._at(2024, 1, 1))
+        create_balance_checkpoint(self._at(2024, 1, 2))
+        self._out(4, self._at(2024, 1, 3))
+        # M003 在该时点之后才建档，但补录了时点之前的入库
+        self._in(2, self._at(2024, 1, 4), material_code="M003")
+
+        data = self.client.get("/api/stock/as-of/", {"at": "2024-01-05T00:00:00"}).json()["data"]
+        self.assertEqual(data["checkpoint_at"], "2024-01-01T16:00:00Z")
+        # M002 在该时点之后才建档
+        self.assertEqual(
+            [(item["material_code"], item["quantity"]) for item in data["list"]], [("M001", 6), ("M003", 2)],
+        )
+        self.assertEqual((data["total_quantity"], data["total_value"]), (8, "8.00"))
+
+        for code, expected in (("M002", []), ("M003", [2])):
+            data = self.client.get("/api/stock/as-of/", {"at": "2024-01-05", "material_code": code}).json()["data"]
+            self.assertEqual([item["quantity"] for item in data["list"]], expected)
+        self.assertEqual(self.client.get("/api/stock/as-of/", {"at": "yesterday"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/stock/as-of/", {"at": "2024-01-05", "material_code": "X"}).status_code, 404)
+
+
+class MonthlyClosingTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+        this_month = timezone.localdate().replace(day=1)
+        self.first = (this_month - timezone.timedelta(days=40)).replace(day=1)
+        self.second = next_month(self.first)
+
+    def _day(self, month, day):
+        return self._at(month.year, month.month, day)
+
+    def _detail(self, month):
+        return self.client.get("/api/monthly-report/detail/", {"month": f"{month:%Y-%m}"}).json()["data"]
+
+    def test_closed_month_reads_snapshot(self) -> None:
+        self._in(10, self._day(self.first, 5))
+        self._out(3, self._day(self.first, 20))
+        self._in(5, self._day(self.second, 3))
+        record = self._in(2, self._day(self.second, 10))
+        self.client.delete(f"/api/stock-in/{record.pk}/delete/")
+
+        self.assertEqual(close_month(self.first), 1)
+        with self.assertRaises(ValueError):
+            close_month(self.first)
+        with self.assertRaises(ValueError):
+            close_month(next_month(self.second))
+
+        # 结账后的入库不影响已结月份的月末结存
+        self._in(100, timezone.now())
+        data = self._detail(self.first)
+        self.assertTrue(data["closed"])
+        item = data["details"][0]
+        self.assertEqual((item["opening_qty"], item["in_qty"], item["out_qty"], item["current_stock"]), (0, 10, 3, 7))
+
+        live = self._detail(self.second)
+        self.assertFalse(live["closed"])
+        self.assertEqual(close_month(self.second), 1)
+        closed = self._detail(self.second)
+        self.assertEqual(live["details"], closed["details"])
+        self.assertEqual(
+            (closed["details"][0]["opening_qty"], closed["details"][0]["in_qty"], closed["details"][0]["current_stock"]),
+            (7, 5, 12),
+        )
+        self.assertEqual(self.stock.monthly_closings.get(month=self.second).in_count, 1)
+
+        months = {m["month"]: m for m in self.client.get("/api/monthly-report/").json()["data"]}
+        self.assertTrue(months[f"{self.first:%Y-%m}"]["closed"])
+        self.assertEqual(months[f"{self.second:%Y-%m}"]["in_qty"], 5)
+        current = months[timezone.localdate().strftime("%Y-%m")]
+        self.assertEqual((current["closed"], current["in_qty"]), (False, 100))
+
+    def test_current_month_computed_live(self) -> None:
+        self._in(4, self._day(self.first, 1))
+        self._out(1, timezone.now())
+        item = self._detail(timezone.localdate())["details"][0]
+        self.assertEqual((item["opening_qty"], item["out_qty"], item["current_stock"]), (4, 1, 3))
+
+
+class PeriodLockTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+        this_month = timezone.localdate().replace(day=1)
+        self.first = (this_month - timezone.timedelta(days=40)).replace(day=1)
+        self.second = next_month(self.first)
+        self.record = self._in(10, self._at(self.first.year, self.first.month, 5))
+        self._out(2, self._at(self.second.year, self.second.month, 5))
+        self._in(1, timezone.now())
+        close_month(self.first)
+
+    def test_closed_period_rejects_changes(self) -> None:
+        back_dated = self._at(self.first.year, self.first.month, 20)
+        outcome = post_stock_in({
+            "material_code": "M001", "in_quantity": 1, "in_value": Decimal(1), "in_type": "purchase",
+            "in_time": back_dated, "operator": "", "remark": "", "supplier": "",
+        })
+        self.assertEqual(outcome["code"], 400)
+        self.assertIn("已结账", outcome["error"])
+        response = self.post_json("/api/stock-out/batch-create/", {"out_type": "sales", "out_time": back_dated.isoformat(),
+                                                                  "items": [{"material_code": "M001", "out_quantity": 1}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.put(f"/api/stock-in/{self.record.pk}/update/", data=json.dumps({"remark": "x"}),
+                                         content_type="application/json").status_code, 400)
+        self.assertEqual(self.client.delete(f"/api/stock-in/{self.record.pk}/delete/").status_code, 400)
+        results = post_movements([("in", {
+            "material_code": "M001", "in_quantity": 1, "in_value": Decimal(1), "in_type": "purchase",
+            "in_time": back_dated, "operator": "", "remark": "", "supplier": "",
+        })])
+        self.assertEqual(results[0]["code"], 400)
+        # 未结账的期间不受影响
+        self.assertEqual(self.client.delete(f"/api/stock-in/{StockIn.objects.latest('pk').pk}/delete/").status_code, 200)
+
+    def test_closed_period_reports_are_cached(self) -> None:
+        params = {"month": f"{self.first:%Y-%m}"}
+        trend_before = self.client.get("/api/statistics/trend/", {"days": 90}).json()["data"]
+        detail = self.client.get("/api/monthly-report/detail/", params).json()["data"]
+        self.assertEqual(detail["details"][0]["current_stock"], 10)
+        self.assertEqual(self.client.get("/api/statistics/trend/", {"days": 90}).json()["data"], trend_before)
+        self.assertEqual(
+            set(PeriodReportCache.objects.values_list("key", flat=True)), {"monthly_detail", "daily_trend"},
+        )
+
+        # 缓存命中后不再读取快照
+        MonthlyClosing.objects.filter(month=self.first).update(closing_quantity=0)
+        self.assertEqual(self.client.get("/api/monthly-report/detail/", params).json()["data"], detail)
+        self.client.get("/api/monthly-report/")
+        self.assertEqual(PeriodReportCache.objects.count(), 3)
+
+        self.assertEqual(self.post_json("/api/monthly-report/reopen/", params).status_code, 400)
+        response = self.post_json("/api/monthly-report/reopen/", dict(params, reason="补录采购单"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(PeriodReportCache.objects.exists())
+        self.assertFalse(MonthlyClosing.objects.filter(month=self.first).exists())
+        self.assertEqual(
+            list(PeriodAuditLog.objects.order_by("pk").values_list("action", "operator", "reason")),
+            [("close", "", ""), ("reopen", "admin", "补录采购单")],
+        )
+        self.assertFalse(self.client.get("/api/monthly-report/detail/", params).json()["data"]["closed"])
+
+    def test_sequential_close_and_reopen(self) -> None:
+        with self.assertRaises(ValueError):
+            close_month(next_month(self.second))
+        self.assertEqual(self.post_json("/api/monthly-report/close/", {"month": f"{self.second:%Y-%m}"}).status_code, 200)
+        self.assertEqual(ClosedPeriod.objects.get(month=self.second).closed_by, "admin")
+        with self.assertRaises(ValueError):
+            reopen_month(self.first, "admin", "补录")
+        reopen_month(self.second, "admin", "补录")
+        reopen_month(self.first, "admin", "补录")
+        self.assertFalse(ClosedPeriod.objects.exists())
+
+    def test_interrupted_close_resumes(self) -> None:
+        # 期间锁已提交、快照尚未写入时中断
+        ClosedPeriod.objects.create(month=self.second, status="closing")
+        params = {"month": f"{self.second:%Y-%m}"}
+        outcome = post_stock_in({
+            "material_code": "M001", "in_quantity": 1, "in_value": Decimal(1), "in_type": "purchase",
+            "in_time": self._at(self.second.year, self.second.month, 20), "operator": "", "remark": "", "supplier": "",
+        })
+        self.assertEqual(outcome["code"], 400)
+        self.assertFalse(self.client.get("/api/monthly-report/detail/", params).json()["data"]["closed"])
+        self.assertFalse(PeriodReportCache.objects.exists())
+        with self.assertRaises(ValueError):
+            close_month(next_month(self.second))
+        with self.assertRaises(ValueError):
+            reopen_month(self.second, "admin", "补录")
+
+        self.assertEqual(close_month(self.second, operator="admin"), 1)
+        period = ClosedPeriod.objects.get(month=self.second)
+        self.assertEqual((period.status, period.closed_by), ("closed", "admin"))
+        self.assertTrue(self.client.get("/api/monthly-report/detail/", params).json()["data"]["closed"])
+        with self.assertRaises(ValueError):
+            close_month(self.second)
+
+
+@skipUnless(connection.vendor == 'postgresql', "分区测试需要 PostgreSQL")
+class MovementPartitionTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+        self.month = timezone.localdate().replace(day=1)
+
+    @staticmethod
+    def _partition_of(model, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {model._meta.db_table} WHERE id = %s", [pk])
+            return cursor.fetchone()[0]
+
+    def test_range_queries_prune_partitions(self) -> None:
+        self.assertTrue(is_partitioned("stock_in"))
+        self.assertTrue(is_partitioned("stock_out"))
+        record = self._in(10, timezone.now())
+        self.assertEqual(self._partition_of(StockIn, record.pk), partition_name("stock_in", self.month))
+
+        start, end = month_range(self.month)
+        plan = StockIn.objects.filter(in_time__gte=start, in_time__lt=end).explain()
+        self.assertIn(partition_name("stock_in", self.month), plan)
+        self.assertNotIn(partition_name("stock_in", next_month(self.month)), plan)
+        self.assertNotIn(default_partition_name("stock_in"), plan)
+
+    def test_default_partition_rows_move_to_new_partition(self) -> None:
+        old_month = self.month.replace(year=self.month.year - 5)
+        record = self._in(10, self._at(old_month.year, old_month.month, 3))
+        self.assertEqual(self._partition_of(StockIn, record.pk), default_partition_name("stock_in"))
+
+        created = ensure_partitions(self.month, self.month)
+        self.assertEqual(created, [partition_name("stock_in", old_month)])
+        self.assertEqual(self._partition_of(StockIn, record.pk), partition_name("stock_in", old_month))
+        # 迁移分区后修改、撤销仍按 (id, 业务时间) 定位
+        self.assertEqual(self.client.delete(f"/api/stock-in/{record.pk}/delete/").status_code, 200)
+        self.assertFalse(StockIn.objects.filter(pk=record.pk).exists())
+
+    def test_bill_no_registry_follows_rows(self) -> None:
+        old_month = self.month.replace(year=self.month.year - 5)
+        record = self._in(10, self._at(old_month.year, old_month.month, 3))
+        registered = BillNoRegistry.objects.filter(table_name="stock_in", bill_no=record.bill_no)
+        self.assertTrue(registered.exists())
+        # 分区表上没有单据号唯一索引，重复单据号由登记表拒绝（跨分区同样生效）
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            post_stock_in({
+                "material_code": "M001", "in_quantity": 1, "in_value": Decimal(1), "in_type": "purchase",
+                "in_time": timezone.now(), "operator": "", "remark": "", "supplier": "",
+            }, bill_no=record.bill_no)
+
+        # 记录迁入新分区时先注销再登记
+        ensure_partitions(self.month, self.month)
+        self.assertEqual(registered.count(), 1)
+        StockIn.objects.filter(pk=record.pk).update(bill_no="IN-MANUAL-0001")
+        self.assertFalse(registered.exists())
+        self.assertEqual(self.client.delete(f"/api/stock-in/{record.pk}/delete/").status_code, 200)
+        self.assertFalse(BillNoRegistry.objects.exists())
+
+
+class MovementArchiveTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings_override = override_settings(STOCK_ARCHIVE_DIR=archive_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓")
+        this_month = timezone.localdate().replace(day=1)
+        self.first = (this_month - timezone.timedelta(days=40)).replace(day=1)
+        self._in(10, self._at(self.first.year, self.first.month, 5))
+        self._in(4, self._at(self.first.year, self.first.month, 6))
+        self._out(2, self._at(self.first.year, self.first.month, 6))
+        self._in(1, timezone.now())
+        close_month(self.first)
+
+    def _reports(self, at):
+        PeriodReportCache.objects.all().delete()
+        return [self.client.get(url, params).json()["data"] for url, params in (
+            ("/api/statistics/trend/", {"days": 90}),
+            ("/api/statistics/ranking/", {"type": "in"}),
+            ("/api/monthly-report/detail/", {"month": f"{self.first:%Y-%m}"}),
+            ("/api/stock/as-of/", {"at": at.isoformat()}),
+        )]
+
+    def test_archive_keeps_reports(self) -> None:
+        at = timezone.now()
+        before = self._reports(at)
+        archives = archive_movements(self.first)
+        self.assertEqual(sorted((a.direction, a.row_count) for a in archives), [("in", 2), ("out", 1)])
+        self.assertEqual(StockIn.objects.count(), 1)
+        self.assertFalse(StockOut.objects.exists())
+        self.assertEqual(self._reports(at), before)
+        # 重复执行不再归档；已归档的月份不能反结账
+        self.assertEqual(archive_movements(self.first), [])
+        with self.assertRaises(ValueError):
+            reopen_month(self.first, "admin", "补录")
+
+    def test_list_include_archived(self) -> None:
+        archive_movements(self.first)
+        self.assertEqual(self.client.get("/api/stock-in/").json()["data"]["total"], 1)
+
+        data = self.client.get("/api/stock-in/", {"include_archived": "true"}).json()["data"]
+        self.assertEqual([(item["in_quantity"], item["archived"]) for item in data["list"]],
+                         [(1, False), (4, True), (10, True)])
+        self.assertEqual(data["total"], 3)
+
+        data = self.client.get("/api/stock-in/", {"include_archived": "true", "page": 2, "page_size": 2}).json()["data"]
+        self.assertEqual([item["in_quantity"] for item in data["list"]], [10])
+        data = self.client.get("/api/stock-in/", {
+            "include_archived": "true", "end_time": self._at(self.first.year, self.first.month, 5).isoformat(),
+        }).json()["data"]
+        self.assertEqual([item["in_quantity"] for item in data["list"]], [10])
+        data = self.client.get("/api/stock-out/", {"include_archived": "true", "search": "m001"}).json()["data"]
+        self.assertEqual((data["total"], data["list"][0]["out_quantity"]), (1, 2))
+        self.assertEqual(self.client.get("/api/stock-out/", {"include_archived": "true", "search": "X"})
+                         .json()["data"]["total"], 0)
+
+    def test_list_include_archived_total_after_full_page(self) -> None:
+        archive_movements(self.first)
+        params = {"include_archived": "true", "page_size": 1}
+        # 本页取满后，归档部分的总数取自汇总行，不再读取归档文件
+        with mock.patch("apps.stock.archive.gzip.open", side_effect=AssertionError):
+            data = self.client.get("/api/stock-in/", params).json()["data"]
+        self.assertEqual((data["total"], data["total_exact"], len(data["list"])), (3, True, 1))
+        day = self._at(self.first.year, self.first.month, 1)
+        data = self.client.get("/api/stock-in/", dict(params, start_time=day.isoformat(), search="m001")).json()["data"]
+        self.assertEqual((data["total"], data["total_exact"]), (3, True))
+
+        # 汇总行无法表达的筛选条件：扫描的归档记录不足抽样上限时仍精确计数，否则按匹配比例估算
+        data = self.client.get("/api/stock-in/", dict(params, in_type="purchase")).json()["data"]
+        self.assertEqual((data["total"], data["total_exact"]), (3, True))
+        with mock.patch("apps.stock.archive.ARCHIVE_COUNT_SAMPLE_ROWS", 0):
+            data = self.client.get("/api/stock-in/", dict(params, in_type="purchase")).json()["data"]
+        self.assertEqual((data["total"], data["total_exact"]), (3, False))
+
+    def test_archive_deletes_in_keyset_chunks(self) -> None:
+        reopen_month(self.first, "admin", "补录")
+        # 同一业务时间的多条记录跨批，按 (业务时间, id) 键集续读
+        for quantity in (1, 2, 3):
+            self._in(quantity, self._at(self.first.year, self.first.month, 7))
+        close_month(self.first)
+
+        with mock.patch("apps.stock.archive.ARCHIVE_CHUNK_SIZE", 2):
+            archive = archive_month("in", self.first)
+        self.assertEqual(archive.row_count, 5)
+        self.assertEqual(StockIn.objects.count(), 1)
+        self.assertEqual([record.in_quantity for record in iter_archived("in")], [3, 2, 1, 4, 10])
+
+    def test_only_closed_months(self) -> None:
+        self.assertEqual(archive_movements(self.first - timezone.timedelta(days=1)), [])
+        reopen_month(self.first, "admin", "补录")
+        self.assertEqual(archive_movements(self.first), [])
+        self.assertFalse(MovementArchive.objects.exists())
+        self.assertEqual(StockIn.objects.count(), 3)
+
+
+class ReconcileMixin(StockApiTestMixin):
+    def _create_stocks(self):
+        for code, value in (("M001", "5.00"), ("M002", "0"), ("HOT", "0")):
+            self.post_json("/api/stock/init/", {"material_code": code, "material_name": code, "stock_value": value})
+        set_shard_count("HOT", 4)
+        for code in ("M001", "M002", "HOT", "HOT"):
+            post_stock_in({
+                "material_code": code, "in_quantity": 10, "in_value": Decimal(10), "in_type": "purchase",
+                "in_time": timezone.now(), "operator": "", "remark": "", "supplier": "",
+            })
+        post_stock_out({
+            "material_code": "HOT", "out_quantity": 3, "out_value": Decimal(3), "out_type": "sales",
+            "out_time": timezone.now(), "operator": "", "remark": "",
+        })
+
+    @staticmethod
+    def _drifts(**kwargs):
+        return [drift for _, drifts in reconcile_balances(**kwargs) for drift in drifts]
+
+
+class ReconcileTests(ReconcileMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self._create_stocks()
+
+    def test_detect_and_repair_drift(self) -> None:
+        self.assertEqual(self._drifts(chunk_size=2), [])
+        Stock.objects.filter(material_code="M002").update(current_stock=F("current_stock") + 5)
+        Stock.objects.filter(material_code="HOT").update(stock_value=F("stock_value") - 1)
+
+        drifts = self._drifts(chunk_size=2)
+        self.assertEqual(
+            [(d["material_code"], d["current_stock"], d["expected_stock"], d["expected_value"]) for d in drifts],
+            [("M002", 15, 10, Decimal("10")), ("HOT", 17, 17, Decimal("17"))],
+        )
+        self.assertEqual(repair_drift([drift["stock_id"] for drift in drifts]), 2)
+        self.assertEqual(self._drifts(), [])
+        stock = with_exact_balance(Stock.objects.all()).get(material_code="HOT")
+        self.assertEqual((stock.exact_stock, stock.exact_value), (17, Decimal("17")))
+
+
+@skipUnless(connection.vendor == 'postgresql', "并行对账测试需要 PostgreSQL")
+class ReconcileParallelTests(ReconcileMixin, TransactionTestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self._create_stocks()
+
+    def test_parallel_workers(self) -> None:
+        Stock.objects.filter(material_code="M001").update(current_stock=0)
+        drifts = self._drifts(chunk_size=1, workers=2)
+        self.assertEqual([(d["material_code"], d["expected_stock"]) for d in drifts], [("M001", 10)])
+
+
+class MovementHistoryTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        Stock.objects.create(material_code="M001", material_name="螺栓")
+        Stock.objects.create(material_code="M002", material_name="垫片")
+        post_stock_in({
+            "material_code": "M002", "in_quantity": 1, "in_value": Decimal(1), "in_type": "purchase",
+            "in_time": self._at(2024, 1, 3), "operator": "", "remark": "", "supplier": "",
+        })
+        self.in1 = self._in(10, self._at(2024, 1, 1))
+        self.out1 = self._out(2, self._at(2024, 1, 2))
+        # 同一时刻的入库、出库各两条
+        self.in2, self.in3 = self._in(5, self._at(2024, 1, 3)), self._in(5, self._at(2024, 1, 3))
+        self.out2, self.out3 = self._out(1, self._at(2024, 1, 3)), self._out(1, self._at(2024, 1, 3))
+        StockOut.objects.filter(pk=self.out3.pk).update(operator="张三")
+        self.in4 = self._in(3, self._at(2024, 1, 4))
+
+    def _pages(self, limit, **params):
+        keys, cursor = [], None
+        while True:
+            query = {"material_code": "M001", "limit": limit, **params, **({"cursor": cursor} if cursor else {})}
+            data = self.client.get("/api/movements/history/", query).json()["data"]
+            keys += [(item["direction"], item["id"]) for item in data["list"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                return keys
+
+    def test_merged_pages_in_time_order(self) -> None:
+        expected = [
+            ("in", self.in4.pk), ("out", self.out3.pk), ("out", self.out2.pk), ("in", self.in3.pk),
+            ("in", self.in2.pk), ("out", self.out1.pk), ("in", self.in1.pk),
+        ]
+        self.assertEqual(self._pages(50), expected)
+        for limit in (1, 2, 3):
+            self.assertEqual(self._pages(limit), expected)
+        item = self.client.get("/api/movements/history/", {"material_code": "M001", "limit": 1}).json()["data"]["list"][0]
+        self.assertEqual((item["type_display"], item["quantity"], item["value"]), ("采购入库", 3, "3.00"))
+
+    def test_filters_apply_to_both_sides(self) -> None:
+        self.assertEqual(self._pages(2, direction="out"), [("out", self.out3.pk), ("out", self.out2.pk), ("out", self.out1.pk)])
+        self.assertEqual(self._pages(2, type="sales", operator="张三"), [("out", self.out3.pk)])
+        self.assertEqual(
+            self._pages(2, start_time="2024-01-02T00:00:00", end_time="2024-01-02T23:59:59"), [("out", self.out1.pk)],
+        )
+        response = self.client.get("/api/movements/history/", {"material_code": "M001", "cursor": "bad"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get("/api/movements/history/", {"material_code": "X"}).status_code, 404)
+
+
+class StockDetailExpansionTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓", min_stock=5)
+        now = timezone.now()
+        self._in(10, now - timedelta(days=40))
+        self._in(6, now - timedelta(days=2))
+        self.out = self._out(4, now - timedelta(days=2))
+        self.latest = self._in(1, now)
+        for status in ("pending", "handled"):
+            StockWarning.objects.create(
+                stock=self.stock, material_code="M001", material_name="螺栓", warning_type="low",
+                current_stock=3, min_stock=5, status=status,
+            )
+
+    def _detail(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/stock/{self.stock.pk}/", params)
+        return response, len(queries)
+
+    def test_expansions(self) -> None:
+        response, _ = self._detail(expand="movements,trend,warnings", movements_limit=2)
+        data = response.json()["data"]
+        self.assertEqual([(m["direction"], m["id"]) for m in data["recent_movements"]],
+                         [("in", self.latest.pk), ("out", self.out.pk)])
+        self.assertEqual(len(data["trend"]), 30)
+        self.assertEqual(data["trend"][-1], {"date": timezone.localdate().isoformat(), "net_quantity": 1})
+        self.assertEqual(sum(point["net_quantity"] for point in data["trend"]), 3)
+        self.assertEqual([w["warning_type"] for w in data["warnings"]], ["low"])
+
+        data = self._detail(expand="trend", trend_days=90)[0].json()["data"]
+        self.assertEqual((len(data["trend"]), sum(point["net_quantity"] for point in data["trend"])), (90, 13))
+        self.assertNotIn("recent_movements", data)
+        self.assertEqual(self._detail(expand="history")[0].status_code, 400)
+        self.assertEqual(self._detail(expand="trend", trend_days=7)[0].status_code, 400)
+
+    def test_fixed_query_count(self) -> None:
+        _, plain = self._detail()
+        _, expanded = self._detail(expand="movements,trend,warnings")
+        for day in range(20):
+            self._in(1, timezone.now() - timedelta(days=day))
+        _, more_history = self._detail(expand="movements,trend,warnings")
+        self.assertEqual((expanded - plain, more_history), (3, expanded))
+
+
+@skipUnless(connection.vendor == 'postgresql', "触发器维护余额需要 PostgreSQL")
+class BalanceTriggerTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓", max_stock=30)
+        set_balance_triggers(connection, True)
+        self.addCleanup(set_balance_triggers, connection, False)
+
+    def put_json(self, url, data):
+        return self.client.put(url, data=json.dumps(data), content_type="application/json")
+
+    def _in(self, quantity):
+        return self.post_json("/api/stock-in/create/", {"material_code": "M001", "in_quantity": quantity, "in_value": quantity})
+
+    def _out(self, quantity):
+        return self.post_json("/api/stock-out/create/", {
+            "material_code": "M001", "out_quantity": quantity, "out_value": quantity, "out_type": "sales",
+        })
+
+    def _balance(self):
+        self.stock.refresh_from_db()
+        return self.stock.current_stock, self.stock.stock_value
+
+    def test_views_only_insert_movements(self) -> None:
+        self.assertEqual(self._in(20).json()["data"]["current_stock"], 20)
+        self.assertEqual(self._out(5).json()["data"]["current_stock"], 15)
+        record_id = StockIn.objects.get().pk
+        self.assertEqual(self.put_json(f"/api/stock-in/{record_id}/update/", {"in_quantity": 12, "in_value": 12}).status_code, 200)
+        self.assertEqual(self._balance(), (7, Decimal("7")))
+        self.assertEqual(self.client.delete(f"/api/stock-out/{StockOut.objects.get().pk}/delete/").status_code, 200)
+        self.assertEqual(self._balance(), (12, Decimal("12")))
+
+        entries = list(StockLedger.objects.filter(stock=self.stock).order_by("sequence").values_list(
+            "sequence", "entry_type", "quantity", "balance_quantity"))
+        self.assertEqual(entries, [
+            (1, "in", 20, 20), (2, "out", -5, 15), (3, "reversal", -20, -5), (4, "in", 12, 7), (5, "reversal", 5, 12),
+        ])
+        self.assertEqual((self.stock.ledger_seq, self.stock.version), (5, 4))
+        self.assertEqual([drift for _, drifts in reconcile_balances() for drift in drifts], [])
+
+    def test_trigger_maintains_stock_status(self) -> None:
+        self._in(30)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.stock_status, "high")
+        self._out(10)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.stock_status, "normal")
+
+    def test_trigger_rejects_invalid_balance(self) -> None:
+        self._in(10)
+        response = self._out(11)
+        self.assertEqual((response.status_code, response.json()["message"]), (400, "库存不足，当前库存量为10"))
+        self.assertEqual(self._in(25).json()["message"], "入库后将超过最大库存量(30)")
+        self._out(8)
+        record_id = StockIn.objects.get().pk
+        self.assertEqual(self.put_json(f"/api/stock-in/{record_id}/update/", {"in_quantity": 5}).status_code, 400)
+        self.assertEqual(self.client.delete(f"/api/stock-in/{record_id}/delete/").status_code, 400)
+        self.assertEqual(self._balance(), (2, Decimal("2")))
+        self.assertEqual(StockLedger.objects.filter(stock=self.stock).count(), 2)
+
+    def test_batch_posting_in_line_order(self) -> None:
+        self._in(30)
+        # 先出后入：按明细顺序插入时不超过最大库存量
+        results = post_movements([
+            ("out", {"material_code": "M001", "out_quantity": 10, "out_value": Decimal(10), "out_type": "sales",
+                     "out_time": timezone.now(), "operator": "", "remark": ""}),
+            ("in", {"material_code": "M001", "in_quantity": 10, "in_value": Decimal(10), "in_type": "purchase",
+                    "in_time": timezone.now(), "operator": "", "remark": "", "supplier": ""}),
+        ])
+        self.assertEqual([result["stock"].current_stock for result in results], [20, 30])
+        self.assertEqual(self._balance(), (30, Decimal("30")))
+        self.assertEqual(self.stock.ledger_seq, 3)
+
+    def test_direct_insert_updates_balance(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO stock_in (bill_no, stock_id, material_code, material_name, supplier, in_time,"
+                " in_quantity, in_value, in_type, operator, remark, version, created_at)"
+                " VALUES ('EXT-1', %s, 'M001', '螺栓', '', now(), 7, 7, 'purchase', '', '', 0, now())",
+                [self.stock.pk],
+            )
+        self.assertEqual(self._balance(), (7, Decimal("7")))
+
+        # 未开启触发器的连接写入记录时余额不变
+        set_balance_triggers(connection, False)
+        self._in(3)
+        StockIn.objects.filter(bill_no="EXT-1").delete()
+        self.assertEqual(self._balance(), (10, Decimal("10")))
+
+    def test_delete_stock_with_movements(self) -> None:
+        self._in(10)
+        self._out(10)
+        self.stock.delete()
+        self.assertFalse(StockIn.objects.exists())
+        self.assertFalse(StockLedger.objects.exists())
+
+
+class StockStatusTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        self.stock = Stock.objects.create(material_code="M001", material_name="螺栓", min_stock=5, max_stock=20)
+
+    def _status(self):
+        self.stock.refresh_from_db()
+        return self.stock.stock_status
+
+    def test_single_threshold_rule(self) -> None:
+        cases = [((5, 5, 20), "low"), ((6, 5, 20), "normal"), ((20, 5, 20), "high"),
+                 ((0, 0, 0), "normal"), ((100, 5, 0), "normal")]
+        for (quantity, min_stock, max_stock), expected in cases:
+            self.assertEqual(classify_stock_status(quantity, min_stock, max_stock), expected)
+        self.assertEqual(self._status(), "low")
+        Stock.objects.create(material_code="M002", material_name="垫片", current_stock=100)
+        self.assertEqual(Stock.objects.get(material_code="M002").stock_status, "normal")
+
+    def test_postings_maintain_status(self) -> None:
+        self._in(10, timezone.now())
+        self.assertEqual(self._status(), "normal")
+        response = self.post_json("/api/stock-in/batch-create/", {
+            "items": [{"material_code": "M001", "in_quantity": 10, "in_value": 10}],
+        })
+        self.assertEqual((response.status_code, self._status()), (200, "high"))
+        out = self._out(15, timezone.now())
+        self.assertEqual(self._status(), "low")
+        self.client.delete(f"/api/stock-out/{out.pk}/delete/")
+        self.assertEqual(self._status(), "high")
+
+        # 修改上下限后保存时重算
+        self.stock.max_stock = 50
+        self.stock.save(update_fields=["max_stock"])
+        self.assertEqual(self._status(), "normal")
+
+    def test_sharded_fast_path_refreshes_after_commit(self) -> None:
+        self._in(8, timezone.now())
+        set_shard_count("M001", 4)
+        self.assertEqual(self._status(), "normal")
+        # 状态不变时快路径不触碰库存行
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self._out(1, timezone.now())
+        self.assertEqual(len(callbacks), 0)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self._out(2, timezone.now())
+        self.assertEqual((len(callbacks), self._status()), (1, "low"))
+        self.assertEqual(sum(self.stock.shards.values_list("quantity", flat=True)), 5)
+
+    def test_list_filters_counts_and_orders_in_sql(self) -> None:
+        for n in range(7):
+            Stock.objects.create(material_code=f"L{n}", material_name="低", min_stock=10, current_stock=n)
+        for n in range(3):
+            Stock.objects.create(material_code=f"H{n}", material_name="高", max_stock=5, current_stock=5 + n)
+
+        data = self.client.get("/api/stock/", {"stock_status": "low", "page_size": 5}).json()["data"]
+        self.assertEqual((data["total"], len(data["list"])), (8, 5))
+        self.assertEqual({item["stock_status"] for item in data["list"]}, {"low"})
+        data = self.client.get("/api/stock/", {"stock_status": "low", "page_size": 5, "page": 2}).json()["data"]
+        self.assertEqual(len(data["list"]), 3)
+
+        data = self.client.get("/api/stock/", {"ordering": "stock_status", "page_size": 20}).json()["data"]
+        self.assertEqual([item["stock_status"] for item in data["list"]], ["high"] * 3 + ["low"] * 8)
+        self.assertEqual(self.client.get("/api/stock/", {"stock_status": "empty"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/stock/", {"ordering": "supplier"}).status_code, 400)
+
+        overview = self.client.get("/api/statistics/overview/").json()["data"]["stock"]
+        self.assertEqual(overview["status_distribution"], {"low": 8, "normal": 0, "high": 3})
+
+
+class KeysetPaginationTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        Stock.objects.create(material_code="M001", material_name="螺栓")
+        moment = timezone.now()
+        # 同一业务时间的多条记录按 id 区分先后
+        for n in range(25):
+            self._in(1, moment - timedelta(minutes=n // 3))
+
+    def _walk(self, url, **params):
+        ids, cursor = [], ""
+        while cursor is not None:
+            data = self.client.get(url, {**params, "cursor": cursor, "page_size": 10}).json()["data"]
+            self.assertIsNone(data["total"])
+            ids += [item["id"] for item in data["list"]]
+            cursor = data["next_cursor"]
+        return ids
+
+    def test_cursor_walk_matches_page_order(self) -> None:
+        paged = [item["id"] for item in self.client.get("/api/stock-in/", {"page_size": 100}).json()["data"]["list"]]
+        self.assertEqual(len(paged), 25)
+        self.assertEqual(self._walk("/api/stock-in/"), paged)
+        self.assertEqual(self._walk("/api/stock-in/", operator="nobody"), [])
+
+    def test_stock_list_cursor_follows_ordering(self) -> None:
+        for n in range(12):
+            Stock.objects.create(material_code=f"S{n:02d}", material_name="物料", min_stock=5, current_stock=n)
+        for ordering in ("-created_at", "stock_status", "-current_stock", "material_code"):
+            paged = self.client.get("/api/stock/", {"page_size": 100, "ordering": ordering}).json()["data"]["list"]
+            self.assertEqual(self._walk("/api/stock/", ordering=ordering), [item["id"] for item in paged])
+
+    def test_invalid_cursor(self) -> None:
+        Stock.objects.create(material_code="M002", material_name="螺母")
+        data = self.client.get("/api/stock/", {"cursor": "", "page_size": 1, "ordering": "material_code"}).json()["data"]
+        response = self.client.get("/api/stock/", {"cursor": data["next_cursor"], "ordering": "-current_stock"})
+        self.assertEqual((response.status_code, response.json()["message"]), (400, "游标格式错误"))
+        self.assertEqual(self.client.get("/api/stock-out/", {"cursor": "bm90LWpzb24="}).status_code, 400)
+        self.assertEqual(self.client.get("/api/stock-in/", {"cursor": "", "include_archived": "true"}).status_code, 400)
+        for url in ("/api/warnings/", "/api/stock-count/tasks/"):
+            data = self.client.get(url, {"cursor": ""}).json()["data"]
+            self.assertEqual((data["list"], data["next_cursor"]), ([], None))
+
+
+class ListCountTests(DatedMovementMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        cache.clear()
+        Stock.objects.create(material_code="M001", material_name="螺栓")
+        for _ in range(3):
+            self._in(1, timezone.now())
+
+    def _page(self, url="/api/stock-in/", **params):
+        return self.client.get(url, params).json()["data"]
+
+    def test_count_modes(self) -> None:
+        self.assertEqual((self._page()["total"], self._page()["total_exact"]), (3, True))
+        self.assertEqual((self._page(count="none")["total"], self._page(count="none")["total_exact"]), (None, False))
+        data = self._page(cursor="", count="exact", page_size=2)
+        self.assertEqual((data["total"], data["total_exact"], len(data["list"])), (3, True, 2))
+        self.assertEqual(self.client.get("/api/stock-in/", {"count": "all"}).status_code, 400)
+        # 非精确计数时页码超出范围返回空列表
+        self.assertEqual(self._page(count="none", page=9)["list"], [])
+
+    def test_filtered_estimate_uses_cached_count(self) -> None:
+        self.assertEqual(self._page(count="estimate", in_type="purchase")["total_exact"], True)
+        self._in(1, timezone.now())
+        data = self._page(count="estimate", in_type="purchase")
+        self.assertEqual((data["total"], data["total_exact"], len(data["list"])), (3, False, 4))
+        self.assertEqual(self._page(count="exact", in_type="purchase")["total"], 4)
+
+    @override_settings(LIST_COUNT_ESTIMATE_MIN_ROWS=0)
+    def test_unfiltered_estimate_uses_planner_statistics(self) -> None:
+        if connection.vendor != 'postgresql':
+            # 没有规划器统计信息时精确计数
+            self.assertEqual((self._page(count="estimate")["total"], self._page(count="estimate")["total_exact"]), (3, True))
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE stock_in")
+        data = self._page(count="estimate")
+        self.assertEqual((data["total"], data["total_exact"]), (3, False))
+        self.assertEqual(self._page("/api/warnings/", count="estimate")["total_exact"], True)
+
+
+class MaterialSearchTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        for code, name in (("BOLT-M8", "不锈钢螺栓M8"), ("NUT-M8", "不锈钢螺母M8"), ("BOLT-M12", "碳钢螺栓M12")):
+            Stock.objects.create(material_code=code, material_name=name)
+
+    def _codes(self, **params):
+        data = self.client.get("/api/stock/", {"page_size": 100, **params}).json()["data"]
+        return {item["material_code"] for item in data["list"]}
+
+    def test_search_matches_code_or_name_case_insensitively(self) -> None:
+        self.assertEqual(self._codes(search="bolt"), {"BOLT-M8", "BOLT-M12"})
+        self.assertEqual(self._codes(search="不锈钢"), {"BOLT-M8", "NUT-M8"})
+        self.assertEqual(self._codes(search="m8"), {"BOLT-M8", "NUT-M8"})
+        self.assertEqual(self._codes(search="铜"), set())
+        # 游标分页同样按关键字过滤
+        self.assertEqual(self._codes(search="螺栓", cursor=""), {"BOLT-M8", "BOLT-M12"})
+
+    def test_ranking_only_with_trigram_extension(self) -> None:
+        queryset, relevance = fuzzy_search(Stock.objects.all(), ("material_code", "material_name"), "螺栓")
+        if not trigram_search_enabled():
+            self.assertEqual(relevance, ())
+            self.assertEqual(queryset.count(), 2)
+            return
+        self.assertEqual(relevance, ("-search_rank",))
+        # 与关键字更相似的 BOLT-M8 排在后创建的 BOLT-M12 之前
+        data = self.client.get("/api/stock/", {"search": "bolt-m"}).json()["data"]
+        self.assertEqual([item["material_code"] for item in data["list"]], ["BOLT-M8", "BOLT-M12"])
+
+    @skipUnless(connection.vendor == 'postgresql', "三元组索引需要 PostgreSQL")
+    def test_trigram_indexes_follow_extension(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes WHERE indexname LIKE %s", ["%\\_trgm"])
+            indexes = {row[0] for row in cursor.fetchall()}
+        expected = {trigram_index_name(table, column) for table, columns in TRIGRAM_INDEXES.items() for column in columns}
+        self.assertEqual(indexes, expected if trigram_search_enabled() else set())
+
+
+class MaterialAutocompleteTests(StockApiTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.login_admin()
+        # 每个用例使用新的进程内索引
+        autocomplete._index = None
+        self.addCleanup(setattr, autocomplete, "_index", None)
+        for code, name in (("BOLT-M8", "不锈钢螺栓M8"), ("NUT-M8", "不锈钢螺母M8"), ("VALVE-01", "铝合金球阀")):
+            Stock.objects.create(material_code=code, material_name=name)
+        Stock.objects.create(material_code="BOLT-OLD", material_name="停用螺栓", status="inactive")
+
+    def _codes(self, q, **params):
+        response = self.client.get("/api/stock/autocomplete/", {"q": q, **params})
+        return [item["material_code"] for item in response.json()["data"]["list"]]
+
+    def test_pinyin_initials(self) -> None:
+        self.assertEqual(autocomplete.pinyin_initials("不锈钢螺栓M8"), "bxglsm8")
+        self.assertEqual(autocomplete.pinyin_initials("铝合金 球阀-01"), "lhjqf01")
+
+    def test_matches_prefix_initials_and_infix(self) -> None:
+        self.assertEqual(self._codes("bolt"), ["BOLT-M8"])
+        self.assertEqual(self._codes("不锈钢"), ["BOLT-M8", "NUT-M8"])
+        self.assertEqual(self._codes("BXGLS"), ["BOLT-M8"])
+        self.assertEqual(self._codes("球阀"), ["VALVE-01"])
+        self.assertCountEqual(self._codes("-m8"), ["BOLT-M8", "NUT-M8"])
+        self.assertEqual(self._codes("", limit=2), ["BOLT-M8", "NUT-M8"])
+        self.assertEqual(self._codes("钛"), [])
+        self.assertEqual(self.client.get("/api/stock/autocomplete/", {"limit": "x"}).status_code, 400)
+
+    def test_index_follows_committed_changes(self) -> None:
+        self.assertEqual(self._codes("gear"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post("/api/stock/init/", {"material_code": "GEAR-01", "material_name": "齿轮"},
+                                        content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._codes("gear"), ["GEAR-01"])
+
+        stock = Stock.objects.get(material_code="BOLT-M8")
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.material_name = "碳钢螺栓M8"
+            stock.save()
+        self.assertEqual((self._codes("不锈钢"), self._codes("tgls")), (["NUT-M8"], ["BOLT-M8"]))
+        # 只改余额等字段时不触发索引更新
+        with self.captureOnCommitCallbacks() as callbacks:
+            stock.save(update_fields=["min_stock"])
+        self.assertEqual(callbacks, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.filter(material_code="NUT-M8").get().delete()
+        self.assertEqual(self._codes("不锈钢"), [])
+
+    @override_settings(MATERIAL_AUTOCOMPLETE_MAX_ENTRIES=1)
+    def test_bounded_index_falls_back_to_database(self) -> None:
+        self.assertEqual(self._codes("bolt"), ["BOLT-M8"])
+        index = autocomplete.get_material_index()
+        self.assertEqual((len(index), index.complete), (1, False))
+        self.assertEqual(len(self._codes("")), 3)
@@ -0,0 +1,79 @@
+"""
+触发器维护余额（PostgreSQL）
+
+迁移 0016 在 stock_in / stock_out 上安装行级触发器：出入库记录插入、删除，或数量、价值、物料被修改时，
+由触发器锁定库存行、按条件更新余额（库存不足、超过最大库存量时以 check_violation 报错）、
+递增 version / ledger_seq / updated_at 并追加流水账分录，与 posting.change_balance 的规则一致。
+
+触发器只在会话参数 kucun.balance_triggers 为 on 的连接上生效。STOCK_BALANCE_TRIGGERS 开启时，
+每个新建的数据库连接都会设置该参数，过账路径随之改为只写出入库记录（见 posting.py 与出入库视图）；
+未开启或非 PostgreSQL 数据库仍由 Python 更新余额。
+其他直接写出入库表的程序，只要在会话中设置该参数，余额也会随之更新。
+
+归档、建分区时迁移记录，以及删除物料级联删除记录时不应改变余额，
+这些操作通过 balance_triggers_suspended 在当前事务内暂停触发器。
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection, transaction
+
+# 控制触发器是否生效的会话参数
+TRIGGER_SETTING = 'kucun.balance_triggers'
+
+# 余额校验不通过时触发器报出的 SQLSTATE
+CHECK_VIOLATION = '23514'
+
+
+def balance_triggers_enabled():
+    """当前连接上的出入库余额是否由触发器维护"""
+    return getattr(connection, 'balance_triggers', False)
+
+
+def set_balance_triggers(conn, enabled):
+    """为连接 conn 开启或关闭触发器维护余额（会话级），非 PostgreSQL 数据库不做处理"""
+    if conn.vendor != 'postgresql':
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"SET {TRIGGER_SETTING} = {'on' if enabled else 'off'}")
+    conn.balance_triggers = enabled
+
+
+def is_balance_check_violation(error):
+    """IntegrityError 是否为触发器的余额校验失败（check_violation），而非单据号重复等其他约束"""
+    return getattr(error.__cause__, 'pgcode', None) == CHECK_VIOLATION
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created 信号处理：按 STOCK_BALANCE_TRIGGERS 设置新连接"""
+    if getattr(settings, 'STOCK_BALANCE_TRIGGERS', False):
+        set_balance_triggers(connection, True)
+
+
+def _set_local(enabled):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SET LOCAL {TRIGGER_SETTING} = {'on' if enabled else 'off'}")
+
+
+@contextmanager
+def balance_triggers_suspended():
+    """在一个事务（嵌套时为保存点）中暂停触发器，退出后恢复连接原有的设置"""
+    with transaction.atomic():
+        if not balance_triggers_enabled():
+            yield
+            return
+        # 出错时事务或保存点回滚，SET LOCAL 随之撤销，无需恢复
+        _set_local(False)
+        yield
+        _set_local(True)
+
+
+def suspend_for_stock_delete(sender, **kwargs):
+    """删除物料前暂停触发器：级联删除的出入库记录不应再冲销即将删除的余额"""
+    if balance_triggers_enabled():
+        _set_local(False)
+
+
+def resume_after_stock_delete(sender, **kwargs):
+    if balance_triggers_enabled():
+        _set_local(True)
@@ -4,16 +4,23 @@ from .views import (
     stock_init_view,
     stock_list_view,
     stock_detail_view,
+    stock_ledger_view,
+    stock_balance_as_of_view,
+    stock_autocomplete_view,
     stock_in_create_view,
+    stock_in_batch_create_view,
     stock_in_list_view,
     stock_in_detail_view,
     stock_in_update_view,
     stock_in_delete_view,
     stock_out_create_view,
+    stock_out_batch_create_view,
     stock_out_list_view,
     stock_out_detail_view,
     stock_out_update_view,
     stock_out_delete_view,
+    movement_stream_view,
+    movement_history_view,
     warning_list_view,
     warning_statistics_view,
     warning_check_view,
@@ -29,6 +36,9 @@ from .views import (
     statistics_category_view,
     monthly_report_list_view,
     monthly_report_detail_view,
+    monthly_close_view,
+    monthly_reopen_view,
+    monthly_period_list_view,
 )
 
 urlpatterns = [
@@ -36,18 +46,26 @@ urlpatterns = [
     path("stock/init/", stock_init_view, name="stock_init"),
     path("stock/", stock_list_view, name="stock_list"),
     path("stock/<int:pk>/", stock_detail_view, name="stock_detail"),
+    path("stock/<int:pk>/ledger/", stock_ledger_view, name="stock_ledger"),
+    path("stock/as-of/", stock_balance_as_of_view, name="stock_balance_as_of"),
+    path("stock/autocomplete/", stock_autocomplete_view, name="stock_autocomplete"),
     # 入库接口
     path("stock-in/", stock_in_list_view, name="stock_in_list"),
     path("stock-in/create/", stock_in_create_view, name="stock_in_create"),
+    path("stock-in/batch-create/", stock_in_batch_create_view, name="stock_in_batch_create"),
     path("stock-in/<int:pk>/", stock_in_detail_view, name="stock_in_detail"),
     path("stock-in/<int:pk>/update/", stock_in_update_view, name="stock_in_update"),
     path("stock-in/<int:pk>/delete/", stock_in_delete_view, name="stock_in_delete"),
     # 出库接口
     path("stock-out/", stock_out_list_view, name="stock_out_list"),
     path("stock-out/create/", stock_out_create_view, name="stock_out_create"),
+    path("stock-out/batch-create/", stock_out_batch_create_view, name="stock_out_batch_create"),
     path("stock-out/<int:pk>/", stock_out_detail_view, name="stock_out_detail"),
     path("stock-out/<int:pk>/update/", stock_out_update_view, name="stock_out_update"),
     path("stock-out/<int:pk>/delete/", stock_out_delete_view, name="stock_out_delete"),
+    # 出入库流水接口
+    path("movements/stream/", movement_stream_view, name="movement_stream"),
+    path("movements/history/", movement_history_view, name="movement_history"),
     # 预警接口
     path("warnings/", warning_list_view, name="warning_list"),
     path("warnings/statistics/", warning_statistics_view, name="warning_statistics"),
@@ -67,4 +85,7 @@ urlpatterns = [
     # 月底结存接口
     path("monthly-report/", monthly_report_list_view, name="monthly_report_list"),
     path("monthly-report/detail/", monthly_report_detail_view, name="monthly_report_detail"),
+    path("monthly-report/close/", monthly_close_view, name="monthly_close"),
+    path("monthly-report/reopen/", monthly_reopen_view, name="monthly_reopen"),
+    path("monthly-report/periods/", monthly_period_list_view, name="monthly_period_list"),
 ]
@@ -2,11 +2,16 @@
 库存模块公共工具函数和常量
 """
 import json
+from datetime import datetime, timedelta
 from decimal import Decimal
 
+from django.db import connection, transaction
+from django.db.models import BigIntegerField, Case, CharField, DecimalField, F, IntegerField, Value, When
 from django.http import JsonResponse
 from django.utils import timezone
 
+from .models import BillSequence, Stock, classify_stock_status
+
 
 # ==================== 响应工具函数 ====================
 
@@ -28,41 +33,179 @@ def parse_json_body(request):
         return None
 
 
+def parse_datetime_or_now(value):
+    """解析 ISO 格式时间字符串为带时区的时间（未带时区的按当前时区），为空或格式错误时返回当前时间"""
+    return (parse_aware_datetime(value) if value else None) or timezone.now()
+
+
+def day_range(day):
+    """day 当天在当前时区下的起止时间 [start, end)，用于按时间列范围过滤（可利用索引与分区裁剪）"""
+    start = timezone.make_aware(datetime.combine(day, datetime.min.time()))
+    return start, timezone.make_aware(datetime.combine(day + timedelta(days=1), datetime.min.time()))
+
+
+def parse_aware_datetime(value):
+    """解析 ISO 格式时间字符串为带时区的时间（未带时区的按当前时区），格式错误返回 None"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (ValueError, AttributeError):
+        return None
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
 # ==================== 单据号生成 ====================
 
-def generate_bill_no(prefix, model_class):
-    """生成单据号 (格式: 前缀-YYYYMMDD-####)"""
-    today = timezone.now().strftime('%Y%m%d')
-    prefix_str = f"{prefix}-{today}-"
-    last_bill = model_class.objects.filter(bill_no__startswith=prefix_str).order_by('-bill_no').first()
-    if last_bill:
-        try:
-            new_num = int(last_bill.bill_no.split('-')[-1]) + 1
-        except (ValueError, IndexError):
-            new_num = 1
+def supports_update_returning():
+    """当前数据库是否支持 INSERT ... ON CONFLICT / UPDATE ... RETURNING 语法"""
+    return connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert
+
+
+def allocate_bill_seq(prefix, biz_date, count=1):
+    """
+    为 前缀 + 业务日期 原子地预留 count 个连续序号，返回其中第一个序号
+
+    计数器保存在 bill_sequence 表中，每个前缀每天一行：
+    - PostgreSQL / SQLite(3.35+) 使用 INSERT ... ON CONFLICT DO UPDATE ... RETURNING，一次往返完成分配
+    - 其他数据库在事务内锁定计数器行后自增
+    序号一经分配即不回收，事务回滚时允许出现空号。
+    """
+    if count < 1:
+        raise ValueError("count 必须大于0")
+
+    if supports_update_returning():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO bill_sequence (prefix, biz_date, last_no, updated_at) "
+                "VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (prefix, biz_date) DO UPDATE "
+                "SET last_no = bill_sequence.last_no + excluded.last_no, updated_at = excluded.updated_at "
+                "RETURNING last_no",
+                [prefix, biz_date, count, timezone.now()],
+            )
+            last_no = cursor.fetchone()[0]
     else:
-        new_num = 1
-    return f"{prefix_str}{new_num:04d}"
+        with transaction.atomic():
+            BillSequence.objects.get_or_create(prefix=prefix, biz_date=biz_date)
+            BillSequence.objects.filter(prefix=prefix, biz_date=biz_date).update(last_no=F('last_no') + count)
+            last_no = BillSequence.objects.get(prefix=prefix, biz_date=biz_date).last_no
+
+    return last_no - count + 1
 
 
-def generate_task_no(model_class):
+def generate_bill_nos(prefix, count):
+    """批量生成 count 个单据号 (格式: 前缀-YYYYMMDD-####)，只占用一次计数器往返"""
+    if count <= 0:
+        return []
+    today = timezone.now().date()
+    first = allocate_bill_seq(prefix, today, count)
+    prefix_str = f"{prefix}-{today.strftime('%Y%m%d')}-"
+    return [f"{prefix_str}{n:04d}" for n in range(first, first + count)]
+
+
+def generate_bill_no(prefix):
+    """生成单据号 (格式: 前缀-YYYYMMDD-####)"""
+    return generate_bill_nos(prefix, 1)[0]
+
+
+def generate_task_no():
     """生成盘点任务号 (格式: SC-YYYYMMDD-####)"""
-    today = timezone.now().strftime('%Y%m%d')
-    prefix_str = f"SC-{today}-"
-    last_task = model_class.objects.filter(task_no__startswith=prefix_str).order_by('-task_no').first()
-    new_num = int(last_task.task_no.split('-')[-1]) + 1 if last_task else 1
-    return f"{prefix_str}{new_num:04d}"
+    return generate_bill_no("SC")
+
+
+# ==================== 库存余额批量更新 ====================
+
+# 批量出入库单次允许提交的最大行数
+BATCH_MAX_LINES = 1000
+
+
+def apply_stock_deltas(deltas, ledger_seqs=None):
+    """
+    按物料汇总后一次性更新库存余额
+
+    deltas: {stock_id: (数量变化, 价值变化)}，入库为正、出库为负。
+    ledger_seqs: {stock_id: 新的流水账顺序号}，调用方已锁定库存行并写入了对应分录。
+    所有物料的变更通过一条 UPDATE ... CASE 语句完成，库存状态按更新后的余额在同一语句中重算
+    （分片物料须已折叠，见 sharding.fold_stock_shards）。
+    """
+    ledger_seqs = ledger_seqs or {}
+    if not deltas and not ledger_seqs:
+        return 0
+    qty_whens = [When(pk=pk, then=Value(qty)) for pk, (qty, _) in deltas.items()]
+    value_whens = [When(pk=pk, then=Value(value)) for pk, (_, value) in deltas.items()]
+    seq_whens = [When(pk=pk, then=Value(seq)) for pk, seq in ledger_seqs.items()]
+    new_stock = F('current_stock') + Case(*qty_whens, default=Value(0), output_field=IntegerField())
+    return Stock.objects.filter(pk__in={*deltas, *ledger_seqs}).update(
+        current_stock=new_stock,
+        stock_status=stock_status_expression(new_stock),
+        stock_value=F('stock_value') + Case(
+            *value_whens, default=Value(Decimal('0')),
+            output_field=DecimalField(max_digits=12, decimal_places=2)
+        ),
+        ledger_seq=Case(*seq_whens, default=F('ledger_seq'), output_field=BigIntegerField()),
+        version=F('version') + 1,
+    )
+
+
+def parse_quantity(value):
+    """
+    解析出入库数量
+
+    接受整数及整数值的浮点数 / Decimal（如 JSON 的 5.0），统一转为 int；
+    布尔值（JSON true/false）、非整数值及其他类型返回 None。
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, Decimal) and value.is_finite() and value == value.to_integral_value():
+        return int(value)
+    return None
+
+
+# ==================== 乐观并发控制 ====================
+
+VERSION_CONFLICT_MESSAGE = "记录已被他人修改，请刷新后重试"
+
+
+def parse_expected_version(value, current_version):
+    """
+    解析客户端提交的版本号
+
+    未提交时以本次读取到的版本为准，仍能发现读取之后、写入之前的并发修改；
+    格式错误时返回 None。
+    """
+    if value is None or value == "":
+        return current_version
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
 
 # ==================== 库存状态计算 ====================
 
+# 与 models.classify_stock_status 相同的规则，{balance} 为更新后余额的 SQL 表达式
+STOCK_STATUS_SQL = (
+    "CASE WHEN min_stock > 0 AND {balance} <= min_stock THEN 'low' "
+    "WHEN max_stock > 0 AND {balance} >= max_stock THEN 'high' ELSE 'normal' END"
+)
+
+
 def get_stock_status(stock):
-    """计算库存状态"""
-    if stock.min_stock > 0 and stock.current_stock <= stock.min_stock:
-        return 'low'
-    elif stock.max_stock > 0 and stock.current_stock >= stock.max_stock:
-        return 'high'
-    return 'normal'
+    """按 stock 上的余额计算库存状态（调用方已把分片物料的余额换成精确余额）"""
+    return classify_stock_status(stock.current_stock, stock.min_stock, stock.max_stock)
+
+
+def stock_status_expression(balance=F('current_stock')):
+    """库存状态的 ORM 表达式，用于在 UPDATE 中随余额一起写入；balance 为更新后的余额表达式"""
+    return Case(
+        When(min_stock__gt=0, min_stock__gte=balance, then=Value('low')),
+        When(max_stock__gt=0, max_stock__lte=balance, then=Value('high')),
+        default=Value('normal'),
+        output_field=CharField(),
+    )
 
 
 # ==================== 显示映射常量 ====================
@@ -8,11 +8,15 @@ from .stock import (
     stock_init_view,
     stock_list_view,
     stock_detail_view,
+    stock_ledger_view,
+    stock_balance_as_of_view,
+    stock_autocomplete_view,
 )
 
 # 入库管理视图
 from .stock_in import (
     stock_in_create_view,
+    stock_in_batch_create_view,
     stock_in_list_view,
     stock_in_detail_view,
     stock_in_update_view,
@@ -22,12 +26,19 @@ from .stock_in import (
 # 出库管理视图
 from .stock_out import (
     stock_out_create_view,
+    stock_out_batch_create_view,
     stock_out_list_view,
     stock_out_detail_view,
     stock_out_update_view,
     stock_out_delete_view,
 )
 
+# 出入库流水视图
+from .movement import (
+    movement_stream_view,
+    movement_history_view,
+)
+
 # 预警管理视图
 from .warning import (
     warning_list_view,
@@ -57,4 +68,7 @@ from .statistics import (
 from .monthly_report import (
     monthly_report_list_view,
     monthly_report_detail_view,
+    monthly_close_view,
+    monthly_reopen_view,
+    monthly_period_list_view,
 )
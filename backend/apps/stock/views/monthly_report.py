@@ -1,16 +1,20 @@
 """
 月底结存视图
 """
-from datetime import datetime
+from functools import partial
 
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_GET
+from django.views.decorators.http import require_GET, require_POST
 from django.db.models import Sum, Count
 from django.db.models.functions import TruncMonth
 from django.utils import timezone
 
-from ..models import Stock, StockIn, StockOut
-from ..utils import json_response, json_error
+from ..closing import (
+    cached_period_report, close_month, compute_month_closing, get_closed_period, next_month, parse_month,
+    reopen_month,
+)
+from ..models import ClosedPeriod, MonthlyClosing, PeriodAuditLog, StockIn, StockOut
+from ..utils import day_range, json_response, json_error, parse_json_body
 from apps.accounts.permissions import require_permission
 
 
@@ -18,120 +22,186 @@ from apps.accounts.permissions import require_permission
 @require_GET
 @require_permission('monthly_report:view')
 def monthly_report_list_view(request):
-    """月报列表"""
+    """
+    月报列表
+
+    近一年各月的出入库汇总：已结账月份汇总月结快照（结果永久缓存），未结账月份按出入库记录实时统计。
+    """
     end_date = timezone.now().date()
     start_date = end_date.replace(day=1) - timezone.timedelta(days=365)
 
-    in_by_month = {
-        item['month'].strftime('%Y-%m'): item
-        for item in StockIn.objects.filter(
-            in_time__date__gte=start_date
-        ).annotate(month=TruncMonth('in_time')).values('month').annotate(
-            in_count=Count('id'),
-            in_qty=Sum('in_quantity'),
-            in_value=Sum('in_value')
-        )
-    }
+    by_month = {}
+    for period in ClosedPeriod.objects.filter(month__gte=start_date.replace(day=1), status='closed'):
+        summary = cached_period_report(period, 'monthly_summary', partial(_closed_month_summary, period.month))
+        by_month[period.month.strftime('%Y-%m')] = dict(summary, closed=True)
+
+    # 只实时统计最早的未结账月份之后的记录
+    live_from = start_date.replace(day=1)
+    while live_from.strftime('%Y-%m') in by_month:
+        live_from = next_month(live_from)
+    live_from = day_range(max(live_from, start_date))[0]
+
+    for item in StockIn.objects.filter(
+        in_time__gte=live_from
+    ).annotate(month=TruncMonth('in_time')).values('month').annotate(
+        in_count=Count('id'),
+        in_qty=Sum('in_quantity'),
+        in_value=Sum('in_value')
+    ):
+        by_month.setdefault(item['month'].strftime('%Y-%m'), dict(item, closed=False))
+
+    for item in StockOut.objects.filter(
+        out_time__gte=live_from
+    ).annotate(month=TruncMonth('out_time')).values('month').annotate(
+        out_count=Count('id'),
+        out_qty=Sum('out_quantity'),
+        out_value=Sum('out_value')
+    ):
+        data = by_month.setdefault(item['month'].strftime('%Y-%m'), {'closed': False})
+        if not data['closed']:
+            data.update(item)
 
-    out_by_month = {
-        item['month'].strftime('%Y-%m'): item
-        for item in StockOut.objects.filter(
-            out_time__date__gte=start_date
-        ).annotate(month=TruncMonth('out_time')).values('month').annotate(
-            out_count=Count('id'),
-            out_qty=Sum('out_quantity'),
-            out_value=Sum('out_value')
-        )
-    }
-
-    all_months = sorted(set(in_by_month.keys()) | set(out_by_month.keys()), reverse=True)
     result = []
-    for m in all_months:
-        in_data = in_by_month.get(m, {})
-        out_data = out_by_month.get(m, {})
+    for m in sorted(by_month, reverse=True):
+        data = by_month[m]
         result.append({
             'month': m,
-            'in_count': in_data.get('in_count', 0),
-            'in_qty': in_data.get('in_qty', 0),
-            'in_value': str(in_data.get('in_value') or 0),
-            'out_count': out_data.get('out_count', 0),
-            'out_qty': out_data.get('out_qty', 0),
-            'out_value': str(out_data.get('out_value') or 0),
+            'closed': data['closed'],
+            'in_count': data.get('in_count', 0),
+            'in_qty': data.get('in_qty', 0),
+            'in_value': str(data.get('in_value') or 0),
+            'out_count': data.get('out_count', 0),
+            'out_qty': data.get('out_qty', 0),
+            'out_value': str(data.get('out_value') or 0),
         })
 
     return json_response(data=result)
 
 
+def _closed_month_summary(month):
+    return MonthlyClosing.objects.filter(month=month).aggregate(
+        in_count=Sum('in_count'), in_qty=Sum('in_quantity'), in_value=Sum('in_value'),
+        out_count=Sum('out_count'), out_qty=Sum('out_quantity'), out_value=Sum('out_value'),
+    )
+
+
 @csrf_exempt
 @require_GET
 @require_permission('monthly_report:view')
 def monthly_report_detail_view(request):
-    """月报详情"""
+    """
+    月报详情
+
+    已结账月份读取月结快照（结果永久缓存），未结账月份（含当前月截至目前）实时计算；
+    current_stock / stock_value 为月末（当前月为目前）结存。
+    """
     month_str = request.GET.get("month", timezone.now().strftime('%Y-%m'))
     try:
-        year, month = map(int, month_str.split('-'))
-        start_date = datetime(year, month, 1).date()
-        next_month = start_date.replace(day=28) + timezone.timedelta(days=4)
-        end_date = next_month.replace(day=1)
+        month = parse_month(month_str)
     except (ValueError, TypeError):
         return json_error("月份格式错误，应为 YYYY-MM", 400)
 
-    in_details = {
-        item['material_code']: item
-        for item in StockIn.objects.filter(
-            in_time__date__gte=start_date, in_time__date__lt=end_date
-        ).values('material_code', 'material_name').annotate(
-            in_qty=Sum('in_quantity'), in_value=Sum('in_value')
-        )
-    }
+    period = get_closed_period(month)
+    return json_response(data=cached_period_report(period, 'monthly_detail', partial(_month_detail, month, period)))
 
-    out_details = {
-        item['material_code']: item
-        for item in StockOut.objects.filter(
-            out_time__date__gte=start_date, out_time__date__lt=end_date
-        ).values('material_code', 'material_name').annotate(
-            out_qty=Sum('out_quantity'), out_value=Sum('out_value')
-        )
-    }
 
-    all_codes = set(in_details.keys()) | set(out_details.keys())
+def _month_detail(month, period):
+    if period is not None:
+        closings = list(MonthlyClosing.objects.filter(month=month).order_by('material_code'))
+    else:
+        closings = compute_month_closing(month)
+
     details = []
     total_in_qty, total_in_value = 0, 0
     total_out_qty, total_out_value = 0, 0
-
-    for code in all_codes:
-        in_data = in_details.get(code, {})
-        out_data = out_details.get(code, {})
-        name = in_data.get('material_name') or out_data.get('material_name', '')
-        in_q = in_data.get('in_qty') or 0
-        in_v = in_data.get('in_value') or 0
-        out_q = out_data.get('out_qty') or 0
-        out_v = out_data.get('out_value') or 0
-
-        stock = Stock.objects.filter(material_code=code).first()
+    for closing in closings:
         details.append({
-            'material_code': code,
-            'material_name': name,
-            'in_qty': in_q,
-            'in_value': str(in_v),
-            'out_qty': out_q,
-            'out_value': str(out_v),
-            'current_stock': stock.current_stock if stock else 0,
-            'stock_value': str(stock.stock_value if stock else 0),
+            'material_code': closing.material_code,
+            'material_name': closing.material_name,
+            'opening_qty': closing.opening_quantity,
+            'opening_value': str(closing.opening_value),
+            'in_qty': closing.in_quantity,
+            'in_value': str(closing.in_value),
+            'out_qty': closing.out_quantity,
+            'out_value': str(closing.out_value),
+            'current_stock': closing.closing_quantity,
+            'stock_value': str(closing.closing_value),
         })
-        total_in_qty += in_q
-        total_in_value += in_v
-        total_out_qty += out_q
-        total_out_value += out_v
-
-    return json_response(data={
-        "month": month_str,
+        total_in_qty += closing.in_quantity
+        total_in_value += closing.in_value
+        total_out_qty += closing.out_quantity
+        total_out_value += closing.out_value
+
+    return {
+        "month": f"{month:%Y-%m}",
+        "closed": period is not None,
         "summary": {
-            "material_count": len(all_codes),
+            "material_count": len(details),
             "total_in_qty": total_in_qty,
             "total_in_value": str(total_in_value),
             "total_out_qty": total_out_qty,
             "total_out_value": str(total_out_value),
         },
         "details": details,
+    }
+
+
+@csrf_exempt
+@require_POST
+@require_permission('monthly_report:close')
+def monthly_close_view(request):
+    """结账：锁定指定月份并生成月结快照，此后该月及之前的出入库记录不能再新增、修改或撤销"""
+    payload = parse_json_body(request)
+    if payload is None:
+        return json_error("请求体需要是 JSON", 400)
+    try:
+        month = parse_month(str(payload.get("month") or ""))
+    except ValueError:
+        return json_error("月份格式错误，应为 YYYY-MM", 400)
+    try:
+        count = close_month(month, operator=request.user.username)
+    except ValueError as exc:
+        return json_error(str(exc), 400)
+    return json_response(data={"month": f"{month:%Y-%m}", "material_count": count}, message="结账成功")
+
+
+@csrf_exempt
+@require_POST
+@require_permission('monthly_report:close')
+def monthly_reopen_view(request):
+    """反结账：只能针对最近一个已结账月份，须填写原因，删除该月快照与报表缓存并记录操作日志"""
+    payload = parse_json_body(request)
+    if payload is None:
+        return json_error("请求体需要是 JSON", 400)
+    try:
+        month = parse_month(str(payload.get("month") or ""))
+    except ValueError:
+        return json_error("月份格式错误，应为 YYYY-MM", 400)
+    try:
+        reopen_month(month, request.user.username, (payload.get("reason") or "").strip())
+    except ValueError as exc:
+        return json_error(str(exc), 400)
+    return json_response(data={"month": f"{month:%Y-%m}"}, message="反结账成功")
+
+
+@csrf_exempt
+@require_GET
+@require_permission('monthly_report:view')
+def monthly_period_list_view(request):
+    """已结账期间及最近的结账/反结账操作记录"""
+    return json_response(data={
+        "closed": [{
+            "month": f"{period.month:%Y-%m}",
+            "closed_by": period.closed_by,
+            "closed_at": period.closed_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "status": period.status,
+        } for period in ClosedPeriod.objects.order_by('-month')],
+        "logs": [{
+            "month": f"{log.month:%Y-%m}",
+            "action": log.action,
+            "action_display": log.get_action_display(),
+            "operator": log.operator,
+            "reason": log.reason,
+            "created_at": log.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        } for log in PeriodAuditLog.objects.all()[:50]],
     })
@@ -0,0 +1,227 @@
+"""
+出入库流水视图：流式导入、物料出入库历史
+"""
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from ..history import HISTORY_MAX_LIMIT, movement_history
+from ..models import Stock, StockIn, StockOut
+from ..posting import MOVEMENT_IN, MOVEMENT_OUT, post_movements
+from ..utils import json_error, json_response, parse_aware_datetime
+from .stock_in import clean_stock_in_line
+from .stock_out import clean_stock_out_line
+from apps.accounts.permissions import has_permission, require_any_permission
+
+# 每批提交的行数，可通过 settings.MOVEMENT_STREAM_BATCH_SIZE 调整
+DEFAULT_STREAM_BATCH_SIZE = 500
+# 单行 JSON 的最大字节数，超出的行直接拒绝
+MAX_LINE_BYTES = 64 * 1024
+
+LINE_CLEANERS = {
+    MOVEMENT_IN: (clean_stock_in_line, 'stock_in:create'),
+    MOVEMENT_OUT: (clean_stock_out_line, 'stock_out:create'),
+}
+
+
+def _iter_request_lines(request):
+    """
+    逐行读取请求体，不把整个请求体载入内存
+
+    chunked 上传没有 Content-Length，此时只有 WSGI 服务器声明了 wsgi.input_terminated
+    才能安全地直接读取原始输入流。
+    """
+    if not request.META.get("CONTENT_LENGTH") and request.META.get("wsgi.input_terminated"):
+        stream = request.META["wsgi.input"]
+    else:
+        stream = request
+    while True:
+        raw = stream.readline(MAX_LINE_BYTES + 1)
+        if not raw:
+            return
+        if len(raw) > MAX_LINE_BYTES and not raw.endswith(b"\n"):
+            # 丢弃超长行的剩余部分
+            while raw and not raw.endswith(b"\n"):
+                raw = stream.readline(MAX_LINE_BYTES + 1)
+            yield None
+            continue
+        yield raw
+
+
+def _parse_line(raw, allowed):
+    """解析一行 NDJSON，返回 (kind, line, error)"""
+    if raw is None:
+        return None, None, f"单行长度超过 {MAX_LINE_BYTES} 字节"
+    try:
+        payload = json.loads(raw.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None, None, "不是合法的 JSON"
+    if not isinstance(payload, dict):
+        return None, None, "每行必须是 JSON 对象"
+
+    kind = payload.get("type")
+    if kind not in LINE_CLEANERS:
+        return None, None, "type 必须是 in 或 out"
+    if not allowed[kind]:
+        return None, None, "您没有权限执行此操作"
+    cleaner, _ = LINE_CLEANERS[kind]
+    line, error = cleaner(payload)
+    return kind, line, error
+
+
+def _ack(batch_no, entries, errors):
+    """提交一批明细并生成该批的确认信息"""
+    results = post_movements([(kind, line) for _, kind, line in entries]) if entries else []
+    accepted = []
+    for (line_no, _, _), result in zip(entries, results):
+        if "error" in result:
+            errors.append({"line": line_no, "message": result["error"]})
+        else:
+            accepted.append({
+                "line": line_no,
+                "id": result["record"].id,
+                "bill_no": result["record"].bill_no,
+                "current_stock": result["stock"].current_stock,
+            })
+    errors.sort(key=lambda e: e["line"])
+    return {"batch": batch_no, "accepted_count": len(accepted), "rejected_count": len(errors),
+            "accepted": accepted, "rejected": errors}
+
+
+def _stream_movements(request, allowed):
+    batch_size = getattr(settings, "MOVEMENT_STREAM_BATCH_SIZE", DEFAULT_STREAM_BATCH_SIZE)
+    batch_no, total_accepted, total_rejected = 0, 0, 0
+    entries, errors, pending = [], [], 0
+
+    def flush():
+        nonlocal batch_no, total_accepted, total_rejected, entries, errors, pending
+        batch_no += 1
+        ack = _ack(batch_no, entries, errors)
+        total_accepted += ack["accepted_count"]
+        total_rejected += ack["rejected_count"]
+        entries, errors, pending = [], [], 0
+        return json.dumps(ack, ensure_ascii=False) + "\n"
+
+    line_no = 0
+    try:
+        for raw in _iter_request_lines(request):
+            line_no += 1
+            if raw is not None and not raw.strip():
+                continue
+            kind, line, error = _parse_line(raw, allowed)
+            if error:
+                errors.append({"line": line_no, "message": error})
+            else:
+                entries.append((line_no, kind, line))
+            pending += 1
+            if pending >= batch_size:
+                yield flush()
+        if pending:
+            yield flush()
+    except Exception as exc:
+        yield json.dumps({"batch": batch_no + 1, "error": f"批次提交失败: {exc}"}, ensure_ascii=False) + "\n"
+        return
+
+    yield json.dumps({
+        "done": True, "batches": batch_no, "lines": line_no,
+        "accepted_count": total_accepted, "rejected_count": total_rejected,
+    }, ensure_ascii=False) + "\n"
+
+
+@csrf_exempt
+@require_POST
+@require_any_permission('stock_in:create', 'stock_out:create')
+def movement_stream_view(request):
+    """
+    NDJSON 流式出入库导入
+
+    请求体每行一条明细，`type` 为 in/out，其余字段与单条入库/出库创建接口相同。
+    服务端按批（默认 500 行）校验并在各自的事务中批量过账，每提交一批即返回一行确认信息，
+    最后一行为汇总。已确认的批次不会因后续批次失败而回滚。
+    """
+    allowed = {kind: has_permission(request.user, perm) for kind, (_, perm) in LINE_CLEANERS.items()}
+    return StreamingHttpResponse(_stream_movements(request, allowed), content_type="application/x-ndjson")
+
+
+# 方向 -> (显示名称, 类型显示名称, 查看权限)
+HISTORY_DIRECTIONS = {
+    MOVEMENT_IN: ('入库', dict(StockIn.IN_TYPE_CHOICES), 'stock_in:view'),
+    MOVEMENT_OUT: ('出库', dict(StockOut.OUT_TYPE_CHOICES), 'stock_out:view'),
+}
+
+
+def visible_directions(user):
+    """用户有权查看的出入库方向"""
+    return [kind for kind, (_, _, perm) in HISTORY_DIRECTIONS.items() if has_permission(user, perm)]
+
+
+def history_item(row):
+    """出入库历史的一行（history.movement_history 的返回项）转为接口数据"""
+    direction_display, type_display, _ = HISTORY_DIRECTIONS[row["direction"]]
+    return {
+        "direction": row["direction"],
+        "direction_display": direction_display,
+        "id": row["id"],
+        "bill_no": row["bill_no"],
+        "time": row["moved_at"].strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "type": row["movement_type"],
+        "type_display": type_display.get(row["movement_type"], row["movement_type"]),
+        "quantity": row["quantity"],
+        "value": str(row["value"]),
+        "supplier": row["supplier"],
+        "operator": row["operator"],
+        "remark": row["remark"],
+    }
+
+
+@csrf_exempt
+@require_GET
+@require_any_permission('stock_in:view', 'stock_out:view')
+def movement_history_view(request):
+    """
+    物料出入库历史（入库、出库按业务时间倒序合并）
+
+    material_code 必填；可选 direction（in/out）、type（入库/出库类型）、operator（精确匹配）、
+    start_time / end_time（ISO 时间，含两端）。按游标分页：cursor 为上一页返回的 next_cursor，
+    limit 默认 50、最大 200。只有入库或出库查看权限之一时只返回有权查看的一侧。
+    """
+    material_code = request.GET.get("material_code", "").strip()
+    if not material_code:
+        return json_error("物料编号不能为空", 400)
+    stock = Stock.objects.filter(material_code=material_code).values('pk', 'material_name').first()
+    if stock is None:
+        return json_error("物料不存在", 404)
+
+    direction = request.GET.get("direction", "").strip()
+    if direction and direction not in HISTORY_DIRECTIONS:
+        return json_error("direction 必须是 in 或 out", 400)
+    directions = [kind for kind in visible_directions(request.user) if not direction or kind == direction]
+    try:
+        limit = min(max(int(request.GET.get("limit", 50)), 1), HISTORY_MAX_LIMIT)
+    except ValueError:
+        return json_error("limit 需要是整数", 400)
+    times = {}
+    for key in ("start_time", "end_time"):
+        value = request.GET.get(key)
+        times[key] = parse_aware_datetime(value) if value else None
+        if value and times[key] is None:
+            return json_error(f"{key} 需要是 ISO 格式时间", 400)
+
+    try:
+        rows, next_cursor = movement_history(
+            stock["pk"], directions=directions, movement_type=request.GET.get("type", "").strip(),
+            operator=request.GET.get("operator", "").strip(), start=times["start_time"], end=times["end_time"],
+            cursor=request.GET.get("cursor") or None, limit=limit,
+        )
+    except ValueError as exc:
+        return json_error(str(exc), 400)
+
+    return json_response(data={
+        "material_code": material_code,
+        "material_name": stock["material_name"],
+        "list": [history_item(row) for row in rows],
+        "next_cursor": next_cursor,
+    })
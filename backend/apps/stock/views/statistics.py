@@ -1,14 +1,20 @@
 """
 统计分析视图
 """
+from collections import defaultdict
+from functools import partial
+
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_GET
 from django.db.models import Sum, Count
 from django.db.models.functions import TruncDate
 from django.utils import timezone
 
-from ..models import Stock, StockIn, StockOut, StockWarning
-from ..utils import json_response
+from ..archive import archived_daily_totals, archived_material_totals
+from ..closing import cached_period_report, month_range
+from ..models import ClosedPeriod, Stock, StockIn, StockOut, StockWarning
+from ..sharding import with_exact_balance
+from ..utils import day_range, json_response
 from apps.accounts.permissions import require_permission
 
 
@@ -17,38 +23,26 @@ from apps.accounts.permissions import require_permission
 @require_permission('statistics:view')
 def statistics_overview_view(request):
     """统计概览"""
-    active_stocks = Stock.objects.filter(status='active')
+    active_stocks = with_exact_balance(Stock.objects.filter(status='active'))
     stock_stats = active_stocks.aggregate(
         total_count=Count('id'),
-        total_value=Sum('stock_value'),
-        total_qty=Sum('current_stock'),
+        total_value=Sum('exact_value'),
+        total_qty=Sum('exact_stock'),
+    )
+
+    # 库存状态分布：按库存表上持久化的库存状态分组计数
+    distribution = dict(
+        Stock.objects.filter(status='active').values_list('stock_status').annotate(count=Count('id')).order_by()
     )
+    stock_stats['status_distribution'] = {key: distribution.get(key, 0) for key in ('low', 'normal', 'high')}
 
-    # 计算库存状态分布
-    low_count = 0
-    normal_count = 0
-    high_count = 0
-    for s in active_stocks:
-        if s.current_stock < s.min_stock:
-            low_count += 1
-        elif s.current_stock > s.max_stock:
-            high_count += 1
-        else:
-            normal_count += 1
-
-    stock_stats['status_distribution'] = {
-        'low': low_count,
-        'normal': normal_count,
-        'high': high_count
-    }
-
-    today = timezone.now().date()
-    today_in = StockIn.objects.filter(in_time__date=today).aggregate(
+    today_start, today_end = day_range(timezone.localdate())
+    today_in = StockIn.objects.filter(in_time__gte=today_start, in_time__lt=today_end).aggregate(
         count=Count('id'),
         qty=Sum('in_quantity'),
         value=Sum('in_value'),
     )
-    today_out = StockOut.objects.filter(out_time__date=today).aggregate(
+    today_out = StockOut.objects.filter(out_time__gte=today_start, out_time__lt=today_end).aggregate(
         count=Count('id'),
         qty=Sum('out_quantity'),
         value=Sum('out_value'),
@@ -66,20 +60,65 @@ def statistics_overview_view(request):
 @require_GET
 @require_permission('statistics:view')
 def statistics_trend_view(request):
-    """出入库趋势"""
+    """
+    出入库趋势
+
+    已结账月份的每日汇总按月永久缓存，其余日期实时统计。
+    """
     days = int(request.GET.get("days", 7))
     end_date = timezone.now().date()
     start_date = end_date - timezone.timedelta(days=days - 1)
+    window_start = day_range(start_date)[0]
+
+    # 结账按月份顺序进行，窗口内的已结账月份是连续的一段
+    periods = list(
+        ClosedPeriod.objects.filter(month__gte=start_date.replace(day=1), status='closed').order_by('month')
+    )
+    if periods:
+        ranges = [(window_start, month_range(periods[0].month)[0]), (month_range(periods[-1].month)[1], None)]
+    else:
+        ranges = [(window_start, None)]
+
+    in_trend, out_trend = _daily_trend(*ranges[0])
+    for period in periods:
+        cached = cached_period_report(period, 'daily_trend', partial(_daily_trend, *month_range(period.month)))
+        in_trend += [item for item in cached[0] if str(item["date"]) >= start_date.isoformat()]
+        out_trend += [item for item in cached[1] if str(item["date"]) >= start_date.isoformat()]
+    if periods:
+        live_in, live_out = _daily_trend(*ranges[1])
+        in_trend += live_in
+        out_trend += live_out
 
-    in_trend = list(StockIn.objects.filter(in_time__date__gte=start_date).annotate(
+    return json_response(data={"in_trend": in_trend, "out_trend": out_trend})
+
+
+def _daily_trend(start, end=None):
+    """[start, end) 内每日的入库、出库汇总，end 为空表示不限"""
+    if end is not None and end <= start:
+        return [], []
+    stock_ins = StockIn.objects.filter(in_time__gte=start)
+    stock_outs = StockOut.objects.filter(out_time__gte=start)
+    if end is not None:
+        stock_ins = stock_ins.filter(in_time__lt=end)
+        stock_outs = stock_outs.filter(out_time__lt=end)
+
+    in_trend = list(stock_ins.annotate(
         date=TruncDate('in_time')).values('date').annotate(
         qty=Sum('in_quantity'), value=Sum('in_value')).order_by('date'))
 
-    out_trend = list(StockOut.objects.filter(out_time__date__gte=start_date).annotate(
+    out_trend = list(stock_outs.annotate(
         date=TruncDate('out_time')).values('date').annotate(
         qty=Sum('out_quantity'), value=Sum('out_value')).order_by('date'))
+    return _with_archived_days(in_trend, 'in', start, end), _with_archived_days(out_trend, 'out', start, end)
 
-    return json_response(data={"in_trend": in_trend, "out_trend": out_trend})
+
+def _with_archived_days(trend, direction, start, end):
+    """并入已归档记录的每日汇总（归档月份整月移出出入库表，与库中记录的日期不重叠）"""
+    archived = archived_daily_totals(direction, start, end)
+    if not archived:
+        return trend
+    trend = trend + [{'date': day, 'qty': qty, 'value': value} for day, (qty, value) in archived.items()]
+    return sorted(trend, key=lambda item: item['date'])
 
 
 @csrf_exempt
@@ -91,11 +130,22 @@ def statistics_ranking_view(request):
     limit = int(request.GET.get("limit", 10))
 
     if rank_type == "in":
-        ranking = list(StockIn.objects.values('material_code', 'material_name').annotate(
-            total_qty=Sum('in_quantity')).order_by('-total_qty')[:limit])
+        queryset = StockIn.objects.values('material_code', 'material_name').annotate(total_qty=Sum('in_quantity'))
+    else:
+        queryset = StockOut.objects.values('material_code', 'material_name').annotate(total_qty=Sum('out_quantity'))
+
+    # 有已归档记录时合并归档汇总后再排序
+    archived = archived_material_totals("in" if rank_type == "in" else "out")
+    if archived:
+        totals = defaultdict(int, archived)
+        for item in queryset:
+            totals[(item['material_code'], item['material_name'])] += item['total_qty']
+        ranking = [
+            {'material_code': code, 'material_name': name, 'total_qty': total_qty}
+            for (code, name), total_qty in sorted(totals.items(), key=lambda pair: -pair[1])[:limit]
+        ]
     else:
-        ranking = list(StockOut.objects.values('material_code', 'material_name').annotate(
-            total_qty=Sum('out_quantity')).order_by('-total_qty')[:limit])
+        ranking = list(queryset.order_by('-total_qty')[:limit])
 
     for idx, item in enumerate(ranking, 1):
         item['rank'] = idx
@@ -108,9 +158,9 @@ def statistics_ranking_view(request):
 @require_permission('statistics:view')
 def statistics_category_view(request):
     """分类统计"""
-    stats = list(Stock.objects.filter(status='active').values('category').annotate(
+    stats = list(with_exact_balance(Stock.objects.filter(status='active')).values('category').annotate(
         count=Count('id'),
-        total_qty=Sum('current_stock'),
-        total_value=Sum('stock_value'),
+        total_qty=Sum('exact_stock'),
+        total_value=Sum('exact_value'),
     ).order_by('-total_value'))
     return json_response(data=stats)
@@ -1,20 +1,29 @@
 """
 库存核心管理视图
 """
+from datetime import timezone as dt_timezone
 from decimal import Decimal
 
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 from django.db.models import Q
-from django.core.paginator import Paginator
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
-from ..models import Stock
+from ..autocomplete import AUTOCOMPLETE_MAX_LIMIT, autocomplete_materials
+from ..checkpoints import balances_as_of
+from ..history import movement_history
+from ..ledger import daily_net_quantities
+from ..models import Stock, StockLedger, StockLedgerPending, StockWarning
+from ..pagination import paginate
+from ..search import fuzzy_search
+from ..sharding import with_exact_balance
 from ..utils import (
-    json_response, json_error, parse_json_body,
-    get_stock_status, STOCK_STATUS_DISPLAY
+    json_response, json_error, parse_json_body, parse_aware_datetime,
+    get_stock_status, STOCK_STATUS_DISPLAY, WARNING_TYPE_DISPLAY, LEVEL_DISPLAY
 )
-from apps.accounts.permissions import require_permission
+from .movement import history_item, visible_directions
+from apps.accounts.permissions import require_any_permission, require_permission
 
 
 @csrf_exempt
@@ -43,11 +52,21 @@ def stock_init_view(request):
     if Stock.objects.filter(material_code=material_code).exists():
         return json_error("物料编号已存在", 400)
 
-    stock = Stock.objects.create(
-        material_code=material_code, material_name=material_name, spec=spec,
-        unit=unit, category=category, supplier=supplier,
-        max_stock=max_stock, min_stock=min_stock, stock_value=Decimal(str(stock_value)),
-    )
+    stock_value = Decimal(str(stock_value))
+    with transaction.atomic():
+        stock = Stock.objects.create(
+            material_code=material_code, material_name=material_name, spec=spec,
+            unit=unit, category=category, supplier=supplier,
+            max_stock=max_stock, min_stock=min_stock, stock_value=stock_value,
+            ledger_seq=1 if stock_value else 0,
+        )
+        if stock_value:
+            # 期初价值记入流水账，使结存价值与库存一致
+            StockLedger.objects.create(
+                stock=stock, sequence=1, entry_type='opening', source_type='stock', source_id=stock.pk,
+                quantity=0, value=stock_value, balance_quantity=0, balance_value=stock_value,
+                occurred_at=stock.created_at,
+            )
 
     return json_response(
         data={
@@ -61,11 +80,22 @@ def stock_init_view(request):
     )
 
 
+# 库存列表可用的排序字段，加 "-" 前缀为倒序
+STOCK_LIST_ORDERINGS = ('created_at', 'material_code', 'current_stock', 'stock_status')
+
+
 @csrf_exempt
 @require_GET
 @require_permission('stock_query:view')
 def stock_list_view(request):
-    """库存列表"""
+    """
+    库存列表
+
+    stock_status（low / normal / high）按库存表上持久化的库存状态在数据库中过滤，
+    total 为过滤后的总数；ordering 为 STOCK_LIST_ORDERINGS 之一，默认按创建时间倒序。
+    带 cursor 参数（首页传空串）时按同一排序键集分页，返回 next_cursor，默认不统计总数；
+    count 为总数的计数方式（none / estimate / exact，见 pagination.count_rows），total_exact 标明是否精确。
+    """
     page = int(request.GET.get("page", 1))
     page_size = int(request.GET.get("page_size", 10))
     search = request.GET.get("search", "").strip()
@@ -73,25 +103,43 @@ def stock_list_view(request):
     category = request.GET.get("category", "").strip()
     status = request.GET.get("status", "").strip()
     stock_status = request.GET.get("stock_status", "").strip()
+    ordering = request.GET.get("ordering", "-created_at").strip()
+    if stock_status and stock_status not in STOCK_STATUS_DISPLAY:
+        return json_error(f"stock_status 只能是 {'/'.join(STOCK_STATUS_DISPLAY)}", 400)
+    if ordering.lstrip('-') not in STOCK_LIST_ORDERINGS:
+        return json_error(f"ordering 只能是 {'/'.join(STOCK_LIST_ORDERINGS)}（可加 - 前缀倒序）", 400)
 
-    queryset = Stock.objects.all()
+    cursor = request.GET.get("cursor")
+    queryset, relevance = with_exact_balance(Stock.objects.all()), ()
     if search:
-        queryset = queryset.filter(Q(material_code__icontains=search) | Q(material_name__icontains=search))
+        queryset, relevance = fuzzy_search(queryset, ('material_code', 'material_name'), search)
     if supplier:
         queryset = queryset.filter(supplier__icontains=supplier)
     if category:
         queryset = queryset.filter(category__icontains=category)
     if status:
         queryset = queryset.filter(status=status)
-
-    paginator = Paginator(queryset, page_size)
-    page_obj = paginator.get_page(page)
+    if stock_status:
+        queryset = queryset.filter(stock_status=stock_status)
+    # 库存数量按精确余额（含分片子余额）排序，与返回的 current_stock 一致
+    if ordering.lstrip('-') == 'current_stock':
+        ordering = ordering.replace('current_stock', 'exact_stock')
+    # 其他字段相同时按创建时间倒序，最后以 id 兜底保证分页顺序稳定
+    order_by = [ordering] if ordering.lstrip('-') == 'created_at' else [ordering, '-created_at']
+    order_by.append('-id' if order_by[-1].startswith('-') else 'id')
+    if cursor is None:
+        # 搜索结果按相似度排在前面（键集分页按原排序）
+        order_by = [*relevance, *order_by]
+    try:
+        page_obj, pagination = paginate(
+            queryset, order_by, page=page, page_size=page_size, cursor=cursor, count=request.GET.get("count"))
+    except ValueError as exc:
+        return json_error(str(exc), 400)
 
     stock_list = []
     for stock in page_obj:
-        s_status = get_stock_status(stock)
-        if stock_status and s_status != stock_status:
-            continue
+        # 分片物料的余额以基础余额 + 分片子余额为准
+        stock.current_stock, stock.stock_value = stock.exact_stock, stock.exact_value
         stock_list.append({
             "id": stock.id,
             "material_code": stock.material_code,
@@ -106,26 +154,52 @@ def stock_list_view(request):
             "unit_price": str(stock.unit_price),
             "stock_value": str(stock.stock_value),
             "status": stock.status,
-            "stock_status": s_status,
-            "stock_status_display": STOCK_STATUS_DISPLAY.get(s_status, '正常'),
+            "version": stock.version,
+            "stock_status": stock.stock_status,
+            "stock_status_display": STOCK_STATUS_DISPLAY.get(stock.stock_status, '正常'),
         })
 
-    return json_response(data={
-        "total": paginator.count,
-        "page": page,
-        "page_size": page_size,
-        "list": stock_list
-    })
+    return json_response(data={**pagination, "list": stock_list})
+
+
+# 库存详情可展开的内容
+DETAIL_EXPANSIONS = ('movements', 'trend', 'warnings')
+# 展开最近出入库记录时的默认/最大条数
+DETAIL_MOVEMENTS_DEFAULT = 10
+DETAIL_MOVEMENTS_MAX = 50
+# 趋势数据可选的天数
+DETAIL_TREND_DAYS = (30, 90)
 
 
 @csrf_exempt
 @require_GET
 @require_permission('stock_query:view')
 def stock_detail_view(request, pk):
-    """库存详情"""
-    stock = get_object_or_404(Stock, pk=pk)
+    """
+    库存详情
+
+    expand 为逗号分隔的展开项，每项固定一条索引查询，与历史记录多少无关：
+    - movements：最近 movements_limit 条（默认 10，最大 50）出入库记录，格式同出入库历史接口，
+      只含有权查看的一侧
+    - trend：最近 trend_days 天（30 或 90，默认 30）每天的净变动数量（按流水账业务时间）
+    - warnings：未处理的预警
+    """
+    expand = {item.strip() for item in request.GET.get("expand", "").split(",") if item.strip()}
+    if expand - set(DETAIL_EXPANSIONS):
+        return json_error(f"expand 只能包含 {','.join(DETAIL_EXPANSIONS)}", 400)
+    try:
+        movements_limit = min(max(int(request.GET.get("movements_limit", DETAIL_MOVEMENTS_DEFAULT)), 1),
+                              DETAIL_MOVEMENTS_MAX)
+        trend_days = int(request.GET.get("trend_days", DETAIL_TREND_DAYS[0]))
+    except ValueError:
+        return json_error("movements_limit/trend_days 需要是整数", 400)
+    if trend_days not in DETAIL_TREND_DAYS:
+        return json_error(f"trend_days 只能是 {' 或 '.join(map(str, DETAIL_TREND_DAYS))}", 400)
+
+    stock = get_object_or_404(with_exact_balance(Stock.objects.all()), pk=pk)
+    stock.current_stock, stock.stock_value = stock.exact_stock, stock.exact_value
     s_status = get_stock_status(stock)
-    return json_response(data={
+    data = {
         "id": stock.id,
         "material_code": stock.material_code,
         "material_name": stock.material_name,
@@ -139,8 +213,142 @@ def stock_detail_view(request, pk):
         "unit_price": str(stock.unit_price),
         "stock_value": str(stock.stock_value),
         "status": stock.status,
+        "version": stock.version,
         "stock_status": s_status,
         "stock_status_display": STOCK_STATUS_DISPLAY.get(s_status, '正常'),
         "created_at": stock.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
         "updated_at": stock.updated_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+
+    if 'movements' in expand:
+        directions = visible_directions(request.user)
+        rows = movement_history(stock.pk, directions=directions, limit=movements_limit)[0] if directions else []
+        data["recent_movements"] = [history_item(row) for row in rows]
+    if 'trend' in expand:
+        data["trend"] = [
+            {"date": day.isoformat(), "net_quantity": quantity}
+            for day, quantity in daily_net_quantities(stock.pk, trend_days)
+        ]
+    if 'warnings' in expand:
+        data["warnings"] = [{
+            "id": warning.id,
+            "warning_type": warning.warning_type,
+            "warning_type_display": WARNING_TYPE_DISPLAY.get(warning.warning_type, ''),
+            "level": warning.level,
+            "level_display": LEVEL_DISPLAY.get(warning.level, ''),
+            "current_stock": warning.current_stock,
+            "min_stock": warning.min_stock,
+            "max_stock": warning.max_stock,
+            "created_at": warning.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        } for warning in StockWarning.objects.filter(stock=stock, status='pending')]
+    return json_response(data=data)
+
+
+# 流水账单次查询的最大条数
+LEDGER_MAX_LIMIT = 500
+
+
+@csrf_exempt
+@require_GET
+@require_permission('stock_query:view')
+def stock_ledger_view(request, pk):
+    """
+    物料流水账
+
+    按顺序号升序返回 after 之后的分录（基于 (stock, sequence) 索引的范围读取），
+    next_after 为下一页的 after 参数。分片物料快路径暂存、尚未入账的分录计入 pending_count。
+    """
+    stock = get_object_or_404(Stock, pk=pk)
+    try:
+        after = int(request.GET.get("after", 0))
+        limit = min(max(int(request.GET.get("limit", 50)), 1), LEDGER_MAX_LIMIT)
+    except ValueError:
+        return json_error("after/limit 需要是整数", 400)
+
+    entries = list(StockLedger.objects.filter(stock=stock, sequence__gt=after).order_by('sequence')[:limit])
+    return json_response(data={
+        "material_code": stock.material_code,
+        "material_name": stock.material_name,
+        "list": [{
+            "sequence": entry.sequence,
+            "entry_type": entry.entry_type,
+            "entry_type_display": entry.get_entry_type_display(),
+            "source_type": entry.source_type,
+            "source_id": entry.source_id,
+            "bill_no": entry.bill_no,
+            "quantity": entry.quantity,
+            "value": str(entry.value),
+            "balance_quantity": entry.balance_quantity,
+            "balance_value": str(entry.balance_value),
+            "occurred_at": entry.occurred_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "created_at": entry.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        } for entry in entries],
+        "next_after": entries[-1].sequence if len(entries) == limit else None,
+        "pending_count": StockLedgerPending.objects.filter(stock=stock).count(),
     })
+
+
+@csrf_exempt
+@require_GET
+@require_permission('stock_query:view')
+def stock_balance_as_of_view(request):
+    """
+    时点余额
+
+    at（必填，ISO 时间）时点各物料按业务时间的结存，可用 material_code 限定单个物料。
+    从不晚于 at 的最近余额检查点出发，只汇总其后的流水账分录（见 checkpoints.balances_as_of）。
+    """
+    at = parse_aware_datetime(request.GET.get("at", ""))
+    if at is None:
+        return json_error("at 需要是 ISO 格式时间", 400)
+
+    stocks = Stock.objects.all()
+    material_code = request.GET.get("material_code", "").strip()
+    if material_code:
+        stocks = stocks.filter(material_code=material_code)
+        if not stocks.exists():
+            return json_error("物料不存在", 404)
+        stock_ids = list(stocks.values_list('pk', flat=True))
+    else:
+        stock_ids = None
+
+    checkpoint_at, balances = balances_as_of(at, stock_ids=stock_ids)
+    # 时点已建档的物料，以及建档时间晚于时点、但有补录到时点之前的分录的物料
+    stocks = stocks.filter(Q(created_at__lte=at) | Q(pk__in=list(balances))).order_by('material_code')
+    total_quantity = sum(quantity for quantity, _ in balances.values())
+    total_value = sum((value for _, value in balances.values()), Decimal('0'))
+    items = []
+    for stock_id, code, name, unit in stocks.values_list('pk', 'material_code', 'material_name', 'unit'):
+        quantity, value = balances.get(stock_id, (0, Decimal('0')))
+        items.append({
+            "id": stock_id,
+            "material_code": code,
+            "material_name": name,
+            "unit": unit,
+            "quantity": quantity,
+            "value": str(value),
+        })
+    return json_response(data={
+        "at": at.astimezone(dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "checkpoint_at": checkpoint_at.astimezone(dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") if checkpoint_at else None,
+        "total_quantity": total_quantity,
+        "total_value": str(total_value),
+        "list": items,
+    })
+
+
+@csrf_exempt
+@require_GET
+@require_any_permission('stock_in:view', 'stock_out:view', 'stock_query:view')
+def stock_autocomplete_view(request):
+    """
+    物料联想（出入库选择物料）
+
+    q 为关键字，匹配物料编号、名称前缀，名称拼音首字母前缀，以及编号、名称包含 q；
+    limit 默认 10、最大 50。只返回启用的物料，由本进程的内存索引提供（见 apps/stock/autocomplete.py）。
+    """
+    try:
+        limit = min(max(int(request.GET.get("limit", 10)), 1), AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        return json_error("limit 需要是整数", 400)
+    return json_response(data={"list": autocomplete_materials(request.GET.get("q", ""), limit)})
@@ -2,21 +2,23 @@
 盘点管理视图
 """
 from decimal import Decimal
-from datetime import datetime
 
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
-from django.db.models import F
-from django.core.paginator import Paginator
 from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 
-from ..models import Stock, StockIn, StockOut, StockCountTask, StockCountItem
+from ..models import Stock, StockCountTask, StockCountItem
 from ..utils import (
     json_response, json_error, parse_json_body,
-    generate_bill_no, generate_task_no,
+    generate_bill_nos, generate_task_no,
     TASK_STATUS_DISPLAY, DIFF_TYPE_DISPLAY
 )
+from ..idempotency import idempotent
+from ..pagination import paginate
+from ..posting import PostingError, post_stock_in, post_stock_out
+from ..sharding import with_exact_balance
 from apps.accounts.permissions import require_permission
 
 
@@ -34,9 +36,10 @@ def stock_count_task_create_view(request):
     if not created_by:
         return json_error("创建人不能为空", 400)
 
+    task_no = generate_task_no()
     with transaction.atomic():
         task = StockCountTask.objects.create(
-            task_no=generate_task_no(StockCountTask),
+            task_no=task_no,
             created_by=created_by,
             remark=remark,
             status='pending'
@@ -46,9 +49,9 @@ def stock_count_task_create_view(request):
                 task=task, stock=s,
                 material_code=s.material_code,
                 material_name=s.material_name,
-                book_qty=s.current_stock
+                book_qty=s.exact_stock
             )
-            for s in Stock.objects.filter(status='active')
+            for s in with_exact_balance(Stock.objects.filter(status='active'))
         ]
         StockCountItem.objects.bulk_create(items)
 
@@ -62,11 +65,15 @@ def stock_count_task_create_view(request):
     )
 
 
+# 列表排序：创建时间倒序，id 兜底
+TASK_LIST_ORDERING = ('-created_at', '-id')
+
+
 @csrf_exempt
 @require_GET
 @require_permission('stock_count:view')
 def stock_count_task_list_view(request):
-    """盘点任务列表"""
+    """盘点任务列表，带 cursor 参数（首页传空串）时按 (created_at, id) 倒序键集分页"""
     page = int(request.GET.get("page", 1))
     page_size = int(request.GET.get("page_size", 10))
     status = request.GET.get("status", "").strip()
@@ -75,8 +82,12 @@ def stock_count_task_list_view(request):
     if status:
         queryset = queryset.filter(status=status)
 
-    paginator = Paginator(queryset, page_size)
-    page_obj = paginator.get_page(page)
+    try:
+        page_obj, pagination = paginate(
+            queryset, TASK_LIST_ORDERING, page=page, page_size=page_size,
+            cursor=request.GET.get("cursor"), count=request.GET.get("count"))
+    except ValueError as exc:
+        return json_error(str(exc), 400)
 
     task_list = [{
         "id": task.id,
@@ -90,12 +101,7 @@ def stock_count_task_list_view(request):
         "counted_count": task.items.filter(real_qty__isnull=False).count(),
     } for task in page_obj]
 
-    return json_response(data={
-        "total": paginator.count,
-        "page": page,
-        "page_size": page_size,
-        "list": task_list
-    })
+    return json_response(data={**pagination, "list": task_list})
 
 
 @csrf_exempt
@@ -162,7 +168,7 @@ def stock_count_item_submit_view(request):
     item.diff_type = 'gain' if diff_qty > 0 else ('loss' if diff_qty < 0 else 'none')
     item.operator = operator
     item.remark = remark
-    item.operated_at = datetime.now()
+    item.operated_at = timezone.now()
     item.save()
 
     if task.status == 'pending':
@@ -182,6 +188,7 @@ def stock_count_item_submit_view(request):
 @csrf_exempt
 @require_POST
 @require_permission('stock_count:complete')
+@idempotent
 def stock_count_task_complete_view(request, pk):
     """完成盘点"""
     task = get_object_or_404(StockCountTask, pk=pk)
@@ -194,64 +201,50 @@ def stock_count_task_complete_view(request, pk):
     if uncounted > 0:
         return json_error(f"还有 {uncounted} 项未盘点", 400)
 
+    diff_items = list(task.items.exclude(diff_qty=0).select_related('stock'))
+    # 一次性为所有调整单预留连续单据号
+    bill_nos = iter(generate_bill_nos("ADJ", len(diff_items)))
+
     adjust_records = []
-    with transaction.atomic():
-        for item in task.items.all():
-            if item.diff_qty == 0:
-                continue
-            stock = item.stock
-            unit_price = float(stock.unit_price) if stock.unit_price else 0
-            adjust_value = abs(item.diff_qty) * unit_price
-
-            if item.diff_type == 'gain':
-                bill_no = generate_bill_no("ADJ", StockIn)
-                StockIn.objects.create(
-                    bill_no=bill_no, stock=stock,
-                    material_code=item.material_code,
-                    material_name=item.material_name,
-                    in_time=datetime.now(),
-                    in_quantity=abs(item.diff_qty),
-                    in_value=Decimal(str(adjust_value)),
-                    in_type='adjust_gain',
-                    operator=item.operator or task.created_by,
-                    remark=f"盘点任务 {task.task_no} 盘盈调整",
-                )
-                Stock.objects.filter(pk=stock.pk).update(
-                    current_stock=F('current_stock') + abs(item.diff_qty),
-                    stock_value=F('stock_value') + Decimal(str(adjust_value)),
-                )
-                adjust_records.append({
+    try:
+        with transaction.atomic():
+            for item in diff_items:
+                stock = item.stock
+                unit_price = float(stock.unit_price) if stock.unit_price else 0
+                adjust_value = Decimal(str(abs(item.diff_qty) * unit_price))
+                common = {
                     "material_code": item.material_code,
-                    "type": "gain",
-                    "qty": abs(item.diff_qty)
-                })
-
-            elif item.diff_type == 'loss':
-                bill_no = generate_bill_no("ADJ", StockOut)
-                StockOut.objects.create(
-                    bill_no=bill_no, stock=stock,
-                    material_code=item.material_code,
-                    material_name=item.material_name,
-                    out_time=datetime.now(),
-                    out_quantity=abs(item.diff_qty),
-                    out_value=Decimal(str(adjust_value)),
-                    out_type='adjust_loss',
-                    operator=item.operator or task.created_by,
-                    remark=f"盘点任务 {task.task_no} 盘亏调整",
-                )
-                Stock.objects.filter(pk=stock.pk).update(
-                    current_stock=F('current_stock') - abs(item.diff_qty),
-                    stock_value=F('stock_value') - Decimal(str(adjust_value)),
-                )
+                    "operator": item.operator or task.created_by,
+                }
+
+                if item.diff_type == 'gain':
+                    outcome = post_stock_in(dict(
+                        common, in_quantity=abs(item.diff_qty), in_value=adjust_value,
+                        in_type='adjust_gain', in_time=timezone.now(), supplier='',
+                        remark=f"盘点任务 {task.task_no} 盘盈调整",
+                    ), bill_no=next(bill_nos))
+                elif item.diff_type == 'loss':
+                    outcome = post_stock_out(dict(
+                        common, out_quantity=abs(item.diff_qty), out_value=adjust_value,
+                        out_type='adjust_loss', out_time=timezone.now(),
+                        remark=f"盘点任务 {task.task_no} 盘亏调整",
+                    ), bill_no=next(bill_nos))
+                else:
+                    continue
+
+                if "error" in outcome:
+                    raise PostingError(f"物料 {item.material_code} 调整失败：{outcome['error']}", outcome["code"])
                 adjust_records.append({
                     "material_code": item.material_code,
-                    "type": "loss",
+                    "type": item.diff_type,
                     "qty": abs(item.diff_qty)
                 })
 
-        task.status = 'done'
-        task.completed_at = datetime.now()
-        task.save()
+            task.status = 'done'
+            task.completed_at = timezone.now()
+            task.save()
+    except PostingError as exc:
+        return json_error(exc.message, exc.code)
 
     return json_response(
         data={
@@ -1,85 +1,102 @@
 """
 入库管理视图
 """
-from decimal import Decimal
-from datetime import datetime
+from decimal import Decimal, InvalidOperation
 
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET, require_http_methods
-from django.db.models import F, Q
-from django.core.paginator import Paginator
-from django.db import transaction
+from django.db.models import F
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
 
-from ..models import Stock, StockIn
+from ..models import StockIn
 from ..utils import (
-    json_response, json_error, parse_json_body,
-    generate_bill_no, get_stock_status
+    json_response, json_error, parse_json_body, parse_aware_datetime,
+    get_stock_status, parse_datetime_or_now,
+    parse_expected_version, parse_quantity, BATCH_MAX_LINES, VERSION_CONFLICT_MESSAGE
 )
+from ..archive import archived_filter, archived_summaries, paginate_with_archive
+from ..pagination import paginate
+from ..search import fuzzy_search
+from ..closing import closed_period_error
+from ..group_commit import get_group_committer, group_commit_enabled
+from ..idempotency import idempotent
+from ..ledger import posting_movement, reversal_movement, write_ledger_entries
+from ..posting import MOVEMENT_IN, PostingError, change_balance, post_batch, post_stock_in
+from ..triggers import balance_triggers_enabled
 from apps.accounts.permissions import require_permission
 
 
-@csrf_exempt
-@require_POST
-@require_permission('stock_in:create')
-def stock_in_create_view(request):
-    """创建入库记录"""
-    payload = parse_json_body(request)
-    if payload is None:
-        return json_error("请求体需要是 JSON", 400)
+VALID_IN_TYPES = ('purchase', 'production', 'return', 'other', 'adjust_gain')
+
+
+def clean_stock_in_line(payload, defaults=None):
+    """
+    校验并规整一条入库数据
 
-    material_code = (payload.get("material_code") or "").strip()
-    in_quantity = payload.get("in_quantity")
+    defaults 提供批量提交时单据头上的默认值（operator/in_time 等）。
+    返回 (line, error)，校验失败时 line 为 None、error 为错误信息。
+    """
+    defaults = defaults or {}
+
+    def _text(key):
+        value = payload.get(key)
+        if value is None:
+            value = defaults.get(key)
+        return (value or "").strip()
+
+    material_code = _text("material_code")
+    in_quantity = parse_quantity(payload.get("in_quantity"))
     in_value = payload.get("in_value")
-    in_time_str = payload.get("in_time")
-    in_type = (payload.get("in_type") or "purchase").strip()
-    operator = (payload.get("operator") or "").strip()
-    remark = (payload.get("remark") or "").strip()
-    supplier = (payload.get("supplier") or "").strip()
+    in_type = _text("in_type") or "purchase"
 
     if not material_code:
-        return json_error("物料编号不能为空", 400)
+        return None, "物料编号不能为空"
     if in_quantity is None or in_quantity <= 0:
-        return json_error("入库数量必须大于0", 400)
+        return None, "入库数量必须大于0"
     if in_value is None:
-        return json_error("入库价值不能为空", 400)
+        return None, "入库价值不能为空"
+    try:
+        in_value = Decimal(str(in_value))
+    except InvalidOperation:
+        return None, "入库价值格式错误"
+    if in_type not in VALID_IN_TYPES:
+        return None, f"入库类型无效，必须是 {'/'.join(VALID_IN_TYPES)}"
+
+    return {
+        "material_code": material_code,
+        "in_quantity": in_quantity,
+        "in_value": in_value,
+        "in_type": in_type,
+        "in_time": parse_datetime_or_now(payload.get("in_time") or defaults.get("in_time")),
+        "operator": _text("operator"),
+        "remark": _text("remark"),
+        "supplier": _text("supplier"),
+    }, None
 
-    valid_in_types = ('purchase', 'production', 'return', 'other', 'adjust_gain')
-    if in_type not in valid_in_types:
-        return json_error(f"入库类型无效，必须是 {'/'.join(valid_in_types)}", 400)
 
-    stock = get_object_or_404(Stock, material_code=material_code)
+@csrf_exempt
+@require_POST
+@require_permission('stock_in:create')
+@idempotent
+def stock_in_create_view(request):
+    """创建入库记录"""
+    payload = parse_json_body(request)
+    if payload is None:
+        return json_error("请求体需要是 JSON", 400)
 
-    if in_type != 'adjust_gain' and stock.max_stock > 0:
-        if stock.current_stock >= stock.max_stock:
-            return json_error(f"当前库存({stock.current_stock})已达到或超过最大库存量({stock.max_stock})，禁止入库", 400)
-        if stock.current_stock + in_quantity > stock.max_stock:
-            return json_error(f"入库后将超过最大库存量({stock.max_stock})", 400)
+    line, error = clean_stock_in_line(payload)
+    if error:
+        return json_error(error, 400)
 
-    if in_time_str:
-        try:
-            in_time = datetime.fromisoformat(in_time_str.replace("Z", "+00:00"))
-        except ValueError:
-            in_time = datetime.now()
+    if group_commit_enabled(request):
+        outcome = get_group_committer().submit(MOVEMENT_IN, line)
     else:
-        in_time = datetime.now()
-
-    bill_prefix = "ADJ" if in_type == 'adjust_gain' else "IN"
-    bill_no = generate_bill_no(bill_prefix, StockIn)
-
-    with transaction.atomic():
-        stock_in = StockIn.objects.create(
-            bill_no=bill_no, stock=stock, material_code=material_code,
-            material_name=stock.material_name, supplier=supplier or stock.supplier,
-            in_time=in_time, in_quantity=in_quantity, in_value=Decimal(str(in_value)),
-            in_type=in_type, operator=operator, remark=remark,
-        )
-        Stock.objects.filter(pk=stock.pk).update(
-            current_stock=F('current_stock') + in_quantity,
-            stock_value=F('stock_value') + Decimal(str(in_value)),
-        )
+        outcome = post_stock_in(line)
+    if "error" in outcome:
+        return json_error(outcome["error"], outcome["code"])
+    stock_in, stock = outcome["record"], outcome["stock"]
 
-    stock.refresh_from_db()
     stock_status = get_stock_status(stock)
     message = "入库成功"
     if stock_status == 'low':
@@ -102,11 +119,80 @@ def stock_in_create_view(request):
     )
 
 
+@csrf_exempt
+@require_POST
+@require_permission('stock_in:create')
+@idempotent
+def stock_in_batch_create_view(request):
+    """批量入库（整单校验，单事务提交）"""
+    payload = parse_json_body(request)
+    if payload is None:
+        return json_error("请求体需要是 JSON", 400)
+
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        return json_error("入库明细不能为空", 400)
+    if len(items) > BATCH_MAX_LINES:
+        return json_error(f"单次最多提交 {BATCH_MAX_LINES} 行", 400)
+
+    defaults = {key: payload.get(key) for key in ("in_type", "in_time", "operator", "remark", "supplier")}
+    lines, errors = [], []
+    for index, item in enumerate(items):
+        line, error = clean_stock_in_line(item if isinstance(item, dict) else {}, defaults)
+        if error:
+            errors.append({"line": index, "message": error})
+        lines.append(line)
+    if errors:
+        return json_response(data={"errors": errors}, message="入库明细校验失败", code=400)
+
+    outcome = post_batch(MOVEMENT_IN, lines)
+    if "errors" in outcome:
+        return json_response(data={"errors": outcome["errors"]}, message="入库明细校验失败", code=400)
+
+    records = [item["record"] for item in outcome["results"]]
+    result = [
+        {
+            "line": index,
+            "id": item["record"].id,
+            "bill_no": item["record"].bill_no,
+            "material_code": item["record"].material_code,
+            "material_name": item["record"].material_name,
+            "in_quantity": item["record"].in_quantity,
+            "in_value": str(item["record"].in_value),
+            "in_type": item["record"].in_type,
+            "current_stock": item["stock"].current_stock,
+        }
+        for index, item in enumerate(outcome["results"])
+    ]
+
+    return json_response(
+        data={
+            "count": len(records),
+            "total_quantity": sum(r.in_quantity for r in records),
+            "total_value": str(sum((r.in_value for r in records), Decimal('0'))),
+            "list": result,
+        },
+        message=f"批量入库成功，共 {len(records)} 行"
+    )
+
+
+# 列表排序：业务时间倒序，id 兜底
+STOCK_IN_LIST_ORDERING = ('-in_time', '-id')
+
+
 @csrf_exempt
 @require_GET
 @require_permission('stock_in:view')
 def stock_in_list_view(request):
-    """入库列表"""
+    """
+    入库列表
+
+    include_archived=true 时同时列出已归档的记录（排在库中记录之后），需扫描归档文件，仅供审计查询使用；
+    本页取满后归档部分的总数取自汇总行，其他筛选条件下按抽样估算（total_exact 为 false）。
+    count 为总数的计数方式（none / estimate / exact，见 pagination.count_rows），total_exact 标明是否精确；
+    带 cursor 参数（首页传空串）时按 (in_time, id) 倒序键集分页，返回 next_cursor，默认不统计总数；
+    键集分页不能与 include_archived 同时使用。
+    """
     page = int(request.GET.get("page", 1))
     page_size = int(request.GET.get("page_size", 10))
     search = request.GET.get("search", "").strip()
@@ -116,10 +202,14 @@ def stock_in_list_view(request):
     operator = request.GET.get("operator", "").strip()
     start_time = request.GET.get("start_time")
     end_time = request.GET.get("end_time")
+    include_archived = request.GET.get("include_archived", "").lower() == 'true'
+    cursor = request.GET.get("cursor")
+    if include_archived and cursor is not None:
+        return json_error("include_archived 模式不支持游标分页", 400)
 
-    queryset = StockIn.objects.all()
+    queryset, relevance = StockIn.objects.all(), ()
     if search:
-        queryset = queryset.filter(Q(material_code__icontains=search) | Q(material_name__icontains=search))
+        queryset, relevance = fuzzy_search(queryset, ('material_code', 'material_name'), search)
     if in_type:
         queryset = queryset.filter(in_type=in_type)
     if supplier:
@@ -133,8 +223,25 @@ def stock_in_list_view(request):
     if end_time:
         queryset = queryset.filter(in_time__lte=end_time)
 
-    paginator = Paginator(queryset, page_size)
-    page_obj = paginator.get_page(page)
+    if include_archived:
+        start, end = parse_aware_datetime(start_time), parse_aware_datetime(end_time)
+        matches = archived_filter(
+            'in_time', search, exact={"in_type": in_type},
+            contains={"supplier": supplier, "bill_no": bill_no, "operator": operator}, start=start, end=end,
+        )
+        # 只按物料、整日时间范围筛选时，归档部分的总数可取自汇总行
+        summaries = None if in_type or supplier or bill_no or operator else archived_summaries('in', search, start, end)
+        total, total_exact, page_obj = paginate_with_archive(
+            queryset.order_by(*STOCK_IN_LIST_ORDERING), 'in', matches, start, end, page, page_size, summaries)
+        pagination = {"total": total, "total_exact": total_exact, "page": page, "page_size": page_size}
+    else:
+        try:
+            # 搜索结果按相似度排在前面（键集分页按原排序）
+            ordering = STOCK_IN_LIST_ORDERING if cursor is not None else (*relevance, *STOCK_IN_LIST_ORDERING)
+            page_obj, pagination = paginate(
+                queryset, ordering, page=page, page_size=page_size, cursor=cursor, count=request.GET.get("count"))
+        except ValueError as exc:
+            return json_error(str(exc), 400)
 
     stock_in_list = [{
         "id": item.id,
@@ -148,14 +255,11 @@ def stock_in_list_view(request):
         "in_type": item.in_type,
         "in_type_display": dict(StockIn.IN_TYPE_CHOICES).get(item.in_type, '其他入库'),
         "operator": item.operator,
+        "version": item.version,
+        "archived": getattr(item, 'archived', False),
     } for item in page_obj]
 
-    return json_response(data={
-        "total": paginator.count,
-        "page": page,
-        "page_size": page_size,
-        "list": stock_in_list
-    })
+    return json_response(data={**pagination, "list": stock_in_list})
 
 
 @csrf_exempt
@@ -176,6 +280,7 @@ def stock_in_detail_view(request, pk):
         "in_type": stock_in.in_type,
         "in_type_display": dict(StockIn.IN_TYPE_CHOICES).get(stock_in.in_type, '其他入库'),
         "operator": stock_in.operator,
+        "version": stock_in.version,
         "remark": stock_in.remark,
         "created_at": stock_in.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
     })
@@ -185,12 +290,21 @@ def stock_in_detail_view(request, pk):
 @require_http_methods(["PUT"])
 @require_permission('stock_in:update')
 def stock_in_update_view(request, pk):
-    """编辑入库记录"""
+    """
+    编辑入库记录
+
+    请求体可带 version（详情/列表返回的版本号）；记录在此之后被他人修改或撤销时返回 409。
+    """
     payload = parse_json_body(request)
     if payload is None:
         return json_error("请求体需要是 JSON", 400)
 
     stock_in = get_object_or_404(StockIn, pk=pk)
+    expected_version = parse_expected_version(payload.get("version"), stock_in.version)
+    if expected_version is None:
+        return json_error("版本号格式错误", 400)
+    if expected_version != stock_in.version:
+        return json_error(VERSION_CONFLICT_MESSAGE, 409)
     old_quantity = stock_in.in_quantity
     old_value = stock_in.in_value
 
@@ -203,41 +317,57 @@ def stock_in_update_view(request, pk):
 
     quantity_diff = 0
     value_diff = Decimal('0')
+    changes = {}
 
     if new_quantity is not None and new_quantity != old_quantity:
         if new_quantity <= 0:
             return json_error("入库数量必须大于0", 400)
         quantity_diff = new_quantity - old_quantity
-        stock_in.in_quantity = new_quantity
+        changes["in_quantity"] = new_quantity
 
     if new_value is not None:
         new_value_decimal = Decimal(str(new_value))
         value_diff = new_value_decimal - old_value
-        stock_in.in_value = new_value_decimal
+        changes["in_value"] = new_value_decimal
 
     if in_type is not None:
-        stock_in.in_type = in_type
+        changes["in_type"] = in_type
     if operator is not None:
-        stock_in.operator = operator
+        changes["operator"] = operator
     if remark is not None:
-        stock_in.remark = remark
+        changes["remark"] = remark
     if supplier is not None:
-        stock_in.supplier = supplier
-
-    stock = stock_in.stock
-    if quantity_diff < 0 and stock.current_stock + quantity_diff < 0:
-        return json_error("修改后库存将变为负数", 400)
-
-    with transaction.atomic():
-        stock_in.save()
-        if quantity_diff != 0 or value_diff != 0:
-            Stock.objects.filter(pk=stock.pk).update(
-                current_stock=F('current_stock') + quantity_diff,
-                stock_value=F('stock_value') + value_diff,
-            )
+        changes["supplier"] = supplier
+
+    try:
+        with transaction.atomic():
+            error = closed_period_error([stock_in.in_time])
+            if error:
+                raise PostingError(error, 400)
+            # 比较并交换：版本号未变才写入，并发的另一次修改会在这里失败
+            # 带上业务时间，分区表上只访问记录所在分区
+            try:
+                updated = StockIn.objects.filter(pk=pk, in_time=stock_in.in_time, version=expected_version).update(
+                    version=F('version') + 1, **changes)
+            except IntegrityError:
+                # 触发器维护余额时，余额校验不通过由触发器报错
+                raise PostingError("修改后库存将变为负数", 400)
+            if not updated:
+                raise PostingError(VERSION_CONFLICT_MESSAGE, 409)
+            if (quantity_diff != 0 or value_diff != 0) and not balance_triggers_enabled():
+                stock = change_balance(quantity_diff, value_diff, stock_id=stock_in.stock_id, entry_count=2)
+                if stock is None:
+                    raise PostingError("修改后库存将变为负数", 400)
+                # 流水账中先冲销原记录，再按修改后的数量/价值重新记账
+                reversal = reversal_movement(posting_movement(stock_in))
+                for field, value in changes.items():
+                    setattr(stock_in, field, value)
+                write_ledger_entries(stock, [reversal, posting_movement(stock_in)])
+    except PostingError as exc:
+        return json_error(exc.message, exc.code)
 
     return json_response(
-        data={"id": stock_in.id, "bill_no": stock_in.bill_no},
+        data={"id": stock_in.id, "bill_no": stock_in.bill_no, "version": expected_version + 1},
         message="入库记录更新成功"
     )
 
@@ -246,16 +376,27 @@ def stock_in_update_view(request, pk):
 @require_http_methods(["DELETE"])
 @require_permission('stock_in:delete')
 def stock_in_delete_view(request, pk):
-    """删除入库记录"""
+    """删除入库记录，可通过查询参数 version 指定期望的版本号"""
     stock_in = get_object_or_404(StockIn, pk=pk)
-    stock = stock_in.stock
-    if stock.current_stock < stock_in.in_quantity:
-        return json_error(f"撤销失败：撤销后库存将变为负数", 400)
-
-    with transaction.atomic():
-        Stock.objects.filter(pk=stock_in.stock_id).update(
-            current_stock=F('current_stock') - stock_in.in_quantity,
-            stock_value=F('stock_value') - stock_in.in_value,
-        )
-        stock_in.delete()
+    expected_version = parse_expected_version(request.GET.get("version"), stock_in.version)
+    if expected_version is None:
+        return json_error("版本号格式错误", 400)
+    try:
+        with transaction.atomic():
+            error = closed_period_error([stock_in.in_time])
+            if error:
+                raise PostingError(error, 400)
+            try:
+                deleted = StockIn.objects.filter(pk=pk, in_time=stock_in.in_time, version=expected_version).delete()[0]
+            except IntegrityError:
+                raise PostingError("撤销失败：撤销后库存将变为负数", 400)
+            if not deleted:
+                raise PostingError(VERSION_CONFLICT_MESSAGE, 409)
+            if not balance_triggers_enabled():
+                stock = change_balance(-stock_in.in_quantity, -stock_in.in_value, stock_id=stock_in.stock_id)
+                if stock is None:
+                    raise PostingError("撤销失败：撤销后库存将变为负数", 400)
+                write_ledger_entries(stock, [reversal_movement(posting_movement(stock_in))])
+    except PostingError as exc:
+        return json_error(exc.message, exc.code)
     return json_response(message="撤销成功，库存已扣减")
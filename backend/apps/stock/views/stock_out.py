@@ -1,81 +1,101 @@
 """
 出库管理视图
 """
-from decimal import Decimal
-from datetime import datetime
+from decimal import Decimal, InvalidOperation
 
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET, require_http_methods
-from django.db.models import F, Q
-from django.core.paginator import Paginator
-from django.db import transaction
+from django.db.models import F
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
 
-from ..models import Stock, StockOut
+from ..models import StockOut
 from ..utils import (
-    json_response, json_error, parse_json_body,
-    generate_bill_no, get_stock_status, OUT_TYPE_DISPLAY
+    json_response, json_error, parse_json_body, parse_aware_datetime,
+    get_stock_status, parse_datetime_or_now,
+    parse_expected_version, parse_quantity, BATCH_MAX_LINES, OUT_TYPE_DISPLAY, VERSION_CONFLICT_MESSAGE
 )
+from ..archive import archived_filter, archived_summaries, paginate_with_archive
+from ..pagination import paginate
+from ..search import fuzzy_search
+from ..closing import closed_period_error
+from ..group_commit import get_group_committer, group_commit_enabled
+from ..idempotency import idempotent
+from ..ledger import posting_movement, reversal_movement, write_ledger_entries
+from ..posting import MOVEMENT_OUT, PostingError, change_balance, post_batch, post_stock_out
+from ..triggers import balance_triggers_enabled
 from apps.accounts.permissions import require_permission
 
 
-@csrf_exempt
-@require_POST
-@require_permission('stock_out:create')
-def stock_out_create_view(request):
-    """创建出库记录"""
-    payload = parse_json_body(request)
-    if payload is None:
-        return json_error("请求体需要是 JSON", 400)
+VALID_OUT_TYPES = ('production', 'sales', 'other', 'adjust_loss')
+
+
+def clean_stock_out_line(payload, defaults=None):
+    """
+    校验并规整一条出库数据
+
+    defaults 提供批量提交时单据头上的默认值（operator/out_time 等）。
+    返回 (line, error)，校验失败时 line 为 None、error 为错误信息。
+    """
+    defaults = defaults or {}
 
-    material_code = (payload.get("material_code") or "").strip()
-    out_quantity = payload.get("out_quantity")
+    def _text(key):
+        value = payload.get(key)
+        if value is None:
+            value = defaults.get(key)
+        return (value or "").strip()
+
+    material_code = _text("material_code")
+    out_quantity = parse_quantity(payload.get("out_quantity"))
     out_value = payload.get("out_value")
-    out_type = (payload.get("out_type") or "").strip()
-    out_time_str = payload.get("out_time")
-    operator = (payload.get("operator") or "").strip()
-    remark = (payload.get("remark") or "").strip()
+    out_type = _text("out_type")
 
     if not material_code:
-        return json_error("物料编号不能为空", 400)
+        return None, "物料编号不能为空"
     if out_quantity is None or out_quantity <= 0:
-        return json_error("出库数量必须大于0", 400)
+        return None, "出库数量必须大于0"
     if out_value is None:
-        return json_error("出库价值不能为空", 400)
+        return None, "出库价值不能为空"
+    try:
+        out_value = Decimal(str(out_value))
+    except InvalidOperation:
+        return None, "出库价值格式错误"
+    if out_type not in VALID_OUT_TYPES:
+        return None, "出库类型无效"
+
+    return {
+        "material_code": material_code,
+        "out_quantity": out_quantity,
+        "out_value": out_value,
+        "out_type": out_type,
+        "out_time": parse_datetime_or_now(payload.get("out_time") or defaults.get("out_time")),
+        "operator": _text("operator"),
+        "remark": _text("remark"),
+    }, None
 
-    valid_out_types = ('production', 'sales', 'other', 'adjust_loss')
-    if out_type not in valid_out_types:
-        return json_error(f"出库类型无效", 400)
 
-    stock = get_object_or_404(Stock, material_code=material_code)
+@csrf_exempt
+@require_POST
+@require_permission('stock_out:create')
+@idempotent
+def stock_out_create_view(request):
+    """创建出库记录"""
+    payload = parse_json_body(request)
+    if payload is None:
+        return json_error("请求体需要是 JSON", 400)
 
-    if stock.current_stock < out_quantity:
-        return json_error(f"库存不足，当前库存量为{stock.current_stock}", 400)
+    line, error = clean_stock_out_line(payload)
+    if error:
+        return json_error(error, 400)
 
-    if out_time_str:
-        try:
-            out_time = datetime.fromisoformat(out_time_str.replace("Z", "+00:00"))
-        except ValueError:
-            out_time = datetime.now()
+    if group_commit_enabled(request):
+        outcome = get_group_committer().submit(MOVEMENT_OUT, line)
     else:
-        out_time = datetime.now()
+        outcome = post_stock_out(line)
+    if "error" in outcome:
+        return json_error(outcome["error"], outcome["code"])
+    stock_out, stock = outcome["record"], outcome["stock"]
 
-    bill_prefix = "ADJ" if out_type == 'adjust_loss' else "OUT"
-    bill_no = generate_bill_no(bill_prefix, StockOut)
-
-    with transaction.atomic():
-        stock_out = StockOut.objects.create(
-            bill_no=bill_no, stock=stock, material_code=material_code,
-            material_name=stock.material_name, out_time=out_time,
-            out_quantity=out_quantity, out_value=Decimal(str(out_value)),
-            out_type=out_type, operator=operator, remark=remark,
-        )
-        Stock.objects.filter(pk=stock.pk).update(
-            current_stock=F('current_stock') - out_quantity,
-            stock_value=F('stock_value') - Decimal(str(out_value)),
-        )
-
-    stock.refresh_from_db()
     stock_status = get_stock_status(stock)
     message = "出库成功"
     if stock_status == 'low':
@@ -93,11 +113,80 @@ def stock_out_create_view(request):
     )
 
 
+@csrf_exempt
+@require_POST
+@require_permission('stock_out:create')
+@idempotent
+def stock_out_batch_create_view(request):
+    """批量出库/拣货单（整单校验，全部成功或全部失败）"""
+    payload = parse_json_body(request)
+    if payload is None:
+        return json_error("请求体需要是 JSON", 400)
+
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        return json_error("出库明细不能为空", 400)
+    if len(items) > BATCH_MAX_LINES:
+        return json_error(f"单次最多提交 {BATCH_MAX_LINES} 行", 400)
+
+    defaults = {key: payload.get(key) for key in ("out_type", "out_time", "operator", "remark")}
+    lines, errors = [], []
+    for index, item in enumerate(items):
+        line, error = clean_stock_out_line(item if isinstance(item, dict) else {}, defaults)
+        if error:
+            errors.append({"line": index, "message": error})
+        lines.append(line)
+    if errors:
+        return json_response(data={"errors": errors}, message="出库明细校验失败", code=400)
+
+    outcome = post_batch(MOVEMENT_OUT, lines)
+    if "errors" in outcome:
+        return json_response(data={"errors": outcome["errors"]}, message="出库明细校验失败", code=400)
+
+    records = [item["record"] for item in outcome["results"]]
+    result = [
+        {
+            "line": index,
+            "id": item["record"].id,
+            "bill_no": item["record"].bill_no,
+            "material_code": item["record"].material_code,
+            "material_name": item["record"].material_name,
+            "out_quantity": item["record"].out_quantity,
+            "out_value": str(item["record"].out_value),
+            "out_type": item["record"].out_type,
+            "current_stock": item["stock"].current_stock,
+        }
+        for index, item in enumerate(outcome["results"])
+    ]
+
+    return json_response(
+        data={
+            "count": len(records),
+            "total_quantity": sum(r.out_quantity for r in records),
+            "total_value": str(sum((r.out_value for r in records), Decimal('0'))),
+            "list": result,
+        },
+        message=f"批量出库成功，共 {len(records)} 行"
+    )
+
+
+# 列表排序：业务时间倒序，id 兜底
+STOCK_OUT_LIST_ORDERING = ('-out_time', '-id')
+
+
 @csrf_exempt
 @require_GET
 @require_permission('stock_out:view')
 def stock_out_list_view(request):
-    """出库列表"""
+    """
+    出库列表
+
+    include_archived=true 时同时列出已归档的记录（排在库中记录之后），需扫描归档文件，仅供审计查询使用；
+    本页取满后归档部分的总数取自汇总行，其他筛选条件下按抽样估算（total_exact 为 false）。
+    count 为总数的计数方式（none / estimate / exact，见 pagination.count_rows），total_exact 标明是否精确；
+    带 cursor 参数（首页传空串）时按 (out_time, id) 倒序键集分页，返回 next_cursor，默认不统计总数；
+    键集分页不能与 include_archived 同时使用。
+    """
     page = int(request.GET.get("page", 1))
     page_size = int(request.GET.get("page_size", 10))
     search = request.GET.get("search", "").strip()
@@ -106,12 +195,14 @@ def stock_out_list_view(request):
     operator = request.GET.get("operator", "").strip()
     start_time = request.GET.get("start_time")
     end_time = request.GET.get("end_time")
+    include_archived = request.GET.get("include_archived", "").lower() == 'true'
+    cursor = request.GET.get("cursor")
+    if include_archived and cursor is not None:
+        return json_error("include_archived 模式不支持游标分页", 400)
 
-    queryset = StockOut.objects.all()
+    queryset, relevance = StockOut.objects.all(), ()
     if search:
-        queryset = queryset.filter(
-            Q(material_code__icontains=search) | Q(material_name__icontains=search)
-        )
+        queryset, relevance = fuzzy_search(queryset, ('material_code', 'material_name'), search)
     if out_type:
         queryset = queryset.filter(out_type=out_type)
     if bill_no:
@@ -123,8 +214,25 @@ def stock_out_list_view(request):
     if end_time:
         queryset = queryset.filter(out_time__lte=end_time)
 
-    paginator = Paginator(queryset, page_size)
-    page_obj = paginator.get_page(page)
+    if include_archived:
+        start, end = parse_aware_datetime(start_time), parse_aware_datetime(end_time)
+        matches = archived_filter(
+            'out_time', search, exact={"out_type": out_type},
+            contains={"bill_no": bill_no, "operator": operator}, start=start, end=end,
+        )
+        # 只按物料、整日时间范围筛选时，归档部分的总数可取自汇总行
+        summaries = None if out_type or bill_no or operator else archived_summaries('out', search, start, end)
+        total, total_exact, page_obj = paginate_with_archive(
+            queryset.order_by(*STOCK_OUT_LIST_ORDERING), 'out', matches, start, end, page, page_size, summaries)
+        pagination = {"total": total, "total_exact": total_exact, "page": page, "page_size": page_size}
+    else:
+        try:
+            # 搜索结果按相似度排在前面（键集分页按原排序）
+            ordering = STOCK_OUT_LIST_ORDERING if cursor is not None else (*relevance, *STOCK_OUT_LIST_ORDERING)
+            page_obj, pagination = paginate(
+                queryset, ordering, page=page, page_size=page_size, cursor=cursor, count=request.GET.get("count"))
+        except ValueError as exc:
+            return json_error(str(exc), 400)
 
     stock_out_list = [{
         "id": item.id,
@@ -137,14 +245,11 @@ def stock_out_list_view(request):
         "out_type": item.out_type,
         "out_type_display": OUT_TYPE_DISPLAY.get(item.out_type, item.out_type),
         "operator": item.operator,
+        "version": item.version,
+        "archived": getattr(item, 'archived', False),
     } for item in page_obj]
 
-    return json_response(data={
-        "total": paginator.count,
-        "page": page,
-        "page_size": page_size,
-        "list": stock_out_list
-    })
+    return json_response(data={**pagination, "list": stock_out_list})
 
 
 @csrf_exempt
@@ -164,6 +269,7 @@ def stock_out_detail_view(request, pk):
         "out_type": stock_out.out_type,
         "out_type_display": OUT_TYPE_DISPLAY.get(stock_out.out_type, stock_out.out_type),
         "operator": stock_out.operator,
+        "version": stock_out.version,
         "remark": stock_out.remark,
         "created_at": stock_out.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
     })
@@ -173,12 +279,21 @@ def stock_out_detail_view(request, pk):
 @require_http_methods(["PUT"])
 @require_permission('stock_out:update')
 def stock_out_update_view(request, pk):
-    """编辑出库记录"""
+    """
+    编辑出库记录
+
+    请求体可带 version（详情/列表返回的版本号）；记录在此之后被他人修改或撤销时返回 409。
+    """
     payload = parse_json_body(request)
     if payload is None:
         return json_error("请求体需要是 JSON", 400)
 
     stock_out = get_object_or_404(StockOut, pk=pk)
+    expected_version = parse_expected_version(payload.get("version"), stock_out.version)
+    if expected_version is None:
+        return json_error("版本号格式错误", 400)
+    if expected_version != stock_out.version:
+        return json_error(VERSION_CONFLICT_MESSAGE, 409)
     old_quantity = stock_out.out_quantity
     old_value = stock_out.out_value
 
@@ -190,39 +305,55 @@ def stock_out_update_view(request, pk):
 
     quantity_diff = 0
     value_diff = Decimal('0')
+    changes = {}
 
     if new_quantity is not None and new_quantity != old_quantity:
         if new_quantity <= 0:
             return json_error("出库数量必须大于0", 400)
         quantity_diff = new_quantity - old_quantity
-        stock_out.out_quantity = new_quantity
+        changes["out_quantity"] = new_quantity
 
     if new_value is not None:
         new_value_decimal = Decimal(str(new_value))
         value_diff = new_value_decimal - old_value
-        stock_out.out_value = new_value_decimal
+        changes["out_value"] = new_value_decimal
 
     if out_type is not None:
-        stock_out.out_type = out_type
+        changes["out_type"] = out_type
     if operator is not None:
-        stock_out.operator = operator
+        changes["operator"] = operator
     if remark is not None:
-        stock_out.remark = remark
-
-    stock = stock_out.stock
-    if quantity_diff > 0 and stock.current_stock < quantity_diff:
-        return json_error("库存不足，无法增加出库数量", 400)
-
-    with transaction.atomic():
-        stock_out.save()
-        if quantity_diff != 0 or value_diff != 0:
-            Stock.objects.filter(pk=stock.pk).update(
-                current_stock=F('current_stock') - quantity_diff,
-                stock_value=F('stock_value') - value_diff,
-            )
+        changes["remark"] = remark
+
+    try:
+        with transaction.atomic():
+            error = closed_period_error([stock_out.out_time])
+            if error:
+                raise PostingError(error, 400)
+            # 比较并交换：版本号未变才写入，并发的另一次修改会在这里失败
+            # 带上业务时间，分区表上只访问记录所在分区
+            try:
+                updated = StockOut.objects.filter(pk=pk, out_time=stock_out.out_time, version=expected_version).update(
+                    version=F('version') + 1, **changes)
+            except IntegrityError:
+                # 触发器维护余额时，余额校验不通过由触发器报错
+                raise PostingError("库存不足，无法增加出库数量", 400)
+            if not updated:
+                raise PostingError(VERSION_CONFLICT_MESSAGE, 409)
+            if (quantity_diff != 0 or value_diff != 0) and not balance_triggers_enabled():
+                stock = change_balance(-quantity_diff, -value_diff, stock_id=stock_out.stock_id, entry_count=2)
+                if stock is None:
+                    raise PostingError("库存不足，无法增加出库数量", 400)
+                # 流水账中先冲销原记录，再按修改后的数量/价值重新记账
+                reversal = reversal_movement(posting_movement(stock_out))
+                for field, value in changes.items():
+                    setattr(stock_out, field, value)
+                write_ledger_entries(stock, [reversal, posting_movement(stock_out)])
+    except PostingError as exc:
+        return json_error(exc.message, exc.code)
 
     return json_response(
-        data={"id": stock_out.id, "bill_no": stock_out.bill_no},
+        data={"id": stock_out.id, "bill_no": stock_out.bill_no, "version": expected_version + 1},
         message="出库记录更新成功"
     )
 
@@ -231,12 +362,20 @@ def stock_out_update_view(request, pk):
 @require_http_methods(["DELETE"])
 @require_permission('stock_out:delete')
 def stock_out_delete_view(request, pk):
-    """删除出库记录"""
+    """删除出库记录，可通过查询参数 version 指定期望的版本号"""
     stock_out = get_object_or_404(StockOut, pk=pk)
+    expected_version = parse_expected_version(request.GET.get("version"), stock_out.version)
+    if expected_version is None:
+        return json_error("版本号格式错误", 400)
     with transaction.atomic():
-        Stock.objects.filter(pk=stock_out.stock_id).update(
-            current_stock=F('current_stock') + stock_out.out_quantity,
-            stock_value=F('stock_value') + stock_out.out_value,
-        )
-        stock_out.delete()
+        error = closed_period_error([stock_out.out_time])
+        if error:
+            return json_error(error, 400)
+        if not StockOut.objects.filter(pk=pk, out_time=stock_out.out_time, version=expected_version).delete()[0]:
+            return json_error(VERSION_CONFLICT_MESSAGE, 409)
+        stock = None
+        if not balance_triggers_enabled():
+            stock = change_balance(stock_out.out_quantity, stock_out.out_value, stock_id=stock_out.stock_id)
+        if stock is not None:
+            write_ledger_entries(stock, [reversal_movement(posting_movement(stock_out))])
     return json_response(message="撤销成功，库存已恢复")
@@ -4,21 +4,26 @@
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST, require_GET
 from django.db.models import Q
-from django.core.paginator import Paginator
 
-from ..models import Stock, StockWarning
+from ..models import Stock, StockWarning, classify_stock_status
+from ..pagination import paginate
 from ..utils import (
-    json_response, parse_json_body,
+    json_response, json_error, parse_json_body,
     WARNING_TYPE_DISPLAY, LEVEL_DISPLAY
 )
+from ..sharding import with_exact_balance
 from apps.accounts.permissions import require_permission
 
 
+# 列表排序：创建时间倒序，id 兜底
+WARNING_LIST_ORDERING = ('-created_at', '-id')
+
+
 @csrf_exempt
 @require_GET
 @require_permission('stock_warning:view')
 def warning_list_view(request):
-    """预警列表"""
+    """预警列表，带 cursor 参数（首页传空串）时按 (created_at, id) 倒序键集分页"""
     page = int(request.GET.get("page", 1))
     page_size = int(request.GET.get("page_size", 10))
     search = request.GET.get("search", "").strip()
@@ -35,8 +40,12 @@ def warning_list_view(request):
     if level:
         queryset = queryset.filter(level=level)
 
-    paginator = Paginator(queryset, page_size)
-    page_obj = paginator.get_page(page)
+    try:
+        page_obj, pagination = paginate(
+            queryset, WARNING_LIST_ORDERING, page=page, page_size=page_size,
+            cursor=request.GET.get("cursor"), count=request.GET.get("count"))
+    except ValueError as exc:
+        return json_error(str(exc), 400)
 
     warning_list = [{
         "id": item.id,
@@ -52,12 +61,7 @@ def warning_list_view(request):
         "created_at": item.created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
     } for item in page_obj]
 
-    return json_response(data={
-        "total": paginator.count,
-        "page": page,
-        "page_size": page_size,
-        "list": warning_list
-    })
+    return json_response(data={**pagination, "list": warning_list})
 
 
 @csrf_exempt
@@ -92,16 +96,14 @@ def warning_check_view(request):
     cleared_warnings = []
 
     # 清理库存已恢复正常的预警记录
+    # 分片物料的精确余额需要加上分片子余额
+    sharded_balances = dict(
+        with_exact_balance(Stock.objects.filter(shard_count__gt=0)).values_list('pk', 'exact_stock')
+    )
     for warning in StockWarning.objects.select_related('stock').all():
         stock = warning.stock
-        is_normal = True
-
-        if warning.warning_type == 'low':
-            if stock.min_stock > 0 and stock.current_stock <= stock.min_stock:
-                is_normal = False
-        elif warning.warning_type == 'high':
-            if stock.max_stock > 0 and stock.current_stock >= stock.max_stock:
-                is_normal = False
+        current_stock = sharded_balances.get(stock.pk, stock.current_stock)
+        is_normal = classify_stock_status(current_stock, stock.min_stock, stock.max_stock) != warning.warning_type
 
         if is_normal:
             cleared_warnings.append({
@@ -112,9 +114,11 @@ def warning_check_view(request):
             warning.delete()
 
     # 检查并创建或更新预警
-    for stock in Stock.objects.filter(status='active'):
+    for stock in with_exact_balance(Stock.objects.filter(status='active')):
+        stock.current_stock = stock.exact_stock
+        stock_status = classify_stock_status(stock.current_stock, stock.min_stock, stock.max_stock)
         # 低库存预警
-        if stock.min_stock > 0 and stock.current_stock <= stock.min_stock:
+        if stock_status == 'low':
             existing = StockWarning.objects.filter(stock=stock, warning_type='low').first()
             level = 'danger' if stock.current_stock == 0 or stock.current_stock < stock.min_stock * 0.5 else 'warning'
             if existing:
@@ -136,7 +140,7 @@ def warning_check_view(request):
                 })
 
         # 高库存预警
-        if stock.max_stock > 0 and stock.current_stock >= stock.max_stock:
+        if stock_status == 'high':
             existing = StockWarning.objects.filter(stock=stock, warning_type='high').first()
             level = 'danger' if stock.current_stock > stock.max_stock * 1.1 else 'warning'
             if existing:
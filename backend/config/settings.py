@@ -83,6 +83,32 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 10,
 }
 
+# 出入库接口 Idempotency-Key 的保留时长（秒）
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+# 出入库组提交：开启后同一进程内短时间窗口内的单行出入库请求合并为一个事务
+GROUP_COMMIT_ENABLED = False
+GROUP_COMMIT_WINDOW_MS = 5
+GROUP_COMMIT_MAX_BATCH = 200
+
+# 触发器维护余额（仅 PostgreSQL）：开启后出入库记录的增删改由数据库触发器更新库存余额并写流水账，
+# 视图只写出入库记录；SQLite 等其他数据库忽略此项（见 apps/stock/triggers.py）
+STOCK_BALANCE_TRIGGERS = False
+
+# NDJSON 流式出入库导入每批提交的行数
+MOVEMENT_STREAM_BATCH_SIZE = 500
+
+# 列表总数 count=estimate：有过滤条件时计数的缓存时长（秒）；无过滤条件时规划器估计值低于该行数则精确计数
+LIST_COUNT_CACHE_SECONDS = 30
+LIST_COUNT_ESTIMATE_MIN_ROWS = 10000
+
+# 物料联想：每个进程内存索引收录的物料上限（超出的物料回退到数据库查询）、同步其他进程修改的间隔（秒）
+MATERIAL_AUTOCOMPLETE_MAX_ENTRIES = 100000
+MATERIAL_AUTOCOMPLETE_REFRESH_SECONDS = 60
+
+# 出入库记录冷归档文件目录（manage.py archive_movements）
+STOCK_ARCHIVE_DIR = BASE_DIR / "archive"
+
 LANGUAGE_CODE = "zh-hans"
 
 TIME_ZONE = "Asia/Shanghai"